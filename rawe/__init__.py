@@ -19,7 +19,11 @@ import models
 import sim
 import collocation
 import telemetry
+import batch
+import montecarlo
 
 from rtIntegrator import RtIntegrator,RtIntegratorOptions
 from ocp import Ocp,Mhe,Mpc,OcpRT,MheRT,MpcRT,OcpExportOptions
 from dae import Dae
+from batch import BatchExport
+from montecarlo import MonteCarlo
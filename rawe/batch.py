@@ -0,0 +1,133 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import multiprocessing
+from multiprocessing import Process
+
+from utils import codegen
+from rtIntegrator import RtIntegrator
+
+def _fingerprintable(constructor, args, kwargs):
+    '''
+    True if every dae/ocp argument (and the integrator measurements) can be fingerprinted,
+    so that an export done in a child process is found in the build cache afterwards.
+    This is cheap, it doesn't do any of the expensive symbolics.
+    '''
+    values = list(args) + kwargs.values()
+    for value in values:
+        if hasattr(value, 'fingerprint') and value.fingerprint() is None:
+            return False
+    measurements = [kwargs.get('measurements'), kwargs.get('integratorMeasurements')]
+    if constructor is RtIntegrator and len(args) > 2:
+        measurements.append(args[2])
+    daes = [getattr(value, 'dae', value) for value in values if hasattr(value, 'fingerprint')]
+    for meas in measurements:
+        if meas is None:
+            continue
+        if not isinstance(meas, list):
+            meas = [meas]
+        for dae in daes:
+            if dae.fingerprintExpressions(meas) is None:
+                return False
+    return True
+
+class BatchExport(object):
+    '''
+    Export and compile several OcpRT/MpcRT/MheRT/RtIntegrator objects in parallel.
+
+    Add each object with the constructor and arguments you would normally use:
+
+        batch = BatchExport()
+        mpc = batch.add(rawe.MpcRT, mpc, lqrDae, ocpOptions=mpcOpts, integratorOptions=intOpts)
+        mhe = batch.add(rawe.MheRT, mhe, ocpOptions=mheOpts, integratorOptions=intOpts)
+        sim = batch.add(rawe.RtIntegrator, dae, ts=0.1, options=intOpts)
+        [mpcRT, mheRT, sim] = batch.run()
+
+    run() constructs every object in a forked process, so phase 1, the symbolics, and make
+    all run concurrently. Each finished export is recorded in the build cache, so the
+    objects are then constructed in this process directly from the cached shared objects.
+    Objects which can't be fingerprinted (e.g. a dae with free parameters) wouldn't be found
+    in the cache, so they are only constructed in this process.
+    '''
+    def __init__(self, numProcesses=None):
+        if numProcesses is None:
+            numProcesses = multiprocessing.cpu_count()
+        assert type(numProcesses) is int and numProcesses > 0, \
+            "numProcesses must be a positive int, got: "+str(numProcesses)
+        self._numProcesses = numProcesses
+        self._jobs = []
+
+    def add(self, constructor, *args, **kwargs):
+        '''
+        Queue constructor(*args, **kwargs) for export. Returns the index of the
+        object in the list returned by run().
+        '''
+        self._jobs.append((constructor, args, kwargs))
+        return len(self._jobs)-1
+
+    def _exportInProcess(self, k):
+        (constructor, args, kwargs) = self._jobs[k]
+        constructor(*args, **kwargs)
+
+    def run(self):
+        '''
+        Export everything in parallel, then return the list of constructed objects.
+        '''
+        forked = [k for (k,(constructor, args, kwargs)) in enumerate(self._jobs)
+                  if _fingerprintable(constructor, args, kwargs)]
+        if len(forked) < len(self._jobs):
+            print 'batch export: '+str(len(self._jobs)-len(forked))+' of '+str(len(self._jobs))+\
+                ' jobs can\'t be fingerprinted, exporting them in this process'
+        numProcesses = min(self._numProcesses, len(forked))
+        if numProcesses > 1:
+            # share the cpus between all the concurrent calls to make,
+            # the build scheduler's token pool makes sure the total never exceeds the cpu count
+            oldMaxMakeJobs = codegen.maxMakeJobs
+            codegen.maxMakeJobs = max(1, multiprocessing.cpu_count() / numProcesses)
+            try:
+                self._exportAll(forked, numProcesses)
+            finally:
+                codegen.maxMakeJobs = oldMaxMakeJobs
+
+        return [constructor(*args, **kwargs) for (constructor, args, kwargs) in self._jobs]
+
+    def _exportAll(self, jobs, numProcesses):
+        waiting = list(jobs)
+        running = {}
+        failed = []
+        while len(waiting) > 0 or len(running) > 0:
+            # start new processes
+            while len(waiting) > 0 and len(running) < numProcesses:
+                k = waiting.pop(0)
+                p = Process(target=self._exportInProcess, args=(k,))
+                p.start()
+                running[k] = p
+
+            # reap finished processes
+            for (k,p) in running.items():
+                if not p.is_alive():
+                    p.join()
+                    if p.exitcode != 0:
+                        failed.append(k)
+                    del running[k]
+            time.sleep(0.05)
+
+        if len(failed) > 0:
+            msgs = [str(k)+': '+str(self._jobs[k][0]) for k in sorted(failed)]
+            raise Exception('batch export failed for jobs:\n'+'\n'.join(msgs)+
+                            '\nsee stdout/stderr above')
@@ -0,0 +1,376 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmarks of the exported integrators and OCP solvers.
+
+    python studies/benchmark.py -o results.json
+    python studies/benchmark.py -o results.json -b baseline.json --models pendulum,carousel
+
+runs every model with every integrator option set in the matrix (and every OCP case with
+every OCP option set), writes the results as json, and if a baseline is given lists
+everything which got slower or less accurate. The exit status is 1 if there were regressions.
+'''
+
+import time
+import json
+import socket
+import platform
+import resource
+import traceback
+import optparse
+import numpy
+
+import casadi as C
+
+import models
+from models import betty_conf
+from dae import Dae
+from ocp import Ocp, OcpRT, OcpExportOptions
+from rtIntegrator import RtIntegrator, RtIntegratorOptions
+from utils import buildscheduler
+
+# how the result files look, bump this if it changes incompatibly
+resultsVersion = 1
+
+def _kiteX0(position):
+    x0 = dict(position)
+    for name in ['e11','e22','e33']:
+        x0[name] = 1.0
+    return x0
+
+# name: (makeDae, ts, x0, u0, p0), anything not in x0/u0/p0 is 0
+# The kite states are a plausible attitude and position, not a trim point. The steps
+# always start from x0, so this is fine for timing.
+benchmarkModels = \
+    {'pendulum':  (lambda: models.pendulum(), 0.02, {'x':0.3}, {}, {'m':0.3}),
+     'pendulum2': (lambda: models.pendulum2(), 0.02, {'x':0.3}, {}, {'m':0.3}),
+     'carousel':  (lambda: models.carousel(betty_conf.makeConf()), 0.02,
+                   _kiteX0({'x':1.2, 'z':-0.1}), {}, {}),
+     'crosswind': (lambda: models.crosswind(betty_conf.makeConf()), 0.02,
+                   _kiteX0({'r_n2b_n_x':30.0, 'r':30.0, 'v_bn_n_y':20.0}), {}, {'w0':10.0}),
+     'crosswind_drag': (lambda: models.crosswind_drag(betty_conf.makeConf()), 0.02,
+                        _kiteX0({'r_n2b_n_x':30.0, 'v_bn_n_y':20.0}), {},
+                        {'r':30.0, 'w0':10.0}),
+     # a plain casadi SXFunction ode, not a rawe Dae, so it can't be exported
+     'free': None}
+
+def _springOcp():
+    dae = Dae()
+    [pos,vel] = dae.addX( ["pos","vel"] )
+    force = dae.addU( "force" )
+    dae.setResidual([dae.ddt('pos') - vel,
+                     dae.ddt('vel') - (force - 3.0*pos - 0.2*vel)])
+    ocp = Ocp(dae, N=50, ts=0.1)
+    ocp.constrain(-10, '<=', ocp['force'], '<=', 10)
+    ocp.minimizeLsq(C.veccat([ocp['pos'],ocp['vel'],ocp['force']]))
+    ocp.minimizeLsqEndTerm(C.veccat([ocp['pos'],ocp['vel']]))
+    return (ocp, {'pos':1.0, 'vel':0.0})
+
+# name: makeOcp, returning (ocp, x0). The bundled models all have parameters,
+# which the OCP export doesn't support, so the OCP cases are their own small problems.
+benchmarkOcps = {'spring': _springOcp}
+
+defaultIntegratorMatrix = \
+    [{'INTEGRATOR_TYPE':integratorType, 'NUM_INTEGRATOR_STEPS':numSteps}
+     for integratorType in ['INT_IRK_GL2','INT_IRK_GL4','INT_IRK_RIIA3']
+     for numSteps in [1,5]]
+
+defaultOcpMatrix = \
+    [{'QP_SOLVER':'QP_QPOASES', 'SPARSE_QP_SOLUTION':condensing, 'HOTSTART_QP':True}
+     for condensing in ['CONDENSING','FULL_CONDENSING','FULL_CONDENSING_N2']]
+
+def latencyStats(seconds):
+    '''
+    summary of a list of timings, all in seconds
+    '''
+    seconds = numpy.array(seconds, dtype=numpy.double)
+    if seconds.size == 0:
+        return {}
+    return {'samples':int(seconds.size),
+            'mean':float(numpy.mean(seconds)),
+            'std':float(numpy.std(seconds)),
+            'min':float(numpy.min(seconds)),
+            'median':float(numpy.median(seconds)),
+            'p90':float(numpy.percentile(seconds, 90)),
+            'p99':float(numpy.percentile(seconds, 99)),
+            'max':float(numpy.max(seconds))}
+
+def _maxRssKb():
+    # peak resident set size (kilobytes on linux) of this process and of the compilers it ran
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def _timedExport(build):
+    # split the time it takes to construct something into code export and compilation
+    numJobs = len(buildscheduler.jobTimes)
+    t0 = time.time()
+    ret = build()
+    total = time.time() - t0
+    jobs = buildscheduler.jobTimes[numJobs:]
+    waitTime = sum([wait for (_, wait, _, _) in jobs])
+    compileTime = sum([seconds for (_, _, seconds, _) in jobs])
+    return (ret, {'exportTime':total - waitTime - compileTime,
+                  'compileTime':compileTime,
+                  'compileWaitTime':waitTime,
+                  'builds':len(jobs)})
+
+def _vector(names, values):
+    return numpy.array([values.get(name, 0.0) for name in names], dtype=numpy.double)
+
+def _optionsName(opts):
+    return ','.join([key+'='+str(opts[key]) for key in sorted(opts.keys())])
+
+def benchmarkIntegrator(dae, ts, options, x0=None, u0=None, p0=None, numSteps=1000):
+    '''
+    Export an RtIntegrator and time numSteps steps, each from (x0,u0,p0) (dicts, missing values are 0).
+    Returns a dictionary with export/compile times, step latencies and memory use.
+    '''
+    (rss0, _) = _maxRssKb()
+    (integrator, ret) = _timedExport(lambda: RtIntegrator(dae, ts, options=options))
+    x0 = _vector(dae.xNames(), x0 or {})
+    u0 = _vector(dae.uNames(), u0 or {})
+    p0 = _vector(dae.pNames(), p0 or {})
+
+    latencies = []
+    for k in range(numSteps):
+        t0 = time.time()
+        integrator.x = x0
+        integrator.u = u0
+        integrator.p = p0
+        integrator.step()
+        latencies.append(time.time() - t0)
+    (rss1, childRss) = _maxRssKb()
+
+    ret['step'] = latencyStats(latencies)
+    ret['finite'] = bool(numpy.all(numpy.isfinite(integrator.x)))
+    ret['instanceBytes'] = int(integrator._instance.nbytes)
+    ret['maxRssKb'] = rss1
+    ret['maxRssIncreaseKb'] = rss1 - rss0
+    ret['compilerMaxRssKb'] = childRss
+    return ret
+
+def benchmarkOcp(ocp, ocpOptions, integratorOptions, x0, numIterations=50):
+    '''
+    Export an OcpRT, start from a forward simulation from x0 (a dict) with zero controls and
+    run numIterations RTI iterations towards the origin with identity weights.
+    Returns a dictionary with export/compile times, preparation/feedback latencies (as measured
+    by the solver), the kkt tolerance and objective after every iteration, and memory use.
+    '''
+    (rss0, _) = _maxRssKb()
+    (ocpRt, ret) = _timedExport(lambda: OcpRT(ocp, ocpOptions=ocpOptions,
+                                              integratorOptions=integratorOptions))
+    ocpRt.S[:,:] = numpy.eye(ocpRt.S.shape[0])
+    ocpRt.SN[:,:] = numpy.eye(ocpRt.SN.shape[0])
+    ocpRt.x[0,:] = _vector(ocp.dae.xNames(), x0)
+    ocpRt.u[:,:] = 0.0
+    ocpRt.initializeNodesByForwardSimulation()
+    if hasattr(ocpRt, 'x0'):
+        ocpRt.x0[:] = ocpRt.x[0,:]
+
+    prepTimes = []
+    fbTimes = []
+    kkts = []
+    objectives = []
+    for k in range(numIterations):
+        ocpRt.preparationStep()
+        ocpRt.feedbackStep()
+        prepTimes.append(ocpRt.preparationTime)
+        fbTimes.append(ocpRt.feedbackTime)
+        kkts.append(float(ocpRt.getKKT()))
+        objectives.append(float(ocpRt.getObjective()))
+    (rss1, childRss) = _maxRssKb()
+
+    ret['preparation'] = latencyStats(prepTimes)
+    ret['feedback'] = latencyStats(fbTimes)
+    ret['kkt'] = kkts
+    ret['objective'] = objectives
+    ret['maxRssKb'] = rss1
+    ret['maxRssIncreaseKb'] = rss1 - rss0
+    ret['compilerMaxRssKb'] = childRss
+    return ret
+
+def _guard(record, run):
+    # one broken configuration shouldn't stop the suite
+    try:
+        record.update(run())
+    except Exception:
+        record['error'] = traceback.format_exc()
+    return record
+
+def runSuite(modelNames=None, integratorMatrix=None, ocpNames=None, ocpMatrix=None,
+             numSteps=1000, numIterations=50):
+    '''
+    Run every model in modelNames (default all benchmarkModels) with every set of
+    RtIntegratorOptions in integratorMatrix (a list of dicts), and every OCP case in
+    ocpNames (default all benchmarkOcps) with every set of OcpExportOptions in ocpMatrix.
+    Returns a json-able dictionary of results. Every record has a unique 'name'.
+    '''
+    if modelNames is None:
+        modelNames = sorted(benchmarkModels.keys())
+    if integratorMatrix is None:
+        integratorMatrix = defaultIntegratorMatrix
+    if ocpNames is None:
+        ocpNames = sorted(benchmarkOcps.keys())
+    if ocpMatrix is None:
+        ocpMatrix = defaultOcpMatrix
+
+    results = {'version':resultsVersion,
+               'meta':{'time':time.time(),
+                       'host':socket.gethostname(),
+                       'platform':platform.platform(),
+                       'python':platform.python_version(),
+                       'numSteps':numSteps,
+                       'numIterations':numIterations},
+               'integrators':[],
+               'ocps':[]}
+
+    for modelName in modelNames:
+        if modelName not in benchmarkModels:
+            raise Exception('unknown model "'+modelName+'", valid models: '+
+                            str(sorted(benchmarkModels.keys())))
+        if benchmarkModels[modelName] is None:
+            results['integrators'].append({'name':modelName, 'model':modelName,
+                                           'skipped':'not a rawe Dae'})
+            continue
+        (makeDae, ts, x0, u0, p0) = benchmarkModels[modelName]
+        dae = makeDae()
+        for opts in integratorMatrix:
+            record = {'name':modelName+'/'+_optionsName(opts), 'model':modelName,
+                      'options':dict(opts)}
+            print 'benchmarking integrator '+record['name']
+            def run():
+                options = RtIntegratorOptions()
+                for key in opts:
+                    options[key] = opts[key]
+                return benchmarkIntegrator(dae, ts, options, x0, u0, p0, numSteps=numSteps)
+            results['integrators'].append(_guard(record, run))
+
+    for ocpName in ocpNames:
+        if ocpName not in benchmarkOcps:
+            raise Exception('unknown ocp "'+ocpName+'", valid ocps: '+
+                            str(sorted(benchmarkOcps.keys())))
+        for opts in ocpMatrix:
+            record = {'name':ocpName+'/'+_optionsName(opts), 'ocp':ocpName,
+                      'options':dict(opts)}
+            print 'benchmarking ocp '+record['name']
+            def run():
+                (ocp, x0) = benchmarkOcps[ocpName]()
+                options = OcpExportOptions()
+                for key in opts:
+                    options[key] = opts[key]
+                return benchmarkOcp(ocp, options, RtIntegratorOptions(), x0,
+                                    numIterations=numIterations)
+            results['ocps'].append(_guard(record, run))
+    return results
+
+def saveResults(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def loadResults(path):
+    with open(path, 'r') as f:
+        results = json.load(f)
+    if results.get('version') != resultsVersion:
+        raise Exception(path+' has results version '+str(results.get('version'))+
+                        ', expected '+str(resultsVersion))
+    return results
+
+# (section, stats, statistic) which count as a regression when they increase
+_latencyMetrics = [('integrators','step','median'), ('integrators','step','p99'),
+                   ('ocps','preparation','median'), ('ocps','preparation','p99'),
+                   ('ocps','feedback','median'), ('ocps','feedback','p99')]
+
+def compareResults(results, baseline, timeTolerance=0.2, accuracyTolerance=1e-6):
+    '''
+    Compare results against baseline results, matching records by name.
+    Latencies more than timeTolerance (relative) slower than the baseline, final kkt values
+    and objectives which got worse by more than accuracyTolerance (relative), and configurations
+    which worked in the baseline but fail now are regressions.
+    Returns a list of (name, metric, baseline value, new value).
+    '''
+    regressions = []
+    for section in ['integrators','ocps']:
+        old = dict([(r['name'], r) for r in baseline.get(section, [])])
+        for record in results.get(section, []):
+            name = record['name']
+            if name not in old or 'error' in old[name] or 'skipped' in old[name]:
+                continue
+            if 'error' in record:
+                regressions.append((name, 'error', None, record['error'].strip().split('\n')[-1]))
+                continue
+            for (sec, stats, stat) in _latencyMetrics:
+                if sec != section:
+                    continue
+                v0 = old[name].get(stats, {}).get(stat)
+                v1 = record.get(stats, {}).get(stat)
+                if v0 is not None and v1 is not None and v1 > v0*(1 + timeTolerance):
+                    regressions.append((name, stats+'.'+stat, v0, v1))
+            if section == 'integrators':
+                if old[name].get('finite') and not record.get('finite'):
+                    regressions.append((name, 'finite', True, False))
+            else:
+                for metric in ['kkt','objective']:
+                    v0 = old[name][metric][-1]
+                    v1 = record[metric][-1]
+                    if not numpy.isfinite(v1) or \
+                            v1 - v0 > accuracyTolerance*max(abs(v0), 1.0):
+                        regressions.append((name, metric, v0, v1))
+    return regressions
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', default='benchmark.json',
+                      help='where to write the results [default: %default]')
+    parser.add_option('-b', '--baseline', default=None,
+                      help='results of an earlier run to compare against')
+    parser.add_option('--models', default=None,
+                      help='comma separated models, valid: '+','.join(sorted(benchmarkModels.keys())))
+    parser.add_option('--ocps', default=None,
+                      help='comma separated ocp cases, valid: '+','.join(sorted(benchmarkOcps.keys())))
+    parser.add_option('--steps', type='int', default=1000,
+                      help='integrator steps per configuration [default: %default]')
+    parser.add_option('--iterations', type='int', default=50,
+                      help='RTI iterations per ocp configuration [default: %default]')
+    parser.add_option('--time-tolerance', type='float', default=0.2,
+                      help='relative slowdown which counts as a regression [default: %default]')
+    (opts, args) = parser.parse_args(argv)
+
+    def split(names):
+        if names is None:
+            return None
+        return [name for name in names.split(',') if name != '']
+    results = runSuite(modelNames=split(opts.models), ocpNames=split(opts.ocps),
+                       numSteps=opts.steps, numIterations=opts.iterations)
+    saveResults(results, opts.output)
+    print 'wrote results to '+opts.output
+
+    failed = [r['name'] for r in results['integrators'] + results['ocps'] if 'error' in r]
+    if len(failed) > 0:
+        print str(len(failed))+' configurations failed: '+', '.join(failed)
+
+    if opts.baseline is None:
+        return 0
+    regressions = compareResults(results, loadResults(opts.baseline),
+                                 timeTolerance=opts.time_tolerance)
+    if len(regressions) == 0:
+        print 'no regressions against '+opts.baseline
+        return 0
+    print str(len(regressions))+' regressions against '+opts.baseline+':'
+    for (name, metric, v0, v1) in regressions:
+        print '    '+name+' '+metric+': '+str(v0)+' -> '+str(v1)
+    return 1
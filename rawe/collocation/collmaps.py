@@ -21,10 +21,42 @@ import casadi as C
 
 from collpoints import mkCollocationPoints
 
+def designVariableIndex(nk,nicp,deg,nx,nz,nu,npar):
+    """
+    Offsets of every design variable in the design vector, which is laid out as
+    [p, (x, z if degIdx > 0) for every (timestep, nicpIdx, degIdx), u after every timestep, xN].
+
+    Returns a dictionary of integer arrays with -1 where a variable isn't defined:
+    'x' (nk+1, nicp, deg+1, nx), 'z' (nk, nicp, deg+1, nz), 'u' (nk, nu), 'p' (npar,),
+    and the total number of design variables 'NV'.
+    """
+    xIdx = -np.ones((nk+1,nicp,deg+1,nx), dtype=int)
+    zIdx = -np.ones((nk,nicp,deg+1,nz), dtype=int)
+    uIdx = -np.ones((nk,nu), dtype=int)
+    pIdx = np.arange(npar)
+
+    # offsets of each (timestep, nicpIdx, degIdx) block relative to the start of its timestep
+    blockSizes = np.array([nx] + [nx+nz]*deg)
+    blockOffsets = np.concatenate(([0], np.cumsum(np.tile(blockSizes, nicp))[:-1]))
+    blockOffsets = blockOffsets.reshape((nicp,deg+1))
+    timestepSize = nicp*np.sum(blockSizes) + nu
+    timestepOffsets = npar + timestepSize*np.arange(nk)
+
+    starts = timestepOffsets[:,None,None] + blockOffsets[None,:,:]
+    xIdx[:nk] = starts[:,:,:,None] + np.arange(nx)
+    zIdx[:,:,1:,:] = starts[:,:,1:,None] + nx + np.arange(nz)
+    uIdx[:,:] = (timestepOffsets + timestepSize - nu)[:,None] + np.arange(nu)
+    NV = npar + nk*timestepSize + nx
+    xIdx[nk,0,0,:] = NV - nx + np.arange(nx)
+    return {'x':xIdx, 'z':zIdx, 'u':uIdx, 'p':pIdx, 'NV':NV}
+
 class ReadOnlyCollMap(object):
     """
     A map of x/z/u/p handling number of timesteps, nicp, and deg.
-    Useful function s are "lookup", "{x,z,u,p}Vec", and "vectorize"
+    Useful function s are "lookup", "lookupGrid", "{x,z,u,p}Vec", and "vectorize"
+
+    All values are kept in one array in design vector order, a lookup is
+    an index into it (see designVariableIndex).
     """
     def __init__(self,ocp,name):
         # grab everything needed from the ocp
@@ -40,40 +72,46 @@ class ReadOnlyCollMap(object):
         assert isinstance(name,str)
         self._name = name
 
-        self._xMap = {}
-        self._zMap = {}
-        self._uMap = {}
-        self._pMap = {}
-        for name in self._xNames:
-            self._xMap[name] = np.resize(np.array([None]),(self._nk+1,self._nicp,self._deg+1))
-        for name in self._zNames:
-            self._zMap[name] = np.resize(np.array([None]),(self._nk,self._nicp,self._deg+1))
-        for name in self._uNames:
-            self._uMap[name] = np.resize(np.array([None]),(self._nk))
-        for name in self._pNames:
-            self._pMap[name] = None
+        self._setupIndex()
+        self._values = np.resize(np.array([None]),self._index['NV'])
+
+    def _setupIndex(self):
+        # name -> column in the index arrays
+        self._xMap = dict([(name,m) for m,name in enumerate(self._xNames)])
+        self._zMap = dict([(name,m) for m,name in enumerate(self._zNames)])
+        self._uMap = dict([(name,m) for m,name in enumerate(self._uNames)])
+        self._pMap = dict([(name,m) for m,name in enumerate(self._pNames)])
+        self._index = designVariableIndex(self._nk,self._nicp,self._deg,
+                                          len(self._xNames),len(self._zNames),
+                                          len(self._uNames),len(self._pNames))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # cached grids are rebuilt when needed
+        state.pop('_grids',None)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if '_index' not in state:
+            # pickled when every name had its own array of values
+            (xMap,zMap,uMap,pMap) = (self._xMap,self._zMap,self._uMap,self._pMap)
+            self._setupIndex()
+            self._values = np.resize(np.array([None]),self._index['NV'])
+            for (kind,oldMap) in [('x',xMap),('z',zMap),('u',uMap)]:
+                for name,vals in oldMap.items():
+                    offsets = self._index[kind][...,getattr(self,'_'+kind+'Map')[name]]
+                    for idx in np.ndindex(offsets.shape):
+                        if offsets[idx] >= 0:
+                            self._values[offsets[idx]] = vals[idx]
+            for name,val in pMap.items():
+                self._values[self._index['p'][self._pMap[name]]] = val
 
     def vectorize(self):
         """
         Return all the variables in one vector
         """
-        V = [self.lookup(name) for name in self._pNames]
-
-        for k in range(self._nk):
-            # Collocated states
-            for i in range(self._nicp):
-                for j in range(self._deg+1):
-                    V.extend([self.lookup(name,timestep=k,nicpIdx=i,degIdx=j) for name in self._xNames])
-
-                    if j !=0:
-                        V.extend([self.lookup(name,timestep=k,nicpIdx=i,degIdx=j) for name in self._zNames])
-
-            # Parametrized controls
-            V.extend([self.lookup(name,timestep=k) for name in self._uNames])
-
-        # State at end time
-        V.extend([self.lookup(name,timestep=self._nk,nicpIdx=0,degIdx=0) for name in self._xNames])
-        return V
+        return [float(val) if type(val) is np.ndarray else val for val in self._values]
 
     def xVec(self,timestep,nicpIdx=None,degIdx=None):
         return C.veccat([self.lookup(name,timestep=timestep,nicpIdx=nicpIdx,degIdx=degIdx) \
@@ -95,7 +133,28 @@ class ReadOnlyCollMap(object):
         else:
             return ret
 
-    def _lookupOrSet(self,name,timestep,nicpIdx,degIdx,setVal=None,quiet=False,force=False):
+    def lookupGrid(self,name):
+        """
+        Every value of one variable at once:
+        a differential state gives a (nk, nicp, deg+1) array (the final state is lookup(name,timestep=-1)),
+        an algebraic variable (nk, nicp, deg) for degIdx 1..deg, a control (nk,), and a parameter its value.
+        """
+        return self._values[self._gridOffsets(name)]
+
+    def _gridOffsets(self,name):
+        assert isinstance(name,str), "lookup key must be a string in "+self._name+" map"
+        if name in self._xMap:
+            return self._index['x'][:self._nk,:,:,self._xMap[name]]
+        elif name in self._zMap:
+            return self._index['z'][:,:,1:,self._zMap[name]]
+        elif name in self._uMap:
+            return self._index['u'][:,self._uMap[name]]
+        elif name in self._pMap:
+            return self._index['p'][self._pMap[name]]
+        else:
+            raise NameError("couldn't find \""+name+"\" in "+self._name+" map")
+
+    def _offset(self,name,timestep,nicpIdx,degIdx):
         assert isinstance(name,str), "lookup key must be a string in "+self._name+" map"
 
         if name in self._xMap:
@@ -107,17 +166,12 @@ class ReadOnlyCollMap(object):
             assert timestep <= self._nk, \
                 "timestep: "+str(timestep)+" out of range in "+self._name+" map (nk: "+str(self._nk)+")"
             assert degIdx >=0 and degIdx < (self._deg+1), \
-                "degIdx: "+str(deg)+" out of range in "+self._name+" map (deg: "+str(self._deg)+")"
+                "degIdx: "+str(degIdx)+" out of range in "+self._name+" map (deg: "+str(self._deg)+")"
             if timestep is self._nk:
                 assert nicpIdx==0 and degIdx==0,"last timestep is only defined at nicpIdx=0,degIdx=0"
-            if setVal is None:
-                return self._xMap[name][timestep][nicpIdx][degIdx]
-            else:
-                oldval = self._xMap[name][timestep][nicpIdx][degIdx]
-                if (not quiet) and (oldval is not None):
-                    print "WARNING: changing \"%s\" %s at timestep %d from %s to %s" % \
-                        (name,self._name,timestep,str(oldval),str(setVal))
-                self._xMap[name][timestep][nicpIdx][degIdx] = setVal
+            offset = int(self._index['x'][timestep,nicpIdx,degIdx,self._xMap[name]])
+            assert offset >= 0, "last timestep is only defined at nicpIdx=0,degIdx=0"
+            return offset
 
         elif name in self._zMap:
             assert timestep is not None, "must give timestep for algebraic state lookup ("+self._name+")"
@@ -126,50 +180,44 @@ class ReadOnlyCollMap(object):
             assert degIdx is not None, "must set degIdx for algebraic state map ("+self._name+")"
             assert degIdx != 0, "algebraic variable ("+self._name+") not defined at degIdx 0"
             assert timestep < self._nk, \
-                "timestep: "+str(timestep)+" out of range in "+self._name+" map (nk: "+str(nk)+")"
+                "timestep: "+str(timestep)+" out of range in "+self._name+" map (nk: "+str(self._nk)+")"
             assert degIdx > 0 and degIdx <= self._deg, \
                 "degIdx: "+str(degIdx)+" out of range in "+self._name+" map (deg: "+str(self._deg)+")"
-            if setVal is None:
-                return self._zMap[name][timestep][nicpIdx][degIdx]
-            else:
-                oldval = self._zMap[name][timestep][nicpIdx][degIdx]
-                if (quiet is False) and (oldval is not None):
-                    print "WARNING: changing \"%s\" %s at timestep %d from %s to %s" % \
-                        (name,self._name,timestep,str(oldval),str(setVal))
-                self._zMap[name][timestep][nicpIdx][degIdx] = setVal
+            return int(self._index['z'][timestep,nicpIdx,degIdx,self._zMap[name]])
 
         elif name in self._uMap:
             assert timestep is not None, "must give timestep for control input lookup ("+self._name+")"
 #            assert nicpIdx is None, "nicpIdx invalid for control input ("+self._name+")"
 #            assert degIdx is None, "degIdx invalid for control input ("+self._name+")"
             assert timestep < self._nk, \
-                   "timestep: "+str(timestep)+" out of range in "+self._name+" map (nk: "+str(nk)+")"
-            if setVal is None:
-                return self._uMap[name][timestep]
-            else:
-                oldval = self._uMap[name][timestep]
-                if (quiet is False) and (oldval is not None):
-                    print "WARNING: changing \"%s\" %s at timestep %d from %s to %s" % \
-                        (name,self._name,timestep,str(oldval),str(setVal))
-                self._uMap[name][timestep] = setVal
+                   "timestep: "+str(timestep)+" out of range in "+self._name+" map (nk: "+str(self._nk)+")"
+            return int(self._index['u'][timestep,self._uMap[name]])
 
         elif name in self._pMap:
 #            assert timestep is None, "timestep invalid for parameter lookup ("+self._name+")"
 #            assert nicpIdx is None, "nicpIdx invalid for parameter lookup ("+self._name+")"
 #            assert degIdx is None, "degIdx invalid for parameter lookup ("+self._name+")"
-            if setVal is None:
-                return self._pMap[name]
-            else:
-                oldval = self._pMap[name]
-                if (force is False) and (oldval is not None):
-                    msg = "can't change \""+name+"\" "+self._name+" once it's set unless " + \
-                        "you use force=True (tried to change "+str(oldval)+" to "+str(setVal)
-                    raise ValueError(msg)
-                self._pMap[name] = setVal
+            return int(self._index['p'][self._pMap[name]])
 
         else:
             raise NameError("couldn't find \""+name+"\" in "+self._name+" map")
 
+    def _lookupOrSet(self,name,timestep,nicpIdx,degIdx,setVal=None,quiet=False,force=False):
+        offset = self._offset(name,timestep,nicpIdx,degIdx)
+        if setVal is None:
+            return self._values[offset]
+
+        oldval = self._values[offset]
+        if name in self._pMap:
+            if (force is False) and (oldval is not None):
+                msg = "can't change \""+name+"\" "+self._name+" once it's set unless " + \
+                    "you use force=True (tried to change "+str(oldval)+" to "+str(setVal)
+                raise ValueError(msg)
+        elif (quiet is False) and (oldval is not None):
+            print "WARNING: changing \"%s\" %s at timestep %d from %s to %s" % \
+                (name,self._name,timestep,str(oldval),str(setVal))
+        self._values[offset] = setVal
+
 
 class WriteableCollMap(ReadOnlyCollMap):
     """
@@ -232,10 +280,17 @@ class VectorizedReadOnlyCollMap(ReadOnlyCollMap):
     returns the original vector instead of concatenating all the individual elements.
     This is
     """
+    _symbolic = False
+
     def __init__(self,ocp,name,vec):
         ReadOnlyCollMap.__init__(self,ocp,name)
         self._devectorize(vec)
 
+    def __setstate__(self,state):
+        ReadOnlyCollMap.__setstate__(self,state)
+        if not self._symbolic and self._values.dtype == object:
+            self._values = np.array([float(val) for val in self._values])
+
     def vectorize(self):
         return self._vec
 
@@ -256,87 +311,86 @@ class VectorizedReadOnlyCollMap(ReadOnlyCollMap):
     def pVec(self):
         return self._pVec
 
+    def lookup(self,name,timestep=None,nicpIdx=None,degIdx=None):
+        offset = self._offset(name,timestep,nicpIdx,degIdx)
+        if not self._symbolic:
+            return float(self._values[offset])
+        # element expressions are made the first time they're looked up,
+        # and reused after that
+        if offset not in self._elements:
+            self._elements[offset] = self._vec[offset]
+        return self._elements[offset]
+
+    def lookupGrid(self,name):
+        assert not self._symbolic, "lookupGrid needs a numeric design vector ("+self._name+")"
+        if not hasattr(self,'_grids'):
+            self._grids = {}
+        if name not in self._grids:
+            # gather every name of the same kind at once so that each grid is contiguous
+            for kind,names in [('x',self._xNames),('z',self._zNames),('u',self._uNames)]:
+                if name in names:
+                    offsets = self._index[kind]
+                    if kind == 'x':
+                        offsets = offsets[:self._nk]
+                    elif kind == 'z':
+                        offsets = offsets[:,:,1:]
+                    grids = self._values[np.ascontiguousarray(np.rollaxis(offsets,-1))]
+                    for m,otherName in enumerate(names):
+                        self._grids[otherName] = grids[m]
+                    break
+            else:
+                return ReadOnlyCollMap.lookupGrid(self,name)
+        return self._grids[name]
+
     def _devectorize(self,V):
         """
-        Take a vector and populate internal _{x,z,u,p}Vec, then
-        look through and call setVal so that lookup() works as normal
+        Take a vector and populate internal _{x,z,u,p}Vec, lookup()
+        indexes straight into the vector
         """
         self._vec = V
         ndiff = len(self._xNames)
         nalg = len(self._zNames)
         nu = len(self._uNames)
         NP = len(self._pNames)
-        nx = ndiff + nalg
-
-        # Total number of variables
-        NXD = self._nicp*self._nk*(self._deg+1)*ndiff # Collocated differential states
-        NXA = self._nicp*self._nk*self._deg*nalg      # Collocated algebraic states
-        NU = self._nk*nu                  # Parametrized controls
-        NXF = ndiff                 # Final state (only the differential states)
-        NV = NXD+NXA+NU+NXF+NP
-
-        def setVal(name,val,timestep=None,nicpIdx=None,degIdx=None):
-            self._lookupOrSet(name,timestep,nicpIdx,degIdx,setVal=val)
-
-        offset = 0
+        NV = self._index['NV']
+
+        self._symbolic = type(V) in [C.MX, C.SXMatrix]
+        if self._symbolic:
+            assert V.size() == NV, \
+                "design vector has "+str(V.size())+" elements, expected "+str(NV)
+            self._values = None
+            self._elements = {}
+        else:
+            self._values = np.array(V,dtype=np.double).flatten()
+            assert self._values.size == NV, \
+                "design vector has "+str(self._values.size)+" elements, expected "+str(NV)
 
         # Get the parameters
-        P = V[offset:offset+NP]
-        for k,name in enumerate(self._pNames):
-#            self._indexMap.setVal(name,k)
-#            self._dvMap.setVal(name,V[offset+k])
-            setVal(name,V[offset+k])
-        offset += NP
+        P = V[0:NP]
 
         # Get collocated states and parametrized control
         XD = np.resize(np.array([],dtype=type(V)),(self._nk+1,self._nicp,self._deg+1)) # NB: same name as above
         XA = np.resize(np.array([],dtype=type(V)),(self._nk,self._nicp,self._deg+1)) # NB: same name as above
         U = np.resize(np.array([],dtype=type(V)),self._nk)
 
+        # every block starts with its differential states
+        starts = self._index['x'][:,:,:,0].tolist()
         for k in range(self._nk):
-            # Collocated states
             for i in range(self._nicp):
                 for j in range(self._deg+1):
-                    # Get the expression for the state vector
+                    offset = starts[k][i][j]
                     XD[k][i][j] = V[offset:offset+ndiff]
-                    for m,name in enumerate(self._xNames):
-#                        self._indexMap.setVal(name,offset+m,timestep=k,nicpIdx=i,degIdx=j)
-#                        self._dvMap.setVal(name,V[offset+m],timestep=k,nicpIdx=i,degIdx=j)
-                        setVal(name,V[offset+m],timestep=k,nicpIdx=i,degIdx=j)
-
                     if j !=0:
                         XA[k][i][j] = V[offset+ndiff:offset+ndiff+nalg]
-                        for m,name in enumerate(self._zNames):
-#                            self._indexMap.setVal(name,offset+ndiff+m,timestep=k,nicpIdx=i,degIdx=j)
-#                            self._dvMap.setVal(name,V[offset+ndiff+m],timestep=k,nicpIdx=i,degIdx=j)
-                            setVal(name,V[offset+ndiff+m],timestep=k,nicpIdx=i,degIdx=j)
-
-                    index = (self._deg+1)*(self._nicp*k+i) + j
-                    if k==0 and j==0 and i==0:
-                        offset += ndiff
-                    else:
-                        if j!=0:
-                            offset += nx
-                        else:
-                            offset += ndiff
 
-            # Parametrized controls
+            # Parametrized controls come right before the next timestep
+            offset = starts[k+1][0][0] - nu
             U[k] = V[offset:offset+nu]
-            for m,name in enumerate(self._uNames):
-#                self._indexMap.setVal(name,offset+m,timestep=k)
-#                self._dvMap.setVal(name,V[offset+m],timestep=k)
-                setVal(name,V[offset+m],timestep=k)
-            offset += nu
 
         # State at end time
+        offset = starts[self._nk][0][0]
         XD[self._nk][0][0] = V[offset:offset+ndiff]
-        for m,name in enumerate(self._xNames):
-#            self._indexMap.setVal(name,offset+m,timestep=self.nk,degIdx=0,nicpIdx=0)
-#            self._dvMap.setVal(name,V[offset+m],timestep=self.nk,degIdx=0,nicpIdx=0)
-            setVal(name,V[offset+m],timestep=self._nk,degIdx=0,nicpIdx=0)
-
-        offset += ndiff
-        assert offset==NV
+        assert offset+ndiff==NV
 
         self._xVec = XD
         self._zVec = XA
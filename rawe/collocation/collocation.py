@@ -213,7 +213,14 @@ class Coll():
         lbx["x",0] = ubx["x",0] = 123
         """
 
-    def setupCollocation(self,tf):
+    def setupCollocation(self,tf,mapped=False):
+        '''
+        Add the collocation and continuity constraints.
+        With mapped=True they are built for all intervals at once: the state derivatives
+        and end states are a few weighted gathers of the design vector, and the dae
+        residual function is applied to every collocation point by one Parallelizer call.
+        This makes a much smaller MX graph for large nk/deg, the constraints are the same.
+        '''
         if self.collocationIsSetup:
             raise ValueError("you can't setup collocation twice")
         self.collocationIsSetup = True
@@ -239,6 +246,16 @@ class Coll():
 
         self._xDot = np.resize(np.array([None]),(self.nk,self.nicp,self.deg+1))
 
+        if mapped:
+            self._setupCollocationMapped(ffcn)
+        else:
+            self._setupCollocationLoops(ffcn)
+
+        # add outputs
+        self._outputMapGenerator = collmaps.OutputMapGenerator(self, self._xDot)
+        self._outputMap = collmaps.OutputMap(self._outputMapGenerator, self._dvMap.vectorize())
+
+    def _setupCollocationLoops(self,ffcn):
         # For all finite elements
         for k in range(self.nk):
             for i in range(self.nicp):
@@ -279,9 +296,72 @@ class Coll():
                 else:
                     self.constrain(self.xVec(k,nicpIdx=i+1,degIdx=0), '==', xf_k, tag=("continuity",(k,i)))
 
-        # add outputs
-        self._outputMapGenerator = collmaps.OutputMapGenerator(self, self._xDot)
-        self._outputMap = collmaps.OutputMap(self._outputMapGenerator, self._dvMap.vectorize())
+    def _setupCollocationMapped(self,ffcn):
+        nk = self.nk
+        nicp = self.nicp
+        deg = self.deg
+        nx = self.xSize()
+        K = nk*nicp # number of finite elements, q = k*nicp + i
+        ldot = self.lagrangePoly.lDotAtTauRoot
+        lAtOne = self.lagrangePoly.lAtOne
+
+        V = self._dvMap.vectorize()
+        index = collmaps.designVariableIndex(nk,nicp,deg,nx,self.zSize(),self.uSize(),self.pSize())
+        def gather(idx):
+            idx = [int(n) for n in np.asarray(idx).flatten()]
+            if len(idx) == 0:
+                return V[0:0]
+            return V[idx]
+
+        # everything at the collocation points is ordered by (q, degIdx, row)
+        xIdx = index['x'][:nk].reshape((K,deg+1,nx))
+        xDot = 0
+        for j2 in range(deg+1):
+            # d/dt of the lagrange polynomial through the states of each element (eq 10.19b)
+            weights = np.tile(np.repeat(ldot[1:,j2], nx), K)
+            xDot += gather(np.repeat(xIdx[:,j2:j2+1,:], deg, axis=1))*CS.DMatrix(weights)
+        xDot = xDot/self.h
+
+        # the dae residual at every collocation point in one call
+        numPoints = K*deg
+        xs = gather(xIdx[:,1:,:])
+        zs = gather(index['z'].reshape((K,deg+1,self.zSize()))[:,1:,:])
+        us = gather(np.repeat(index['u'], nicp*deg, axis=0))
+        p = self.pVec()
+        nz = self.zSize()
+        nu = self.uSize()
+        ffcnMapped = self._makeMappedResidualFun(ffcn, numPoints)
+        args = []
+        for n in range(numPoints):
+            args.extend([xDot[n*nx:(n+1)*nx], xs[n*nx:(n+1)*nx],
+                         zs[n*nz:(n+1)*nz], us[n*nu:(n+1)*nu], p])
+        fs = ffcnMapped.call(args)
+
+        # states at the end of each finite element, and at the start of the next one
+        xf = 0
+        for j in range(deg+1):
+            xf += lAtOne[j]*gather(xIdx[:,j,:])
+        xNext = np.concatenate((xIdx[1:,0,:], index['x'][nk:,0,0,:]))
+        continuity = gather(xNext) - xf
+
+        # same constraints (and order) as the loops
+        for k in range(nk):
+            for i in range(nicp):
+                q = k*nicp + i
+                for j in range(1,deg+1):
+                    point = q*deg + j-1
+                    self._xDot[k,i,j] = xDot[point*nx:(point+1)*nx]
+                    self.constrain(fs[point],'==',0,
+                                   tag=("implicit dynamic equation",(k,i,j)))
+                self.constrain(continuity[q*nx:(q+1)*nx],'==',0,tag=("continuity",(k,i)))
+
+    def _makeMappedResidualFun(self,ffcn,numPoints):
+        # the same residual function at numPoints points, one MX node which references
+        # ffcn instead of numPoints inlined copies of the residual
+        ffcnMapped = CS.Parallelizer([ffcn]*numPoints)
+        ffcnMapped.setOption("parallelization","serial")
+        ffcnMapped.init()
+        return ffcnMapped
 
     def xVec(self,*args,**kwargs):
         return self._dvMap.xVec(*args,**kwargs)
@@ -48,13 +48,11 @@ def make_pps(traj):
     for name in traj.dvMap._xNames:
         # make piecewise poly
         pps[name] = None
+        grid = traj.dvMap.lookupGrid(name)
         for timestepIdx in range(traj.dvMap._nk):
             for nicpIdx in range(traj.dvMap._nicp):
-                ts = []
-                ys = []
-                for degIdx in range(traj.dvMap._deg+1):
-                    ts.append(traj.tgrid[timestepIdx,nicpIdx,degIdx])
-                    ys.append([traj.dvMap.lookup(name,timestep=timestepIdx,nicpIdx=nicpIdx,degIdx=degIdx)])
+                ts = traj.tgrid[timestepIdx,nicpIdx,:]
+                ys = grid[timestepIdx,nicpIdx,:,numpy.newaxis]
                 if pps[name] is None:
                     pps[name] = PiecewisePolynomial(ts,ys)
                 else:
@@ -65,13 +63,11 @@ def make_pps(traj):
     for name in traj.dvMap._zNames:
         # make piecewise poly
         pps[name] = None
+        grid = traj.dvMap.lookupGrid(name)
         for timestepIdx in range(traj.dvMap._nk):
             for nicpIdx in range(traj.dvMap._nicp):
-                ts = []
-                ys = []
-                for degIdx in range(1,traj.dvMap._deg+1):
-                    ts.append(traj.tgrid[timestepIdx,nicpIdx,degIdx])
-                    ys.append([traj.dvMap.lookup(name,timestep=timestepIdx,nicpIdx=nicpIdx,degIdx=degIdx)])
+                ts = traj.tgrid[timestepIdx,nicpIdx,1:]
+                ys = grid[timestepIdx,nicpIdx,:,numpy.newaxis]
                 if pps[name] is None:
                     pps[name] = PiecewisePolynomial(ts,ys)
                 else:
@@ -80,11 +76,8 @@ def make_pps(traj):
     # controls
     for name in traj.dvMap._uNames:
         # make piecewise poly
-        ts = []
-        ys = []
-        for timestepIdx in range(traj.dvMap._nk):
-            ts.append(traj.tgrid[timestepIdx,0,0])
-            ys.append([traj.dvMap.lookup(name,timestep=timestepIdx)])
+        ts = traj.tgrid[:traj.dvMap._nk,0,0]
+        ys = traj.dvMap.lookupGrid(name)[:,numpy.newaxis]
         pps[name] = PiecewisePolynomial(ts,ys)
 
     return pps
@@ -19,3 +19,5 @@ from dae import Dae
 import dae
 import acadoModelExport
 import detectLinearSubsystems
+import outputsExport
+from outputsExport import CompiledOutputs
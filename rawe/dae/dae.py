@@ -16,8 +16,48 @@
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import hashlib
 import casadi as C
 
+from ..utils import codegen
+from detectLinearSubsystems import nonzeroStructure, blockTriangularOrder
+
+def _structuredSolve(A, b):
+    '''
+    Symbolically solve A w = b for square SXMatrix A, exploiting block triangular structure.
+    Equations with a single unknown left (like ddt(x) - v == 0) are solved by substitution,
+    and only the remaining coupled block (e.g. a mass matrix) goes through C.solve.
+    '''
+    rowDeps = nonzeroStructure(A)
+    (head, (coreRows, coreCols), tail) = blockTriangularOrder(rowDeps)
+    w = [None]*len(rowDeps)
+
+    # b_i minus the part of row i which is already known
+    def remainder(i):
+        r = b[i]
+        for k in rowDeps[i]:
+            if w[k] is not None:
+                r = r - A[i,k]*w[k]
+        return r
+    def pivot(i, j):
+        r = remainder(i)
+        a = A[i,j].toScalar()
+        if a.isOne():
+            return r
+        if a.isMinusOne():
+            return -r
+        return r/A[i,j]
+
+    for (i,j) in head:
+        w[j] = pivot(i,j)
+    if len(coreRows) > 0:
+        wCore = C.solve(A[coreRows,coreCols], C.veccat([remainder(i) for i in coreRows]))
+        for k,j in enumerate(coreCols):
+            w[j] = wCore[k]
+    for (i,j) in reversed(tail):
+        w[j] = pivot(i,j)
+    return C.veccat(w)
+
 class Dae(object):
     """
     Class to hold represent a differential-algebraic or ordinary differential equation
@@ -43,6 +83,9 @@ class Dae(object):
         # map of derivatives
         self._dummyDdtMap = {}
 
+        # symbolic things derived from the residual/outputs, see _memoized
+        self._derivations = {}
+
     def _freezeXzup(self,msg):
         '''
         call this when it's illegal for user to add any more states/controls/params
@@ -57,6 +100,18 @@ class Dae(object):
         '''
         self._outputsFrozen.add(msg)
 
+    def _memoized(self, key, derive):
+        '''
+        Return derive(), computing it only the first time it's asked for.
+        Everything stored here must only depend on parts of the Dae which derive()
+        itself freezes (the residual can only be set once), so it never goes stale.
+        '''
+        try:
+            return self._derivations[key]
+        except KeyError:
+            self._derivations[key] = derive()
+            return self._derivations[key]
+
     def _getAllNames(self):
         return self._xNames + self._zNames + self._uNames + self._pNames + self._outputNames
 
@@ -248,10 +303,22 @@ class Dae(object):
         outputs0 is list of names of f0 outputs
         '''
         self._freezeOutputs('outputsFun()')
+        (fAll, (f0, outputs0)) = self._memoized('outputsFun', self._outputsFun)
+        return (fAll, (f0, list(outputs0)))
 
+    def _outputsFun(self):
         # which outputs are defined at tau_i0
         outputs0 = [] # only outputs which are defined at tau_i0
-        for name in self.outputNames():
+        # usually none of them depend on z or ddt(x), then one probe is enough
+        probeNames = self.outputNames()
+        if len(probeNames) > 0:
+            f = C.SXFunction([self.xVec(),self.uVec(),self.pVec()],
+                             [self[name] for name in probeNames])
+            f.init()
+            if len(f.getFree()) == 0:
+                outputs0 = list(probeNames)
+                probeNames = []
+        for name in probeNames:
             # try to make a function without any algebraic or ddt(x) variables
             f = C.SXFunction([self.xVec(),self.uVec(),self.pVec()],
                              [self[name]]
@@ -287,10 +354,14 @@ class Dae(object):
         this solves for unknown xdot and z symbolically
         then gives all outputs as function of only f(x,u,p)
         '''
+        return self._memoized('outputsFunWithSolve', self._outputsFunWithSolve)
+
+    def _outputsFunWithSolve(self):
         # get output fun as fcn of [xdot, x, z, u, p]
         (fAll, _) = self.outputsFun()
         if fAll == None:
             f = C.SXFunction([self.xVec(), self.uVec(), self.pVec()], [0])
+            f.init()
             return f
         # solve for xdot, z
         (xDotDict, zDict) = self.solveForXDotAndZ()
@@ -315,6 +386,21 @@ class Dae(object):
             raise ValueError('need to set the residual')
         return self._residual
 
+    def residualFunction(self):
+        '''
+        return SXFunction([x,z,u,p,xdot]) -> [f, jacobian(f, [x,z,u,p,xdot])]
+        where f is the dae residual, with the inputs stacked as one vector
+        '''
+        return self._memoized('residualFunction', self._residualFunction)
+
+    def _residualFunction(self):
+        f = self.getResidual()
+        inputs = C.veccat([self.xVec(), self.zVec(), self.uVec(), self.pVec(), self.xDotVec()])
+        fun = C.SXFunction([inputs], [f, C.jacobian(f, inputs)])
+        fun.setOption('name','residual and jacobian')
+        fun.init()
+        return fun
+
     def casadiDae(self):
 #       I have:
 #       0 = fg(xdot,x,z)
@@ -341,6 +427,10 @@ class Dae(object):
         returns (xDotDict,zDict) where these dictionaries contain symbolic
         xdot and z which are only a function of x,u,p
         '''
+        (xDotDict, zDict) = self._memoized('solveForXDotAndZ', self._solveForXDotAndZ)
+        return (dict(xDotDict), dict(zDict))
+
+    def _solveForXDotAndZ(self):
         # get the residual fg(xdot,x,z)
         fg = self.getResidual()
 
@@ -362,7 +452,7 @@ class Dae(object):
         assert len(testFun.getFree()) == 0, \
             "the \"impossible\" happened in solveForXDotAndZ"
 
-        xDotAndZ = C.solve(jac, -fg_zero)
+        xDotAndZ = _structuredSolve(jac, -fg_zero)
         xDot = xDotAndZ[0:len(self.xNames())]
         z = xDotAndZ[len(self.xNames()):]
 
@@ -412,6 +502,41 @@ class Dae(object):
             dae[name] = outs[k+2]
         return dae
 
+    def fingerprint(self):
+        '''
+        Return a hash of the names, residual, and outputs of this dae.
+        This is cheap compared to anything which solves for xdot/z or takes jacobians,
+        so it can be used to look up things which have previously been exported.
+        Returns None if the dae has free parameters.
+        '''
+        if hasattr(self,'_fingerprint'):
+            return self._fingerprint
+        # after this both the variables and outputs are frozen, so the result can be stored
+        f = C.SXFunction([self.xDotVec(),self.xVec(),self.zVec(),self.uVec(),self.pVec()],
+                         [self.getResidual()]+[self[name] for name in self.outputNames()])
+        f.init()
+        if len(f.getFree()) > 0:
+            return None
+        names = [self.xNames(), self.zNames(), self.uNames(), self.pNames(), self.outputNames()]
+        self._fingerprint = hashlib.md5(str(names)+codegen.hashFunction(f)).hexdigest()
+        return self._fingerprint
+
+    def fingerprintExpressions(self,exprs):
+        '''
+        Return a hash of some expressions of xdot/x/z/u/p, given as a list,
+        combined with the fingerprint of the dae itself.
+        Returns None if the expressions (or the dae) have free parameters.
+        '''
+        daeFingerprint = self.fingerprint()
+        if daeFingerprint is None:
+            return None
+        f = C.SXFunction([self.xDotVec(),self.xVec(),self.zVec(),self.uVec(),self.pVec()],
+                         exprs)
+        f.init()
+        if len(f.getFree()) > 0:
+            return None
+        return hashlib.md5(daeFingerprint+codegen.hashFunction(f)).hexdigest()
+
     def assertNoFreeParams(self):
         '''
         throw exception if there are some symbolics in the dae which were not added
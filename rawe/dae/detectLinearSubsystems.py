@@ -15,9 +15,129 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
+import numpy
 import casadi as C
 
+def nonzeroStructure(m):
+    '''
+    for each row of the SXMatrix m, the set of columns with (symbolically) nonzero entries
+    '''
+    return [set(j for j in range(m.size2()) if not m[i,j].toScalar().isZero())
+            for i in range(m.size1())]
+
+def blockTriangularOrder(rowDeps):
+    '''
+    Given the structure of a square linear system (rowDeps[i] is the set of unknowns in
+    equation i), peel off the equations which can be solved one unknown at a time.
+
+    Returns (head, (coreRows, coreCols), tail), where head and tail are lists of
+    (equation, unknown) pairs. The system can be solved by solving the head equations in
+    order (each one only depends on its own unknown and earlier head unknowns), then the
+    coupled core, then the tail equations in reverse order.
+    '''
+    n = len(rowDeps)
+    rows = set(range(n))
+    cols = set(range(n))
+    colDeps = [set() for j in range(n)]
+    for i,deps in enumerate(rowDeps):
+        assert deps <= cols, "equation "+str(i)+" has unknowns out of range: "+str(deps)
+        for j in deps:
+            colDeps[j].add(i)
+    head = []
+    tail = []
+    changed = True
+    while changed:
+        changed = False
+        for i in sorted(rows):
+            deps = rowDeps[i] & cols
+            if len(deps) == 0:
+                raise Exception("structurally singular, equation "+str(i)+" has no unknowns left")
+            if len(deps) == 1:
+                (j,) = deps
+                head.append((i,j))
+                rows.remove(i)
+                cols.remove(j)
+                changed = True
+        for j in sorted(cols):
+            deps = colDeps[j] & rows
+            if len(deps) == 0:
+                raise Exception("structurally singular, unknown "+str(j)+" is in no equation left")
+            if len(deps) == 1:
+                (i,) = deps
+                tail.append((i,j))
+                rows.remove(i)
+                cols.remove(j)
+                changed = True
+    return (head, (sorted(rows), sorted(cols)), tail)
+
+def linearInputSubsystem(dae):
+    '''
+    The linear states x1 of detectLinearSubsystems as a linear input subsystem
+
+        M1 ddt(x1) == A1 x1 + B1 [u, p]
+
+    with constant M1 (invertible), A1 and B1, where ddt(x1) shows up in no other row.
+    Actuator states like daileron or ddr are typically like this, and an integrator can
+    propagate them in closed form (ACADO's linear input subsystem) instead of including
+    them in the Newton iterations. The nonlinear rows may depend on x1, but not on ddt(x1).
+    ACADO needs x1 to be the leading states.
+
+    Returns None if there is no such subsystem, otherwise a dictionary with n1,
+    'rows' (the residual rows of the linear subsystem, in the order of M1's rows),
+    'nonlinearRows' (all other residual rows) and numpy arrays M1, A1, B1.
+    '''
+    return dae._memoized('linearInputSubsystem', lambda : _linearInputSubsystem(dae))
+
+def _linearInputSubsystem(dae):
+    subsystems = detectLinearSubsystems(dae)
+    n1 = len(subsystems['x1'])
+    rows = subsystems['f1']
+    if n1 == 0 or subsystems['x1'] != dae.xNames()[:n1] or len(rows) != n1:
+        return None
+
+    nx = len(dae.xNames())
+    nz = len(dae.zNames())
+    nup = len(dae.uNames()) + len(dae.pNames())
+    xdot = C.veccat([dae.ddt(name) for name in dae.xNames()])
+    inputs = C.veccat([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), xdot])
+    [f, jac] = dae.residualFunction().eval([inputs])
+    rowDeps = nonzeroStructure(jac)
+    xdotOffset = nx+nz+nup
+    nonlinearRows = [i for i in range(len(rowDeps)) if i not in rows]
+    if any(j in rowDeps[i] for i in nonlinearRows for j in range(xdotOffset, xdotOffset+n1)):
+        return None
+
+    # the linear rows may still have parameter dependent coefficients or an offset
+    f0Fun = C.SXFunction([inputs], [f])
+    f0Fun.init()
+    [f0] = f0Fun.eval([0*inputs])
+    J = numpy.zeros((n1, jac.size2()))
+    for k,i in enumerate(rows):
+        if not f0[i,0].toScalar().isZero():
+            return None
+        for j in rowDeps[i]:
+            if not jac[i,j].toScalar().isConstant():
+                return None
+            J[k,j] = jac[i,j].toScalar().getValue()
+    M1 = J[:, xdotOffset:xdotOffset+n1]
+    if numpy.linalg.matrix_rank(M1) < n1:
+        return None
+    # residual M1 xdot - A1 x - B1 u == 0
+    A1 = 0.0 - J[:, :n1]
+    B1 = 0.0 - J[:, nx+nz:nx+nz+nup]
+    return {'n1':n1, 'rows':rows, 'nonlinearRows':nonlinearRows,
+            'M1':M1, 'A1':A1, 'B1':B1}
+
 def detectLinearSubsystems(dae):
+    '''
+    Classify the states into x1 (linear, only depending on other x1 and u),
+    x2 (nonlinear) and x3 (only entering linearly, not feeding back into x2), and the
+    residual rows accordingly. Returns a dictionary of the state names and row indices.
+    See linearInputSubsystem for the part which the exported integrators use.
+    '''
+    return dict(dae._memoized('detectLinearSubsystems', lambda : _detectLinearSubsystems(dae)))
+
+def _detectLinearSubsystems(dae):
     f = dae.getResidual()
     xdot = C.veccat([dae.ddt(name) for name in dae.xNames()])
     x = dae.xVec()
@@ -31,7 +151,7 @@ def detectLinearSubsystems(dae):
     inputs = C.veccat([x, z, u, p, xdot])
 
     # take jacobian and find which entries are constant, zero, or nonzer
-    jac = C.jacobian(f,inputs)
+    [_, jac] = dae.residualFunction().eval([inputs])
 
     def qualifyM(m):
       M = C.IMatrix.zeros(m.size1(),m.size2())
@@ -116,8 +236,6 @@ def detectLinearSubsystems(dae):
     f23 = fi_nonlinear
     x1 = x1_candidates
     x23 = x23_candidates
-    print "finished in",niters,"iterations"
-    print "LOL HERE IS WHERE WE CHECK IF C1 IS SQUARE (yolo)"
 
     # separate x23 into x2 and x3
     x3_candidates = set(x23)
@@ -140,10 +258,9 @@ def detectLinearSubsystems(dae):
     f2 = f23 - not_f3
     f3 = f23 - f2
 
-    print "LOL HERE IS WHERE WE CHECK IF C3 IS SQUARE (yolo)"
-    print "x1",[dae.xNames()[j] for j in x1]
-    print "x2",[dae.xNames()[j] for j in x2]
-    print "x3",[dae.xNames()[j] for j in x3]
-    print "f1",f1
-    print "f2",f2
-    print "f3",f3
+    return {'x1':[dae.xNames()[j] for j in sorted(x1)],
+            'x2':[dae.xNames()[j] for j in sorted(x2)],
+            'x3':[dae.xNames()[j] for j in sorted(x3)],
+            'f1':sorted(f1),
+            'f2':sorted(f2),
+            'f3':sorted(f3)}
@@ -0,0 +1,230 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import ctypes
+import hashlib
+import numpy
+import casadi as C
+
+from ..utils import codegen, buildcache
+
+# used for anything not given in cgOptions, the same as the OCP export defaults
+defaultCgOptions = {'CXX':'g++',
+                    'CXXFLAGS':'-O3 -fPIC -finline-functions'}
+
+def makeMakefile(cgOptions):
+    '''
+    Makefile for outputs.so using the compiler and flags of the codegen options.
+    Only CXX and CXXFLAGS are used, everything else in cgOptions is for the OCP export.
+    '''
+    return """\
+CXX      = %(CXX)s
+CXXFLAGS = %(CXXFLAGS)s -I.
+LDFLAGS  = -lm
+
+OBJ = outputs.o outputs_batch.o
+
+.PHONY: clean all
+all : outputs.so
+
+%%.o : %%.cpp outputs.h
+\t@echo CXX $@: $(CXX) $(CXXFLAGS) -c $< -o $@
+\t@$(CXX) $(CXXFLAGS) -c $< -o $@
+
+outputs.so : $(OBJ)
+\t@echo LD $@: $(CXX) -shared -o $@ $(OBJ) $(LDFLAGS)
+\t@$(CXX) -shared -o $@ $(OBJ) $(LDFLAGS)
+
+clean :
+\trm -f *.o *.so
+""" % {'CXX':cgOptions['CXX'], 'CXXFLAGS':cgOptions['CXXFLAGS']}
+
+def batchSource(nx, nu, np, nOut):
+    '''
+    C source looping the generated outputs function over many nodes.
+    Node k uses row k of x and u, nodes after the last control get u = NaN.
+    '''
+    return '''\
+#include <math.h>
+#include "outputs.h"
+
+#define NX %(nx)d
+#define NU %(nu)d
+#define NP %(np)d
+#define NOUT %(nOut)d
+
+extern "C" {
+void evaluateOutputs(const double * x, const double * u, const double * p,
+                     double * out, const int numNodes, const int numControls);
+}
+
+void evaluateOutputs(const double * x, const double * u, const double * p,
+                     double * out, const int numNodes, const int numControls){
+  double xup[NX + NU + NP + 1];
+  int k, j;
+  for (j = 0; j < NP; j++)
+    xup[NX + NU + j] = p[j];
+  for (k = 0; k < numNodes; k++){
+    for (j = 0; j < NX; j++)
+      xup[j] = x[k*NX + j];
+    for (j = 0; j < NU; j++)
+      xup[NX + j] = (k < numControls) ? u[k*NU + j] : NAN;
+    outputs(xup, out + k*NOUT);
+  }
+}
+''' % {'nx':nx, 'nu':nu, 'np':np, 'nOut':nOut}
+
+def _shape(expr):
+    try:
+        return (expr.size1(), expr.size2())
+    except AttributeError:
+        return (1,1)
+
+class CompiledOutputs(object):
+    '''
+    Dae outputs as a compiled function of (x,u,p) which is evaluated at many nodes in one call.
+
+    If names is None, all outputs are given, solving for xdot and z symbolically.
+    Otherwise only the named outputs are given, and they must be functions of only x, u and p.
+
+    cgOptions are codegen options like those given to the OCP export ({'CXX':'clang++', ...}).
+    '''
+    def __init__(self, dae, names=None, cgOptions=None):
+        self._dae = dae
+        self._cgOptions = dict(defaultCgOptions)
+        if cgOptions is not None:
+            for name in defaultCgOptions:
+                if name in cgOptions:
+                    self._cgOptions[name] = cgOptions[name]
+        self._solve = names is None
+        if names is None:
+            names = dae.outputNames()
+        self.names = list(names)
+        self._nx = len(dae.xNames())
+        self._nu = len(dae.uNames())
+        self._np = len(dae.pNames())
+
+        # where each output is in a row of evaluate()
+        self._slices = {}
+        self.shapes = {}
+        i0 = 0
+        for name in self.names:
+            shape = _shape(dae[name])
+            self.shapes[name] = shape
+            self._slices[name] = (i0, i0+shape[0]*shape[1])
+            i0 += shape[0]*shape[1]
+        self.numOutputs = i0
+
+        self._lib = None
+        if self.numOutputs > 0:
+            self._lib = ctypes.cdll.LoadLibrary(os.path.join(self._export(), 'outputs.so'))
+
+    def _fingerprint(self):
+        daeFingerprint = self._dae.fingerprint()
+        if daeFingerprint is None:
+            return None
+        generators = buildcache.sourceFingerprint([sys.modules[__name__], codegen])
+        return hashlib.md5(str(['outputs', daeFingerprint, self.names, self._solve, generators,
+                                sorted(self._cgOptions.items()),
+                                buildcache.toolchainVersion(self._cgOptions['CXX'])])).hexdigest()
+
+    def _export(self):
+        # if these outputs were compiled before, skip solving for xdot/z
+        fingerprint = self._fingerprint()
+        if fingerprint is not None:
+            exportpath = buildcache.lookupFingerprint(fingerprint, ['outputs.so'])
+            if exportpath is not None:
+                return exportpath
+
+        dae = self._dae
+        if self._solve:
+            f = dae.outputsFunWithSolve()
+            outputs = f.eval([dae.xVec(), dae.uVec(), dae.pVec()])
+        else:
+            outputs = [dae[name] for name in self.names]
+        xup = C.veccat([dae.xVec(), dae.uVec(), dae.pVec()])
+        f = C.SXFunction([xup], [C.densify(C.veccat(outputs))])
+        f.init()
+        assert len(f.getFree()) == 0, \
+            'outputs '+str(self.names)+' are not functions of only x, u, and p'
+        (source, header) = codegen.writeCCode(f, 'outputs')
+        genfiles = {'outputs.cpp': '#include "outputs.h"\n'+source,
+                    'outputs.h': header,
+                    'outputs_batch.cpp': batchSource(self._nx, self._nu, self._np,
+                                                     self.numOutputs),
+                    'Makefile': makeMakefile(self._cgOptions)}
+        exportpath = buildcache.memoizeBuild(genfiles, ['outputs.so'],
+                                             prefix='outputs__',
+                                             compilers=[self._cgOptions['CXX']],
+                                             errorMessage="outputs compilation failed")
+        if fingerprint is not None:
+            buildcache.recordFingerprint(fingerprint, exportpath)
+        return exportpath
+
+    def evaluate(self, x, u, p=None):
+        '''
+        Evaluate all outputs at every row of x (nodes by nx).
+        u can have the same number of rows as x, or one less in which case
+        the last node is evaluated with u = NaN.
+        Returns a (nodes by numOutputs) array.
+        '''
+        x = numpy.ascontiguousarray(x, dtype=numpy.double)
+        u = numpy.ascontiguousarray(u, dtype=numpy.double)
+        if p is None:
+            p = numpy.zeros(self._np)
+        p = numpy.ascontiguousarray(p, dtype=numpy.double)
+        if x.ndim == 1:
+            x = x.reshape((1, x.size))
+        if u.ndim == 1:
+            u = u.reshape((1, u.size))
+        numNodes = x.shape[0]
+        numControls = u.shape[0]
+        assert x.shape[1] == self._nx, 'x should have '+str(self._nx)+' columns, got '+str(x.shape)
+        assert u.shape[1] == self._nu, 'u should have '+str(self._nu)+' columns, got '+str(u.shape)
+        assert p.size == self._np, 'p should have size '+str(self._np)+', got '+str(p.shape)
+        assert numControls in [numNodes, numNodes-1], \
+            "u must have as many rows as x, or one less (got "+str(numControls)+\
+            " and "+str(numNodes)+")"
+
+        out = numpy.zeros((numNodes, self.numOutputs))
+        if self._lib is not None:
+            self._lib.evaluateOutputs(ctypes.c_void_p(x.ctypes.data),
+                                      ctypes.c_void_p(u.ctypes.data),
+                                      ctypes.c_void_p(p.ctypes.data),
+                                      ctypes.c_void_p(out.ctypes.data),
+                                      numNodes, numControls)
+        return out
+
+    def column(self, out, name):
+        '''
+        Pick one output out of the result of evaluate(), (nodes,) for scalar outputs
+        or (nodes,)+shape otherwise.
+        '''
+        (i0,i1) = self._slices[name]
+        if i1 - i0 == 1:
+            return out[:,i0]
+        # matrix outputs were flattened column major by veccat
+        (n1,n2) = self.shapes[name]
+        return out[:,i0:i1].reshape((out.shape[0],n2,n1)).swapaxes(1,2)
+
+    def toDict(self, out):
+        '''
+        Split the result of evaluate() into a dictionary of outputs.
+        '''
+        return dict([(name, self.column(out, name)) for name in self.names])
@@ -0,0 +1,169 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import traceback
+import multiprocessing
+import numpy
+
+from rtIntegrator import RtIntegrator, RtIntegratorOptions
+
+# Everything a worker needs. It is set right before the pool is forked, so the workers
+# inherit the loaded integrator, the controller, and the shared result arrays without
+# pickling anything.
+_workerState = None
+
+def _sharedArray(shape, typecode='d'):
+    raw = multiprocessing.RawArray(typecode, int(numpy.prod(shape)))
+    if typecode == 'd':
+        dtype = numpy.double
+    else:
+        dtype = numpy.intc
+    return (raw, numpy.frombuffer(raw, dtype=dtype).reshape(shape))
+
+def _runScenario(state, m):
+    integrator = state['integrator']
+    X = state['X']
+    U = state['U']
+    P = state['P']
+    controller = state['controller']
+    if controller is None:
+        # open loop, the whole control sequence in one call
+        X[m,:,:] = integrator.rollout(X[m,0,:], U[m,:,:], P[m,:])['x']
+    else:
+        # closed loop, one step at a time, continuing from the last step's z
+        # exactly like the open loop rollout does
+        z = integrator.z
+        for k in range(U.shape[1]):
+            U[m,k,:] = controller(X[m,k,:], k, m)
+            ret = integrator.rollout(X[m,k,:], U[m,k:k+1,:], P[m,:], reset=(k==0), z0=z)
+            X[m,k+1,:] = ret['x'][1,:]
+            z = ret['z'][-1,:]
+    if state['outputs'] is not None:
+        state['outputs'][m,:,:] = integrator._outputs.evaluate(X[m,:,:], U[m,:,:], P[m,:])
+
+def _runChunk(scenarios):
+    state = _workerState
+    for m in scenarios:
+        try:
+            _runScenario(state, m)
+        except Exception:
+            traceback.print_exc()
+            state['failed'][m] = 1
+            state['X'][m,1:,:] = numpy.nan
+            if state['outputs'] is not None:
+                state['outputs'][m,:,:] = numpy.nan
+    return len(scenarios)
+
+class MonteCarlo(object):
+    '''
+    Run many simulations of a dae in parallel on a process pool.
+
+        mc = MonteCarlo(dae, ts, options=intOpts)
+        ret = mc.run(x0s, Us, ps)                      # open loop, Us is M by N by nu
+        ret = mc.run(x0s, 200, ps, controller=lqr)     # closed loop, u = lqr(x, k, m)
+
+    The integrator is exported (or taken from the build cache) once in this process,
+    the workers are forked from it and write their results straight into shared memory.
+    '''
+    def __init__(self, dae, ts, options=None, numProcesses=None):
+        if options is None:
+            options = RtIntegratorOptions()
+        if numProcesses is None:
+            numProcesses = multiprocessing.cpu_count()
+        assert type(numProcesses) is int and numProcesses > 0, \
+            "numProcesses must be a positive int, got: "+str(numProcesses)
+        self._numProcesses = numProcesses
+        self._dae = dae
+        self._integrator = RtIntegrator(dae, ts, options=options)
+
+    def run(self, x0s, Us, ps=None, controller=None, outputs=False):
+        '''
+        Simulate M scenarios, each from an initial state (x0s is M by nx) with
+        parameters ps (M by np, or a single p for all scenarios).
+
+        Open loop: Us is an M by N by nu array of control sequences.
+        Closed loop: Us is the number of steps N, and controller(x, k, m) gives the control
+        at step k of scenario m. It runs in the worker processes.
+
+        Returns a dictionary with 'x' (M by N+1 by nx), 'u' (M by N by nu), 'failed'
+        (indices of scenarios which raised an exception, their trajectories are NaN)
+        and if outputs is True 'outputs', a dictionary of M by N+1 arrays.
+        '''
+        global _workerState
+        nx = len(self._dae.xNames())
+        nu = len(self._dae.uNames())
+        np = len(self._dae.pNames())
+        x0s = numpy.array(x0s, dtype=numpy.double, ndmin=2)
+        M = x0s.shape[0]
+        assert x0s.shape == (M,nx), 'x0s should be M by '+str(nx)+', got '+str(x0s.shape)
+
+        if controller is None:
+            Us = numpy.array(Us, dtype=numpy.double)
+            assert Us.ndim == 3 and Us.shape[0] == M and Us.shape[2] == nu, \
+                'Us should be '+str(M)+' by N by '+str(nu)+', got '+str(Us.shape)
+            N = Us.shape[1]
+        else:
+            assert type(Us) is int and Us > 0, \
+                'for closed loop simulation give the number of steps instead of Us'
+            N = Us
+        if ps is None:
+            ps = numpy.zeros(np)
+        ps = numpy.array(ps, dtype=numpy.double)
+        if ps.ndim < 2:
+            ps = numpy.tile(ps.reshape((1,np)), (M,1))
+        assert ps.shape == (M,np), 'ps should be M by '+str(np)+' or '+str((np,))+\
+            ', got '+str(ps.shape)
+
+        (_, X) = _sharedArray((M, N+1, nx))
+        (_, U) = _sharedArray((M, N, nu))
+        (_, P) = _sharedArray((M, np))
+        (_, failed) = _sharedArray((M,), 'i')
+        X[:,0,:] = x0s
+        P[:,:] = ps
+        if controller is None:
+            U[:,:,:] = Us
+        outs = None
+        if outputs:
+            # compile the outputs before forking so every worker has them
+            compiled = self._integrator._outputs
+            (_, outs) = _sharedArray((M, N+1, compiled.numOutputs))
+
+        numProcesses = min(self._numProcesses, M)
+        chunks = [range(k, M, numProcesses*4) for k in range(min(M, numProcesses*4))]
+        _workerState = {'integrator':self._integrator, 'controller':controller,
+                        'X':X, 'U':U, 'P':P, 'failed':failed, 'outputs':outs}
+        try:
+            if numProcesses == 1:
+                map(_runChunk, chunks)
+            else:
+                pool = multiprocessing.Pool(numProcesses)
+                try:
+                    pool.map(_runChunk, chunks)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            _workerState = None
+
+        ret = {'x':numpy.array(X), 'u':numpy.array(U),
+               'failed':list(numpy.nonzero(failed)[0])}
+        if outputs:
+            ret['outputs'] = compiled.toDict(outs.reshape((M*(N+1), compiled.numOutputs)))
+            for name in ret['outputs']:
+                val = ret['outputs'][name]
+                ret['outputs'][name] = val.reshape((M, N+1)+val.shape[1:])
+        return ret
@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import casadi as C
 
 import exportOcp
@@ -248,6 +249,34 @@ class Ocp(object):
         assert not hasattr(self, '_minLsqEndTerm'), 'you can only call minimizeLsqEndTerm once'
         self._minLsqEndTerm = obj
 
+    def fingerprint(self):
+        '''
+        Return a hash of everything about this ocp which goes into the exported code:
+        the dae, horizon, objectives, constraints and bounds.
+        Returns None if the objectives haven't been set yet.
+        '''
+        minLsq = getattr(self, '_minLsq', None)
+        minLsqEndTerm = getattr(self, '_minLsqEndTerm', None)
+        if minLsq is None or minLsqEndTerm is None:
+            return None
+        exprs = [minLsq, minLsqEndTerm]
+        comparisons = []
+        for constraints in [self._constraints, self._constraintsStart, self._constraintsEnd]:
+            for (lhs,comparison,rhs) in constraints:
+                exprs.extend([C.SXMatrix(lhs),C.SXMatrix(rhs)])
+                comparisons.append(comparison)
+            comparisons.append('|')
+        bounds = []
+        for bndmap in [self._ebndmap, self._ebndmapStart, self._ebndmapEnd,
+                       self._lbndmap, self._lbndmapStart, self._lbndmapEnd,
+                       self._ubndmap, self._ubndmapStart, self._ubndmapEnd]:
+            bounds.append(sorted([(name,str(val)) for (name,val) in bndmap.items()]))
+        exprsFingerprint = self.dae.fingerprintExpressions(exprs)
+        if exprsFingerprint is None:
+            return None
+        return hashlib.md5(str([type(self).__name__, self.hashPrefix, self.N, repr(self.ts),
+                                comparisons, bounds, exprsFingerprint])).hexdigest()
+
     def exportCode(self, ocpOptions, integratorOptions, codegenOptions, phase1Options):
         assert isinstance(ocpOptions, OcpExportOptions)
         assert isinstance(integratorOptions, RtIntegratorOptions)
@@ -17,3 +17,5 @@
 
 from Ocp import Ocp, Mhe, Mpc, OcpExportOptions
 from ocprt import OcpRT, MheRT, MpcRT
+from arrivalCost import ArrivalCost
+from lqr import dlqr, solveDare
@@ -0,0 +1,124 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+import scipy.linalg
+
+class ArrivalCost(object):
+    '''
+    Square root arrival cost update for moving horizon estimation.
+
+    The arrival cost ||PL (x0 - xL)||^2 is moved forward by one sample by solving
+
+        min_{xL_,uL_,xL1_} ||  PL ( xL_ - xL )             ||^2
+                           ||  VL ( yL - h(xL_,uL_) )      ||
+                           ||  WL ( xL1_ - f(xL_,uL_) )    ||
+
+    with f and h (the integrator and its measurements) linearized at the current estimate (x,u).
+    Stacked as || M (xL_,uL_,xL1_) + res ||^2, a QR factorization of [M res] gives the new
+    weight PL1 (the lower right block of R) and the new reference xL1 = -PL1^-1 rho2.
+    Everything stays in square root form, PL^T PL is never formed.
+
+    [M res] is allocated once and factorized in place without forming Q.
+    The sensitivities d(x1,h)/d(x,u) come from one integrator step with seeds, so the
+    integrator needs measurements h with at least as many rows as u.
+    '''
+    def __init__(self, integrator, xL, PL, VL, WL):
+        assert integrator._measurements is not None, \
+            "the arrival cost needs an integrator with measurements"
+        nx = integrator.x.size
+        nu = integrator.u.size
+        np = integrator.p.size
+        nh = integrator.h.size
+        assert nh >= nu, "the controls can't be estimated from "+str(nh)+" measurements"
+        self._integrator = integrator
+        self._nx = nx
+        self._nu = nu
+        self._nh = nh
+
+        def mat(val, shape, name):
+            val = numpy.array(val, dtype=numpy.double)
+            assert val.shape == shape, \
+                name+' should have shape '+str(shape)+', got '+str(val.shape)
+            return val
+        self.xL = mat(xL, (nx,), 'xL')
+        self.PL = mat(PL, (nx,nx), 'PL')
+        self.VL = mat(VL, (nh,nh), 'VL')
+        self.WL = mat(WL, (nx,nx), 'WL')
+
+        # directions (x,u) of the sensitivities, p is held fixed
+        self._seeds = numpy.eye(nx+nu+np)[:,:nx+nu]
+        self._xu = numpy.zeros(nx+nu)
+        self._VLH = numpy.zeros((nh,nx+nu))
+        self._WLJ = numpy.zeros((nx,nx+nu))
+        self._hTilde = numpy.zeros(nh)
+        self._xTilde = numpy.zeros(nx)
+
+        # [M res], rows: PL, VL, WL blocks, columns: xL_, uL_, xL1_, res
+        # (fortran order so the QR can work in place)
+        self._aug = numpy.zeros((nx+nh+nx, nx+nu+nx+1), order='F')
+
+    def update(self, x, u, yL, p=None):
+        '''
+        Move the arrival cost forward one sample, linearizing at the first node of the
+        current estimate (x,u) with its measurement yL. Updates and returns (PL, xL).
+        '''
+        nx = self._nx
+        nu = self._nu
+        nh = self._nh
+        integrator = self._integrator
+        aug = self._aug
+
+        self._xu[:nx] = x
+        self._xu[nx:] = u
+        integrator.x = self._xu[:nx]
+        integrator.u = self._xu[nx:]
+        if p is not None:
+            integrator.p = p
+        integrator.step(sensitivities=self._seeds)
+        J = integrator.dx1_dseed # [Xx Xu]
+        H = integrator.dh_dseed  # [Hx Hu]
+
+        # x_tilde = f(x,u) - J (x,u), h_tilde = h(x,u) - H (x,u)
+        numpy.dot(J, self._xu, out=self._xTilde)
+        numpy.subtract(integrator.x, self._xTilde, out=self._xTilde)
+        numpy.dot(H, self._xu, out=self._hTilde)
+        numpy.subtract(integrator.h, self._hTilde, out=self._hTilde)
+
+        # the QR overwrites all of [M res], the zero blocks too
+        aug.fill(0.0)
+        aug[:nx, :nx] = self.PL
+        aug[:nx, -1] = -numpy.dot(self.PL, self.xL)
+        numpy.dot(self.VL, H, out=self._VLH)
+        aug[nx:nx+nh, :nx+nu] = self._VLH
+        aug[nx:nx+nh, :nx+nu] *= -1
+        aug[nx:nx+nh, -1] = numpy.dot(self.VL, yL - self._hTilde)
+        numpy.dot(self.WL, J, out=self._WLJ)
+        aug[nx+nh:, :nx+nu] = self._WLJ
+        aug[nx+nh:, :nx+nu] *= -1
+        aug[nx+nh:, nx+nu:nx+nu+nx] = self.WL
+        aug[nx+nh:, -1] = -numpy.dot(self.WL, self._xTilde)
+
+        (R,) = scipy.linalg.qr(aug, mode='r', overwrite_a=True)
+        R2 = R[nx+nu:nx+nu+nx, nx+nu:nx+nu+nx]
+        rho2 = R[nx+nu:nx+nu+nx, -1]
+
+        # the sign of each row of R is arbitrary, keep the diagonal of PL positive
+        signs = numpy.where(numpy.diag(R2) < 0, -1.0, 1.0)
+        self.PL[:,:] = R2*signs[:,numpy.newaxis]
+        self.xL[:] = -scipy.linalg.solve_triangular(R2, rho2)
+        return (self.PL, self.xL)
@@ -15,13 +15,16 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
+import sys
+import hashlib
 import casadi as C
 
 import phase1
 import qpoases
 import ocg_interface
+import writeAcadoOcpExport
 from ..rtIntegrator import rtModelExport
-from ..utils import codegen
+from ..utils import codegen, buildcache, pkgconfig
 
 def validateOptions(defaultOpts, userOpts, optName):
     '''
@@ -97,6 +100,29 @@ def writeObjective(ocp, out0, exportName):
     return codegen.writeCCode(outputFun,exportName)
 
 
+def exportFingerprint(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
+    '''
+    Hash everything which determines the exported OCP, without doing any expensive symbolics.
+    Returns None if the ocp can't be fingerprinted.
+    '''
+    ocpFingerprint = ocp.fingerprint()
+    if ocpFingerprint is None:
+        return None
+    toolchain = [buildcache.toolchainVersion(cgOptions['CC']),
+                 buildcache.toolchainVersion(cgOptions['CXX']),
+                 buildcache.toolchainVersion(phase1Options['CXX']),
+                 pkgconfig.call(['--modversion','acado'])]
+    generators = buildcache.sourceFingerprint([sys.modules[__name__], phase1, qpoases,
+                                               ocg_interface, writeAcadoOcpExport,
+                                               rtModelExport, codegen])
+    return hashlib.md5(str([ocpFingerprint,
+                            generators,
+                            sorted(ocpOptions.getAcadoOpts().items()),
+                            sorted(integratorOptions.getAcadoOpts().items()),
+                            sorted(cgOptions.items()),
+                            sorted(phase1Options.items()),
+                            toolchain])).hexdigest()
+
 def exportOcp(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
     defaultCgOptions = {'CXX':'g++', 'CC':'gcc',
                         'CXXFLAGS':'-O3 -fPIC -finline-functions',
@@ -110,8 +136,20 @@ def exportOcp(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
     cgOptions['hashPrefix'] = ocp.hashPrefix
     phase1Options['hashPrefix'] = ocp.hashPrefix
 
+    # if this exact ocp has been exported and built before, skip all the symbolics
+    if cgOptions['export_without_build_path'] is None and cgOptions['force_export_path'] is None:
+        fingerprint = exportFingerprint(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options)
+        if fingerprint is not None:
+            exportPath = buildcache.lookupFingerprint(fingerprint, qpoases.products)
+            if exportPath is not None:
+                return exportPath
+    else:
+        fingerprint = None
+
     # write the OCP exporter and run it, returning an exported OCP
-    files = phase1.runPhase1(ocp, phase1Options, integratorOptions, ocpOptions)
+    linearInput = rtModelExport.linearInput(ocp.dae, integratorOptions, None)
+    files = phase1.runPhase1(ocp, phase1Options, integratorOptions, ocpOptions,
+                             linearInput=linearInput)
 
     # add model for rt integrator
     files['model.c'] = '''\
@@ -119,7 +157,7 @@ def exportOcp(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
 #include "rhs.h"
 #include "rhsJacob.h"
 '''
-    rtModelGen = rtModelExport.generateCModel(ocp.dae, ocp.ts, None)
+    rtModelGen = rtModelExport.generateCModel(ocp.dae, ocp.ts, None, linearInput=linearInput)
     files['rhs.cpp'] = '#include "rhs.h"\n'+rtModelGen['rhsFile'][0]
     files['rhsJacob.cpp'] = '#include "rhsJacob.h"\n'+rtModelGen['rhsJacobFile'][0]
     files['rhs.h'] = rtModelGen['rhsFile'][1]
@@ -152,4 +190,7 @@ def exportOcp(ocp, ocpOptions, integratorOptions, cgOptions, phase1Options):
     else:
         raise Exception('the impossible happened, unsupported qp solver: "'+str(ocpOptions['QP_SOLVER'])+'"')
 
+    if fingerprint is not None:
+        buildcache.recordFingerprint(fingerprint, exportPath)
+
     return exportPath
@@ -0,0 +1,155 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+def _symmetric(P):
+    return 0.5*(P + P.T)
+
+def _relativeChange(P0, P1):
+    return numpy.max(numpy.abs(P1 - P0))/max(numpy.max(numpy.abs(P1)), 1e-300)
+
+def _gain(A, B, R, P):
+    # K = (R + B' P B)^-1 B' P A
+    BtP = numpy.dot(B.T, P)
+    return numpy.linalg.solve(R + numpy.dot(BtP, B), numpy.dot(BtP, A))
+
+def _dareResidual(A, B, Q, R, P):
+    K = _gain(A, B, R, P)
+    res = numpy.dot(numpy.dot(A.T, P), A - numpy.dot(B, K)) + Q - P
+    return numpy.max(numpy.abs(res))/max(numpy.max(numpy.abs(P)), 1.0)
+
+def _stein(Acl, Qcl, tol, maxIter):
+    '''
+    Solve X = Acl' X Acl + Qcl by Smith's doubling. Returns None if Acl is not stable,
+    which shows up as Acl^(2^k) blowing up instead of going to zero.
+    '''
+    X = Qcl.copy()
+    Ak = Acl.copy()
+    for k in range(maxIter):
+        X = X + numpy.dot(numpy.dot(Ak.T, X), Ak)
+        Ak = numpy.dot(Ak, Ak)
+        size = numpy.max(numpy.abs(Ak))
+        if size < tol:
+            return _symmetric(X)
+        if not size < 1e8:
+            return None
+    return None
+
+def _newton(A, B, Q, R, P0, tol, maxIter):
+    '''
+    Newton-Kleinman (Hewer) iterations from P0, None if P0 doesn't give a stabilizing gain
+    or it doesn't converge.
+    '''
+    P = P0
+    for k in range(maxIter):
+        K = _gain(A, B, R, P)
+        Acl = A - numpy.dot(B, K)
+        Pnew = _stein(Acl, Q + numpy.dot(numpy.dot(K.T, R), K), tol, maxIter)
+        if Pnew is None:
+            return None
+        if _relativeChange(P, Pnew) < tol:
+            return Pnew
+        P = Pnew
+    return None
+
+def _doubling(A, B, Q, R, tol, maxIter):
+    '''
+    Structure preserving doubling algorithm, converges quadratically from scratch.
+    '''
+    nx = A.shape[0]
+    I = numpy.eye(nx)
+    Ak = A.copy()
+    Gk = numpy.dot(B, numpy.linalg.solve(R, B.T))
+    Hk = Q.copy()
+    for k in range(maxIter):
+        W = I + numpy.dot(Gk, Hk)
+        # W^-1 A and W^-1 G
+        WinvA = numpy.linalg.solve(W, Ak)
+        WinvG = numpy.linalg.solve(W, Gk)
+        Hnew = _symmetric(Hk + numpy.dot(numpy.dot(Ak.T, Hk), WinvA))
+        Gk = _symmetric(Gk + numpy.dot(Ak, numpy.dot(WinvG, Ak.T)))
+        Ak = numpy.dot(Ak, WinvA)
+        if _relativeChange(Hk, Hnew) < tol:
+            return Hnew
+        Hk = Hnew
+    return None
+
+def solveDare(A, B, Q, R, N=None, P0=None, tol=1e-12, maxIter=100):
+    '''
+    Stabilizing solution P of the discrete algebraic riccati equation
+
+        P = A' P A - (A' P B + N) (R + B' P B)^-1 (B' P A + N') + Q
+
+    If P0 (e.g. the solution at the previous linearization) is given and its gain
+    stabilizes the system, Newton's method is started from it which usually converges
+    in a couple of iterations. Otherwise the doubling algorithm is used.
+    '''
+    A = numpy.array(A, dtype=numpy.double)
+    B = numpy.array(B, dtype=numpy.double)
+    Q = numpy.array(Q, dtype=numpy.double)
+    R = numpy.array(R, dtype=numpy.double)
+    nx = A.shape[0]
+    nu = B.shape[1]
+    assert A.shape == (nx,nx), 'A should be square, got '+str(A.shape)
+    assert B.shape == (nx,nu), 'B should be '+str(nx)+' by nu, got '+str(B.shape)
+    assert Q.shape == (nx,nx), 'Q should be '+str((nx,nx))+', got '+str(Q.shape)
+    assert R.shape == (nu,nu), 'R should be '+str((nu,nu))+', got '+str(R.shape)
+
+    # remove the cross term: A - B R^-1 N', Q - N R^-1 N'
+    if N is not None:
+        N = numpy.array(N, dtype=numpy.double)
+        assert N.shape == (nx,nu), 'N should be '+str((nx,nu))+', got '+str(N.shape)
+        RinvNt = numpy.linalg.solve(R, N.T)
+        A = A - numpy.dot(B, RinvNt)
+        Q = Q - numpy.dot(N, RinvNt)
+    Q = _symmetric(Q)
+    R = _symmetric(R)
+
+    P = None
+    if P0 is not None:
+        P0 = numpy.array(P0, dtype=numpy.double)
+        assert P0.shape == (nx,nx), 'P0 should be '+str((nx,nx))+', got '+str(P0.shape)
+        P0 = _symmetric(P0)
+        if _dareResidual(A, B, Q, R, P0) < tol:
+            # nothing changed since last time
+            P = P0
+        else:
+            P = _newton(A, B, Q, R, P0, tol, maxIter)
+    if P is None:
+        P = _doubling(A, B, Q, R, tol, maxIter)
+    if P is None or not numpy.all(numpy.isfinite(P)) or _dareResidual(A, B, Q, R, P) > 1e3*tol:
+        raise Exception('discrete riccati equation did not converge, '+
+                        'is (A,B) stabilizable and (A,Q) detectable?')
+    return P
+
+def dlqr(A, B, Q, R, N=None, P0=None):
+    '''
+    Infinite horizon discrete LQR: returns (K, P) where u = -K x is the optimal control
+    for the cost sum x'Qx + u'Ru + 2x'Nu and P is the cost to go matrix.
+    P0 warm starts the riccati solver, see solveDare.
+    '''
+    P = solveDare(A, B, Q, R, N=N, P0=P0)
+    A = numpy.array(A, dtype=numpy.double)
+    B = numpy.array(B, dtype=numpy.double)
+    BtP = numpy.dot(B.T, P)
+    k1 = numpy.dot(BtP, B) + R
+    k2 = numpy.dot(BtP, A)
+    if N is not None:
+        k2 = k2 + numpy.array(N, dtype=numpy.double).T
+    K = numpy.linalg.solve(k1, k2)
+    return K, P
@@ -54,21 +54,94 @@ real_t feedbackStepTimed(int * ret){
   return toc(&tmr);
 }
 
+/** One real time iteration: feedback step, shift, preparation step.
+ *  x0 is the new initial state (if the initial state is fixed).
+ *  If yNew is not NULL the reference is shifted and yNew becomes the last one,
+ *  if yNNew is not NULL it becomes the new terminal reference.
+ *  The solution of the feedback step is copied to xSol/uSol/zSol,
+ *  and the shifted x/u/z/y/yN for the next iteration are copied to xNext/uNext/zNext/yNext/yNNext.
+ *  stats gets [feedback time, preparation time, KKT value, objective].
+ *  Any of the pointers may be NULL. If the feedback step fails its return code is returned
+ *  without shifting or preparing.
+ */
+int rtiStep(real_t const * const x0, real_t const * const yNew, real_t const * const yNNew,
+            const int strategy,
+            real_t * const xSol, real_t * const uSol, real_t * const zSol,
+            real_t * const xNext, real_t * const uNext, real_t * const zNext,
+            real_t * const yNext, real_t * const yNNext,
+            real_t * const stats){
+  int ret;
+  timer tmr;
+  real_t fbTime, prepTime = 0;
+
+#if ACADO_INITIAL_STATE_FIXED
+  if (x0 != 0 && x0 != acadoVariables.x0)
+    memcpy(acadoVariables.x0, x0, sizeof(real_t)*ACADO_NX);
+#endif
+
+  tic(&tmr);
+  ret = feedbackStep();
+  fbTime = toc(&tmr);
+
+  if (stats != 0){
+    stats[0] = fbTime;
+    stats[2] = getKKT();
+    stats[3] = getObjective();
+  }
+  if (xSol != 0) memcpy(xSol, acadoVariables.x, sizeof(real_t)*(ACADO_N + 1)*ACADO_NX);
+  if (uSol != 0) memcpy(uSol, acadoVariables.u, sizeof(real_t)*ACADO_N*ACADO_NU);
+#if ACADO_NXA
+  if (zSol != 0) memcpy(zSol, acadoVariables.z, sizeof(real_t)*ACADO_N*ACADO_NXA);
+#endif
+
+  if (ret == 0){
+    shiftStates(strategy, 0, 0);
+    shiftControls( 0 );
+    if (yNew != 0){
+      memmove(acadoVariables.y, acadoVariables.y + ACADO_NY, sizeof(real_t)*(ACADO_N - 1)*ACADO_NY);
+      memcpy(acadoVariables.y + (ACADO_N - 1)*ACADO_NY, yNew, sizeof(real_t)*ACADO_NY);
+    }
+#if ACADO_NYN
+    if (yNNew != 0 && yNNew != acadoVariables.yN)
+      memcpy(acadoVariables.yN, yNNew, sizeof(real_t)*ACADO_NYN);
+#endif
+    tic(&tmr);
+    preparationStep();
+    prepTime = toc(&tmr);
+  }
+  if (stats != 0) stats[1] = prepTime;
+
+  if (xNext != 0) memcpy(xNext, acadoVariables.x, sizeof(real_t)*(ACADO_N + 1)*ACADO_NX);
+  if (uNext != 0) memcpy(uNext, acadoVariables.u, sizeof(real_t)*ACADO_N*ACADO_NU);
+#if ACADO_NXA
+  if (zNext != 0) memcpy(zNext, acadoVariables.z, sizeof(real_t)*ACADO_N*ACADO_NXA);
+#endif
+  if (yNext != 0) memcpy(yNext, acadoVariables.y, sizeof(real_t)*ACADO_N*ACADO_NY);
+#if ACADO_NYN
+  if (yNNext != 0) memcpy(yNNext, acadoVariables.yN, sizeof(real_t)*ACADO_NYN);
+#endif
+
+  return ret;
+}
+
 int py_set_x(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.x, val, nr, nc, ACADO_N + 1, ACADO_NX); }
 int py_get_x(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.x, nr, nc, ACADO_N + 1, ACADO_NX); }
+real_t * py_get_ptr_x(void){ return acadoVariables.x; }
 
 int py_set_u(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.u, val, nr, nc, ACADO_N, ACADO_NU); }
 int py_get_u(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.u, nr, nc, ACADO_N, ACADO_NU); }
+real_t * py_get_ptr_u(void){ return acadoVariables.u; }
 
 #if ACADO_NP
 int py_set_p(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.p, val, nr, nc, ACADO_NP, 1); }
 int py_get_p(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.p, nr, nc, ACADO_NP, 1); }
+real_t * py_get_ptr_p(void){ return acadoVariables.p; }
 #endif
 
 #if ACADO_NXA
@@ -76,18 +149,21 @@ int py_set_z(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.z, val, nr, nc, ACADO_N, ACADO_NXA); }
 int py_get_z(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.z, nr, nc, ACADO_N, ACADO_NXA); }
+real_t * py_get_ptr_z(void){ return acadoVariables.z; }
 #endif
 
 int py_set_y(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.y, val, nr, nc, ACADO_N, ACADO_NY); }
 int py_get_y(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.y, nr, nc, ACADO_N, ACADO_NY); }
+real_t * py_get_ptr_y(void){ return acadoVariables.y; }
 
 #if ACADO_NYN
 int py_set_yN(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.yN, val, nr, nc, ACADO_NYN, 1); }
 int py_get_yN(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.yN, nr, nc, ACADO_NYN, 1); }
+real_t * py_get_ptr_yN(void){ return acadoVariables.yN; }
 #endif /* ACADO_NYN */
 
 #if ACADO_INITIAL_STATE_FIXED
@@ -95,6 +171,7 @@ int py_set_x0(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.x0, val, nr, nc, ACADO_NX, 1); }
 int py_get_x0(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.x0, nr, nc, ACADO_NX, 1); }
+real_t * py_get_ptr_x0(void){ return acadoVariables.x0; }
 #endif /* ACADO_INITIAL_STATE_FIXED */
 
 #if ACADO_WEIGHTING_MATRICES_TYPE == 1
@@ -102,19 +179,23 @@ int py_set_S(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.S, val, nr, nc, ACADO_NY, ACADO_NY); }
 int py_get_S(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.S, nr, nc, ACADO_NY, ACADO_NY); }
+real_t * py_get_ptr_S(void){ return acadoVariables.S; }
 int py_set_SN(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.SN, val, nr, nc, ACADO_NYN, ACADO_NYN); }
 int py_get_SN(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.SN, nr, nc, ACADO_NYN, ACADO_NYN); }
+real_t * py_get_ptr_SN(void){ return acadoVariables.SN; }
 #elif ACADO_WEIGHTING_MATRICES_TYPE == 2
 int py_set_S(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.S, val, nr, nc, ACADO_N * ACADO_NY, ACADO_NY); }
 int py_get_S(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.S, nr, nc, ACADO_N * ACADO_NY, ACADO_NY); }
+real_t * py_get_ptr_S(void){ return acadoVariables.S; }
 int py_set_SN(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.SN, val, nr, nc, ACADO_NYN, ACADO_NYN); }
 int py_get_SN(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.SN, nr, nc, ACADO_NYN, ACADO_NYN); }
+real_t * py_get_ptr_SN(void){ return acadoVariables.SN; }
 #endif /* ACADO_WEIGHTING_MATRICES_TYPE */
 
 #if ACADO_USE_ARRIVAL_COST == 1
@@ -122,16 +203,22 @@ int py_set_SAC(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.SAC, val, nr, nc, ACADO_NX, ACADO_NX); }
 int py_get_SAC(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.SAC, nr, nc, ACADO_NX, ACADO_NX); }
+real_t * py_get_ptr_SAC(void){ return acadoVariables.SAC; }
 int py_set_xAC(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.xAC, val, nr, nc, ACADO_NX, 1); }
 int py_get_xAC(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.xAC, nr, nc, ACADO_NX, 1); }
+real_t * py_get_ptr_xAC(void){ return acadoVariables.xAC; }
 int py_set_WL(real_t * val, const int nr, const int nc){
   return memcpyMat(acadoVariables.WL, val, nr, nc, ACADO_NX, ACADO_NX); }
 int py_get_WL(real_t * val, const int nr, const int nc){
   return memcpyMat(val, acadoVariables.WL, nr, nc, ACADO_NX, ACADO_NX); }
+real_t * py_get_ptr_WL(void){ return acadoVariables.WL; }
 #endif /* ACADO_USE_ARRIVAL_COST */
 
+/** Is real_t a double (can numpy arrays of doubles point at acadoVariables). */
+int py_real_t_is_double(void){ return sizeof(real_t) == sizeof(double); }
+
 /** Number of control/estimation intervals. */
 int py_get_ACADO_N(void){ return ACADO_N; }
 /** Number of differential variables. */
@@ -17,7 +17,6 @@
 
 import ctypes
 import numpy
-import copy
 import matplotlib.pyplot as plt
 import casadi as C
 import scipy
@@ -25,20 +24,106 @@ import os
 
 import rawe
 from Ocp import OcpExportOptions,Ocp,Mhe,Mpc
+from arrivalCost import ArrivalCost
+from lqr import dlqr
 from ..rtIntegrator import RtIntegratorOptions
-
-def dlqr(A, B, Q, R, N=None):
-
-    if N == None:
-        N = numpy.zeros((Q.shape[0],R.shape[0]))
-    raise Exception('scipy LQR does not work, soon we are gonna implement it in a reliable way')
-    P = scipy.linalg.solve_discrete_are(A, B, Q, R)
-
-    k1 = numpy.dot(numpy.dot(B.T, P), B) + R
-    k2 = numpy.dot(numpy.dot(B.T, P), A)
-    K = numpy.linalg.solve(k1,k2)
-
-    return K, P
+from ..utils.ringbuffer import RingBuffer
+from ..dae.outputsExport import CompiledOutputs
+
+def _unlocked(arrays, f, *args, **kwargs):
+    '''
+    Call f with the memory of arrays (and of the arrays they are views of) writeable.
+    '''
+    chain = []
+    for a in arrays:
+        while isinstance(a, numpy.ndarray):
+            chain.append((a, a.flags.writeable))
+            a = a.base
+    # a view can only be made writeable after the array it views
+    for (a, _) in reversed(chain):
+        a.flags.writeable = True
+    try:
+        return f(*args, **kwargs)
+    finally:
+        for (a, writeable) in chain:
+            a.flags.writeable = writeable
+
+class _TrackedArray(numpy.ndarray):
+    '''
+    An ndarray which remembers if it has been written to since it was last synced
+    with the solver. Writing to a view (ocp.x[k,:][j] = ...) marks its parent.
+
+    The memory is read-only (see _tracked) except for the write paths which mark it:
+    item/slice assignment, in-place operators, fill, ufuncs with out=, and numpy functions
+    like copyto on numpy versions which let subclasses intercept them (__array_function__).
+    Any other write, e.g. through numpy.asarray(ocp.x), raises instead of being missed.
+    '''
+    def __array_finalize__(self, obj):
+        self._dirty = True
+
+    def _markDirty(self):
+        a = self
+        while isinstance(a, _TrackedArray):
+            a._dirty = True
+            a = a.base
+
+    def _write(self, f, *args, **kwargs):
+        ret = _unlocked([self], f, *args, **kwargs)
+        self._markDirty()
+        return ret
+
+    def __setitem__(self, index, value):
+        self._write(numpy.ndarray.__setitem__, self, index, value)
+
+    def __setslice__(self, i, j, value):
+        self._write(numpy.ndarray.__setslice__, self, i, j, value)
+
+    def fill(self, value):
+        self._write(numpy.ndarray.fill, self, value)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # compute on plain ndarrays, and mark the outputs (this includes the in-place operators)
+        def plain(a):
+            return a.view(numpy.ndarray) if isinstance(a, _TrackedArray) else a
+        outs = kwargs.get('out', ())
+        tracked = [o for o in outs if isinstance(o, _TrackedArray)]
+        def call():
+            # the plain views of the outputs have to be made while they are writeable
+            if len(outs) > 0:
+                kwargs['out'] = tuple([plain(o) for o in outs])
+            return getattr(ufunc, method)(*[plain(a) for a in inputs], **kwargs)
+        ret = _unlocked(tracked, call)
+        for o in tracked:
+            o._markDirty()
+        if len(outs) == 0:
+            return ret
+        # give back the arrays which were passed, so that "a += b" keeps a
+        return outs[0] if len(outs) == 1 else outs
+
+    def __array_function__(self, func, types, args, kwargs):
+        # numpy functions which write to their first argument or to out=
+        written = []
+        if func in _firstArgumentWriters:
+            written.append(args[0])
+        out = kwargs.get('out')
+        written += list(out) if isinstance(out, tuple) else [out]
+        tracked = [a for a in written if isinstance(a, _TrackedArray)]
+        ret = _unlocked(tracked, numpy.ndarray.__array_function__, self, func, types, args, kwargs)
+        for a in tracked:
+            a._markDirty()
+        return ret
+
+_firstArgumentWriters = [getattr(numpy, _name) for _name in
+                         ['copyto','put','place','putmask','fill_diagonal','put_along_axis']
+                         if hasattr(numpy, _name)]
+
+def _tracked(value):
+    '''
+    a read-only C contiguous copy of value as a _TrackedArray
+    '''
+    owner = numpy.array(value, dtype=numpy.double, order='C')
+    owner.flags.writeable = False
+    return owner.view(_TrackedArray)
 
 def secretAccess(f):
     def blah(self,*args,**kwargs):
@@ -64,7 +149,18 @@ class OcpRT(object):
                  integratorOptions=None,
                  codegenOptions=None,
                  phase1Options=None,
-                 integratorMeasurements=None):
+                 integratorMeasurements=None,
+                 zeroCopy=False,
+                 logCapacity=10000,
+                 logDecimation=1):
+        '''
+        If zeroCopy is True, the canonical fields (x, u, y, S, ...) are numpy arrays
+        which point directly at the solver's memory. Nothing is copied between python and C
+        around preparationStep/feedbackStep/etc, and assigning to a field copies into that memory.
+
+        log() keeps the last logCapacity samples in preallocated buffers, and only every
+        logDecimation'th call to log() (or rtiStep(log=True)) is recorded.
+        '''
         if ocpOptions is None:
             ocpOptions=OcpExportOptions(),
         if integratorOptions is None:
@@ -77,9 +173,11 @@ class OcpRT(object):
         assert isinstance(ocp, Ocp), "OcpRT must be given an Ocp object, you gave: "+str(type(ocp))
 
         self._ocp = ocp
+        self._zeroCopy = False
         exportPath = self.ocp.exportCode(ocpOptions, integratorOptions,
                                          codegenOptions, phase1Options)
         self._exportPath = exportPath
+        self._codegenOptions = codegenOptions
         self._libpath = os.path.join(self._exportPath, 'ocp.so')
         self._lib = ctypes.cdll.LoadLibrary(self._libpath)
 
@@ -88,10 +186,15 @@ class OcpRT(object):
         self._lib.getObjective.restype = ctypes.c_double
         self._lib.preparationStepTimed.restype = ctypes.c_double
         self._lib.feedbackStepTimed.restype = ctypes.c_double
+        self._lib.rtiStep.restype = ctypes.c_int
 
         self.preparationTime = 0.0
         self.feedbackTime = 0.0
 
+        # bytes copied between python and the solver, only fields which were
+        # modified in python are sent and only fields which the solver changes are received
+        self.bytesTransferred = {'toC':0, 'fromC':0}
+
         self.x  = numpy.zeros((self._lib.py_get_ACADO_N()+1,
                                self._lib.py_get_ACADO_NX()))
         self.u  = numpy.zeros((self._lib.py_get_ACADO_N(),
@@ -126,27 +229,43 @@ class OcpRT(object):
         if self._lib.py_get_ACADO_INITIAL_STATE_FIXED():
             self.x0 = numpy.zeros(self._lib.py_get_ACADO_NX())
 
+        # preallocated outputs of rtiStep
+        self._rtiSolution = {'x':numpy.zeros(self.x.shape), 'u':numpy.zeros(self.u.shape)}
+        if hasattr(self, 'z'):
+            self._rtiSolution['z'] = numpy.zeros(self.z.shape)
+        self._rtiStats = numpy.zeros(4)
+
+        self._fieldNames = [name for name in self._canonicalNames if hasattr(self, name)]
+        self._setters = dict([(name, getattr(self._lib, 'py_set_'+name))
+                              for name in self._fieldNames])
+        self._getters = dict([(name, getattr(self._lib, 'py_get_'+name))
+                              for name in self._fieldNames])
+
         print 'initializing solver'
         self._lib.py_initialize()
-        self._getAll()
+        if zeroCopy:
+            self._makeViews()
+        else:
+            self._getAll(self._fieldNames)
 
+        assert type(logDecimation) is int and logDecimation > 0, \
+            "logDecimation must be a positive int, got: "+str(logDecimation)
+        self._logDecimation = logDecimation
+        self._logCalls = 0
         self._log = {}
         self._autologNames = []
         for field in self._canonicalNames:
             if hasattr(self, field):
                 self._autologNames.append(field)
-                self._log[field] = []
-        self._log['_kkt'] = []
-        self._log['_objective'] = []
-        self._log['_prep_time'] = []
-        self._log['_fb_time'] = []
+                self._log[field] = RingBuffer(logCapacity)
+        self._log['_kkt'] = RingBuffer(logCapacity)
+        self._log['_objective'] = RingBuffer(logCapacity)
+        self._log['_prep_time'] = RingBuffer(logCapacity)
+        self._log['_fb_time'] = RingBuffer(logCapacity)
 
         self._log['outputs'] = {}
         for outName in self.outputNames():
-            self._log['outputs'][outName] = []
-
-        # setup outputs function
-        self._outputsFun = self.ocp.dae.outputsFunWithSolve()
+            self._log['outputs'][outName] = RingBuffer(logCapacity)
 
         # export integrator
         self._integrator = rawe.RtIntegrator(self.ocp.dae, ts=self.ocp.ts,
@@ -154,6 +273,14 @@ class OcpRT(object):
                                              measurements=integratorMeasurements)
         self._integratorOptions = integratorOptions
 
+    @property
+    def _outputs(self):
+        # solving for xdot/z symbolically is expensive, so only do it if outputs are requested
+        if not hasattr(self, '_compiledOutputs'):
+            object.__setattr__(self, '_compiledOutputs',
+                               CompiledOutputs(self.ocp.dae, cgOptions=self._codegenOptions))
+        return self._compiledOutputs
+
     def xNames(self):
         return self.ocp.dae.xNames()
     def uNames(self):
@@ -162,12 +289,7 @@ class OcpRT(object):
         return self.ocp.dae.outputNames()
 
     def computeOutputs(self, x, u):
-        self._outputsFun.setInput(x,0)
-        self._outputsFun.setInput(u,1)
-        self._outputsFun.evaluate()
-        outs = [C.DMatrix(self._outputsFun.output(k))
-                for k in range(self._outputsFun.getNumOutputs())]
-        return numpy.squeeze(numpy.array(C.veccat(outs)))
+        return numpy.squeeze(self._outputs.evaluate(x, u))
 
     def __setattr__(self, name, value):
         if name in self._canonicalNames:
@@ -177,7 +299,13 @@ class OcpRT(object):
                 assert value.shape == getattr(self, name).shape, \
                     name+' has dimension '+str(getattr(self,name).shape)+' but you tried to '+\
                     'assign it something with dimension '+str(value.shape)
-            object.__setattr__(self, name, numpy.ascontiguousarray(value, dtype=numpy.double))
+            if self._zeroCopy and hasattr(self, name):
+                # copy into the solver's memory instead of replacing the view
+                getattr(self, name)[...] = value
+            else:
+                # always copy so that later changes to "value" can't bypass the dirty flag
+                value = _tracked(value)
+                object.__setattr__(self, name, value)
         else:
             if self._locked == 0:
                 raise Exception('you cannot set field "'+name+'"')
@@ -192,39 +320,53 @@ class OcpRT(object):
         (nr,nc) = sh
         ret = call(ctypes.c_void_p(mat.ctypes.data), nr, nc)
         assert 0 == ret, "dimension mismatch in "+str(call)
-        return call(ctypes.c_void_p(mat.ctypes.data), nr, nc)
+        return ret
+
+    @secretAccess
+    def _makeViews(self):
+        '''
+        Replace every canonical field with a numpy array pointing at acadoVariables.
+        '''
+        assert self._lib.py_real_t_is_double() == 1, "zero copy mode needs real_t to be double"
+        for name in self._canonicalNames:
+            if hasattr(self, name):
+                shape = getattr(self, name).shape
+                getPtr = getattr(self._lib, 'py_get_ptr_'+name)
+                getPtr.restype = ctypes.POINTER(ctypes.c_double)
+                view = numpy.ctypeslib.as_array(getPtr(), shape=shape)
+                object.__setattr__(self, name, view)
+        self._zeroCopy = True
+
+    # fields which the solver writes to in each call, all other fields are only read
+    _solverOutputs = ['x','u','z']
 
     def _setAll(self):
-        self._callMat(self._lib.py_set_x,  self.x)
-        self._callMat(self._lib.py_set_u,  self.u)
-        self._callMat(self._lib.py_set_y,  self.y)
-        self._callMat(self._lib.py_set_yN, self.yN)
-        self._callMat(self._lib.py_set_S,  self.S)
-        self._callMat(self._lib.py_set_SN, self.SN)
-        if self._lib.py_get_ACADO_INITIAL_STATE_FIXED():
-            self._callMat(self._lib.py_set_x0, self.x0)
-        if self._lib.py_get_ACADO_USE_ARRIVAL_COST():
-            self._callMat(self._lib.py_set_xAC, self.xAC)
-            self._callMat(self._lib.py_set_SAC, self.SAC)
-            self._callMat(self._lib.py_set_WL, self.WL)
-        if hasattr(self, 'z'):
-            self._callMat(self._lib.py_set_z, self.z)
-
-    def _getAll(self):
-        self._callMat(self._lib.py_get_x,  self.x)
-        self._callMat(self._lib.py_get_u,  self.u)
-        self._callMat(self._lib.py_get_y,  self.y)
-        self._callMat(self._lib.py_get_yN, self.yN)
-        self._callMat(self._lib.py_get_S,  self.S)
-        self._callMat(self._lib.py_get_SN, self.SN)
-        if self._lib.py_get_ACADO_INITIAL_STATE_FIXED():
-            self._callMat(self._lib.py_get_x0, self.x0)
-        if self._lib.py_get_ACADO_USE_ARRIVAL_COST():
-            self._callMat(self._lib.py_get_xAC, self.xAC)
-            self._callMat(self._lib.py_get_SAC, self.SAC)
-            self._callMat(self._lib.py_get_WL, self.WL)
-        if hasattr(self, 'z'):
-            self._callMat(self._lib.py_get_z, self.z)
+        '''
+        Send every field which was modified since it was last synced.
+        '''
+        if self._zeroCopy:
+            return
+        for name in self._fieldNames:
+            mat = getattr(self, name)
+            if mat._dirty:
+                self._callMat(self._setters[name], mat)
+                mat._dirty = False
+                self.bytesTransferred['toC'] += mat.nbytes
+
+    def _getAll(self, names=None):
+        '''
+        Copy fields from the solver, by default the ones the solver might have changed.
+        '''
+        if self._zeroCopy:
+            return
+        if names is None:
+            names = self._solverOutputs
+        for name in names:
+            if name in self._getters:
+                mat = getattr(self, name)
+                self._callMat(self._getters[name], mat)
+                mat._dirty = False
+                self.bytesTransferred['fromC'] += mat.nbytes
 
     def writeStateTxtFiles(self,prefix='',directory=None):
         '''
@@ -247,7 +389,8 @@ class OcpRT(object):
     def preparationStep(self):
         self._setAll()
         self.preparationTime = self._lib.preparationStepTimed()
-        self._getAll()
+        # the model simulation updates the algebraic states
+        self._getAll(['z'])
 
     @secretAccess
     def feedbackStep(self):
@@ -270,14 +413,13 @@ class OcpRT(object):
         self._lib.initializeNodesByForwardSimulation()
         self._getAll()
 
+    _shiftStrategies = {'copy':1, 'simulate':2}
+
     def shiftXZU(self,strategy='simulate', xEnd=None, uEnd=None):
         null_ptr = ctypes.POINTER(ctypes.c_double)()
-        if strategy == 'copy':
-            stratN = 1
-        elif strategy == 'simulate':
-            stratN = 2
-        else:
+        if strategy not in self._shiftStrategies:
             raise Exception('strategy: "'+str(strategy)+'" must be {simulate,copy}')
+        stratN = self._shiftStrategies[strategy]
 
         if xEnd is None:
             xptr = null_ptr
@@ -293,6 +435,95 @@ class OcpRT(object):
         self._lib.shiftControls(uptr)
         self._getAll()
 
+    @secretAccess
+    def rtiStep(self, x0=None, y=None, yN=None, strategy='simulate', log=False):
+        '''
+        One real time iteration in a single call to the solver, equivalent to:
+
+            ocp.x0 = x0
+            ocp.feedbackStep()
+            ocp.log()                         # if log is True
+            ocp.shiftXZU(strategy)
+            ocp.simpleShiftReference(y, yN)   # y and yN are optional
+            ocp.preparationStep()
+
+        Returns the solution of the feedback step as a dictionary with keys 'x', 'u' (and 'z').
+        These arrays are overwritten by the next call, copy them if you want to keep them.
+        Afterwards x/u/z/y/yN hold the shifted guess and reference for the next iteration.
+        '''
+        if strategy not in self._shiftStrategies:
+            raise Exception('strategy: "'+str(strategy)+'" must be {simulate,copy}')
+        if x0 is not None:
+            assert hasattr(self, 'x0'), "this ocp doesn't have a fixed initial state, x0 must be None"
+
+        self._setAll()
+        def ptr(mat):
+            if mat is None:
+                return None
+            return ctypes.c_void_p(mat.ctypes.data)
+        if x0 is not None:
+            x0 = numpy.ascontiguousarray(x0, dtype=numpy.double)
+            assert x0.size == self.x0.size, \
+                'x0 has dimension '+str(self.x0.shape)+' but you gave '+str(x0.shape)
+        if y is not None:
+            y = numpy.ascontiguousarray(y, dtype=numpy.double)
+            assert y.size == self.y.shape[1], \
+                'y has dimension '+str(self.y.shape[1])+' but you gave '+str(y.shape)
+        if yN is not None:
+            yN = numpy.ascontiguousarray(yN, dtype=numpy.double)
+            assert yN.size == self.yN.size, \
+                'yN has dimension '+str(self.yN.shape)+' but you gave '+str(yN.shape)
+
+        log = log and self._shouldLog()
+        if log:
+            fields = {}
+            for name in self._autologNames:
+                if name not in self._rtiSolution:
+                    fields[name] = numpy.array(getattr(self, name))
+            fields.update(self._rtiSolution)
+            if x0 is not None and 'x0' in fields:
+                # the feedback step uses the new x0
+                fields['x0'] = numpy.array(x0.reshape(self.x0.shape))
+
+        if self._zeroCopy:
+            # the fields already are the solver's memory
+            nextBufs = [None]*5
+        else:
+            nextBufs = [getattr(self, name, None) for name in ['x','u','z','y','yN']]
+        ret = self._lib.rtiStep(ptr(x0), ptr(y), ptr(yN), self._shiftStrategies[strategy],
+                                ptr(self._rtiSolution['x']),
+                                ptr(self._rtiSolution['u']),
+                                ptr(self._rtiSolution.get('z')),
+                                *([ptr(mat) for mat in nextBufs] + [ptr(self._rtiStats)]))
+        if x0 is not None:
+            # keep the python copy in sync without sending it again
+            self.x0[...] = x0.reshape(self.x0.shape)
+        if not self._zeroCopy:
+            for mat in nextBufs:
+                if mat is not None:
+                    mat._dirty = False
+                    self.bytesTransferred['fromC'] += mat.nbytes
+            if x0 is not None:
+                self.x0._dirty = False
+                self.bytesTransferred['toC'] += x0.nbytes
+
+        [fbTime, prepTime, kkt, objective] = self._rtiStats
+        if log:
+            self._appendLog(fields, kkt, objective, self.preparationTime, fbTime)
+        self.feedbackTime = fbTime
+        self.preparationTime = prepTime
+
+        if ret != 0:
+            raise Exception("feedbackStep returned error code "+str(ret))
+        nans = []
+        if numpy.any(numpy.isnan(self._rtiSolution['x'])):
+            nans.append('x')
+        if numpy.any(numpy.isnan(self._rtiSolution['u'])):
+            nans.append('u')
+        if len(nans) > 0:
+            raise Exception('qp solver returned success but NaNs found in '+str(nans))
+        return self._rtiSolution
+
     def pythonShiftXZU(self):
         '''
         There are N+1 states and N controls/alg vars in the trajectory.
@@ -385,57 +616,54 @@ class OcpRT(object):
         if new_yN != None:
             self.yN = new_yN
 
+    @secretAccess
+    def _shouldLog(self):
+        '''
+        count a call to log(), return True if this sample should be recorded
+        '''
+        self._logCalls += 1
+        return (self._logCalls - 1) % self._logDecimation == 0
+
     def log(self):
+        if not self._shouldLog():
+            return
+        fields = {}
         for field in self._autologNames:
             assert hasattr(self, field), \
                 "the \"impossible\" happened: ocprt doesn't have field \""+field+"\""
-            self._log[field].append(copy.deepcopy(getattr(self, field)))
-        self._log['_kkt'].append(self.getKKT())
-        self._log['_objective'].append(self.getObjective())
-        self._log['_prep_time'].append(self.preparationTime)
-        self._log['_fb_time'].append(self.feedbackTime)
-
-        ret = {}
-        for j,name in enumerate(self.outputNames()):
-            ret[name] = []
-        nu = self.u.shape[0]
-        for k in range(nu+1):
-            self._outputsFun.setInput(self.x[k,:],0)
-            if k < nu:
-                self._outputsFun.setInput(self.u[k,:],1)
-            else:
-                # at final state, set u=nan
-                self._outputsFun.setInput(numpy.nan*self.u[k-1,:],1)
-            self._outputsFun.evaluate()
-            for j,name in enumerate(self.outputNames()):
-                ret[name].append(numpy.array(self._outputsFun.output(j)))
+            fields[field] = getattr(self, field)
+        self._appendLog(fields, self.getKKT(), self.getObjective(),
+                        self.preparationTime, self.feedbackTime)
 
-        for outName in self.outputNames():
-            self._log['outputs'][outName].append(numpy.squeeze(ret[outName]))
+    def _appendLog(self, fields, kkt, objective, prepTime, fbTime):
+        for field in self._autologNames:
+            self._log[field].append(fields[field])
+        self._log['_kkt'].append(kkt)
+        self._log['_objective'].append(objective)
+        self._log['_prep_time'].append(prepTime)
+        self._log['_fb_time'].append(fbTime)
+
+        if len(self.outputNames()) > 0:
+            # all nodes in one call, at the final state u is nan
+            outs = self._outputs.evaluate(fields['x'], fields['u'])
+            for outName in self.outputNames():
+                self._log['outputs'][outName].append(self._outputs.column(outs, outName))
 
     def getLog(self,name):
+        '''
+        return a list with the logged trajectory of a state, control or output for every sample
+        '''
         # if it's a differential state
         if name in self.xNames():
-            index = self.xNames().index(name)
-            ys = []
-            for k in range(numpy.array(self._log['x']).shape[0]):
-                ys.append(numpy.array(self._log['x'])[k,:,index])
-            return ys
+            return list(self._log['x'].select((Ellipsis, self.xNames().index(name))))
 
         # if it's a control
         elif name in self.uNames():
-            index = self.uNames().index(name)
-            ys = []
-            for k in range(numpy.array(self._log['u']).shape[0]):
-                ys.append(numpy.array(self._log['u'])[k,:,index])
-            return ys
+            return list(self._log['u'].select((Ellipsis, self.uNames().index(name))))
 
         # if it's an output
         elif name in self.outputNames():
-            ys = []
-            for k in range(numpy.array(self._log['outputs'][name]).shape[0]):
-                ys.append(numpy.array(self._log['outputs'][name])[k,:])
-            return ys
+            return list(self._log['outputs'][name].select(Ellipsis))
 
         else:
             msg = 'ocpRT.getLog got unrecognized name: "'+name+'"'
@@ -458,8 +686,9 @@ class OcpRT(object):
         else:
             reset = 0
         self._setAll()
-        return self._lib.updateArrivalCost(reset)
-        self._getAll()
+        ret = self._lib.updateArrivalCost(reset)
+        self._getAll(['xAC','SAC'])
+        return ret
 
     def getKKT(self):
         self._setAll()
@@ -523,6 +752,8 @@ class OcpRT(object):
         if isinstance(names,str):
             names = [names]
         assert isinstance(names,list)
+        # time between logged samples
+        dt = self.ocp.ts*self._logDecimation
 
         def myStep(xs0,ys0,style):
             #plt.plot(xs0,ys0,'o')
@@ -545,30 +776,32 @@ class OcpRT(object):
             # if it's a differential state
             if name in self.xNames():
                 index = self.xNames().index(name)
+                logged = self._log['x'].select((Ellipsis, index))
                 if when == 'all':
-                    for k in range(numpy.array(self._log['x']).shape[0]):
-                        ys = numpy.array(self._log['x'])[k,:,index]
-                        ts = (offset + numpy.arange(len(ys)) + k)*self.ocp.ts
+                    for k in range(logged.shape[0]):
+                        ys = logged[k,:]
+                        ts = (offset + numpy.arange(len(ys)))*self.ocp.ts + k*dt
                         plt.plot(ts,ys,style)
                 else:
-                    ys = numpy.array(self._log['x'])[:,when,index]
-                    ts = numpy.arange(len(ys))*self.ocp.ts
+                    ys = logged[:,when]
+                    ts = numpy.arange(len(ys))*dt
                     plt.plot(ts,ys,style)
 
             # if it's a control
             if name in self.uNames():
                 index = self.uNames().index(name)
+                logged = self._log['u'].select((Ellipsis, index))
                 if when == 'all':
-                    for k in range(numpy.array(self._log['u']).shape[0]):
-                        ys = numpy.array(self._log['u'])[k,:,index]
-                        ts = (offset + numpy.arange(len(ys)) + k)*self.ocp.ts
+                    for k in range(logged.shape[0]):
+                        ys = logged[k,:]
+                        ts = (offset + numpy.arange(len(ys)))*self.ocp.ts + k*dt
                         if style == 'o':
                             plt.plot(ts,ys,style)
                         else:
                             myStep(ts,ys,style)
                 else:
-                    ys = numpy.array(self._log['u'])[:,when,index]
-                    ts = numpy.arange(len(ys))*self.ocp.ts
+                    ys = logged[:,when]
+                    ts = numpy.arange(len(ys))*dt
                     if style == 'o':
                         plt.plot(ts,ys,style)
                     else:
@@ -576,20 +809,21 @@ class OcpRT(object):
 
             # if it's an output
             if name in self.outputNames():
+                logged = numpy.array(self._log['outputs'][name])
                 if when == 'all':
-                    for k in range(numpy.array(self._log['outputs'][name]).shape[0]):
-                        ys = numpy.array(self._log['outputs'][name])[k,:]
-                        ts = (offset + numpy.arange(len(ys)) + k)*self.ocp.ts
+                    for k in range(logged.shape[0]):
+                        ys = logged[k,:]
+                        ts = (offset + numpy.arange(len(ys)))*self.ocp.ts + k*dt
                         plt.plot(ts,ys,style)
                 else:
-                    ys = numpy.array(self._log['outputs'][name])[:,when]
-                    ts = numpy.arange(len(ys))*self.ocp.ts
+                    ys = logged[:,when]
+                    ts = numpy.arange(len(ys))*dt
                     plt.plot(ts,ys,style)
 
             # if it's something else
             if name in ['_kkt','_objective','_prep_time','_fb_time']:
-                ys = numpy.array(self._log[name])[:]
-                ts = (offset + numpy.arange(len(ys)))*self.ocp.ts
+                ys = numpy.array(self._log[name])
+                ts = offset*self.ocp.ts + numpy.arange(len(ys))*dt
                 plt.plot(ts,ys,style)
 
         if title is not None:
@@ -607,7 +841,10 @@ class MpcRT(OcpRT):
                  ocpOptions=None,
                  integratorOptions=None,
                  codegenOptions=None,
-                 phase1Options=None):
+                 phase1Options=None,
+                 zeroCopy=False,
+                 logCapacity=10000,
+                 logDecimation=1):
         assert isinstance(ocp, Mpc), "MpcRT must be given an Mpc object, you gave: "+str(type(ocp))
 
         # call the parent init
@@ -615,7 +852,10 @@ class MpcRT(OcpRT):
                        ocpOptions=ocpOptions,
                        integratorOptions=integratorOptions,
                        codegenOptions=codegenOptions,
-                       phase1Options=phase1Options)
+                       phase1Options=phase1Options,
+                       zeroCopy=zeroCopy,
+                       logCapacity=logCapacity,
+                       logDecimation=logDecimation)
 
         # set up measurement functions
         self._yxFun = C.SXFunction([ocp.dae.xVec()], [C.densify(self.ocp.yx)])
@@ -625,20 +865,45 @@ class MpcRT(OcpRT):
 
         self._lqrDae = lqrDae
         self._integratorLQR  = rawe.RtIntegrator(self._lqrDae, ts=self.ocp.ts, options=integratorOptions)
+        self.K = None
+        self._lqrP = None
 
-    def computeLqr(self):
+    @secretAccess
+    def computeLqr(self, Q=None, R=None, x=None, u=None):
+        '''
+        Recompute the terminal weight SN (and the gain K) from an LQR around a reference.
+        The lqr dae is linearized at (x, u), by default the last reference y[-1,:] = [x, u].
+        Q and R default to the state and control blocks of S. The riccati equation is
+        warm started from the last solution, so calling this every few samples is cheap.
+        Returns (K, P).
+        '''
         nx = self.x.shape[1]
-
-        self._integratorLQR.x = self.y[-1,:nx]
-        self._integratorLQR.u = self.y[-1,nx:]
+        nu = self.u.shape[1]
+        if x is None:
+            x = self.y[-1,:nx]
+        if u is None:
+            u = self.y[-1,nx:nx+nu]
+        if Q is None or R is None:
+            assert self.S.shape == (nx+nu, nx+nu), \
+                "S isn't [x,u] by [x,u], so Q and R have to be given"
+            if Q is None:
+                Q = self.S[:nx,:nx]
+            if R is None:
+                R = self.S[nx:,nx:]
+
+        self._integratorLQR.x = x
+        self._integratorLQR.u = u
         self._integratorLQR.step()
         A = self._integratorLQR.dx1_dx0
         B = self._integratorLQR.dx1_du
 
-        K, P = dlqr(A, B, self.Q, self.R)
-
+        (K, P) = dlqr(A, B, Q, R, P0=self._lqrP)
+        assert P.shape == self.SN.shape, \
+            "the lqr gives a "+str(P.shape)+" terminal weight but SN is "+str(self.SN.shape)
         self.K = K
+        self._lqrP = P
         self.SN = P
+        return (K, P)
 
 
 class MheRT(OcpRT):
@@ -647,7 +912,10 @@ class MheRT(OcpRT):
                  ocpOptions=None,
                  integratorOptions=None,
                  codegenOptions=None,
-                 phase1Options=None):
+                 phase1Options=None,
+                 zeroCopy=False,
+                 logCapacity=10000,
+                 logDecimation=1):
         assert isinstance(ocp, Mhe), "MheRT must be given an Mhe object, you gave: "+str(type(ocp))
 
         # call the parent init
@@ -656,7 +924,10 @@ class MheRT(OcpRT):
                        integratorOptions=integratorOptions,
                        codegenOptions=codegenOptions,
                        phase1Options=phase1Options,
-                       integratorMeasurements=C.veccat([ocp.yx,ocp.yu]))
+                       integratorMeasurements=C.veccat([ocp.yx,ocp.yu]),
+                       zeroCopy=zeroCopy,
+                       logCapacity=logCapacity,
+                       logDecimation=logDecimation)
 
         # set up measurement functions
         self._yxFun = C.SXFunction([ocp.dae.xVec()], [C.densify(self.ocp.yx)])
@@ -674,90 +945,24 @@ class MheRT(OcpRT):
         self._yuFun.evaluate()
         return numpy.squeeze(numpy.array(self._yuFun.output(0)))
 
-#    def UpdateArrivalCost(self):
-#        ''' Arrival cost implementation.
-#            Approximate the solution of:
-#            min_{xL_,uL_,xL1_} ||  pL ( xL_-xL )         ||^2
-#                               ||  vL ( yL-h(xL_,uL_) )  ||
-#                               ||  wL wx                 ||_2
-#                         s.t.  wx = xL1_ - f(xL_,uL_)
-#            where:
-#                    PL = pL^T pL is the last kalman prediction covariance matrix
-#                    VL = vL^T vL is the measurement noise covariance matrix
-#                    WL = wL^T wL is the state noise covariance matrix
-#
-#            Linearization (at the last MHE estimate x,u which is different from xL,uL):
-#            f(xL_,uL_) ~= f(x,u) + df(x,u)/dx (xL_-x) + df(x,u)/du (uL_-u)
-#                       ~= f(x,u) +         Xx (xL_-x) +         Xu (uL_-u)
-#                       ~= f(x,u) - Xx x - Xu u + Xx xL_ + Xu uL_
-#                       ~= x_tilde              + Xx xL_ + Xu uL_
-#            h(xL_,uL_) ~= h(x,u) + dh(x,u)/dx (xL_-x) + dh(x,u)/du (uL_-u)
-#                       ~= f(x,u) +         Hx (xL_-x) +         Hu (uL_-u)
-#                       ~= h(x,u) - Hx x - Hu u + Hx xL_ + Hu uL_
-#                       ~= h_tilde              + Hx xL_ + Hu uL_
-#
-#            Linearized problem:
-#            min_{xL_,uL_,xL1_} ||  pL ( xL_ - xL )                          ||^2
-#                               ||  vL ( yL - h_tilde - Hx xL_ - Hu uL_ )    ||
-#                               ||  wL ( xL1_ - x_tilde - Xx xL_ - Xu uL_ )  ||_2
-#
-#            Rewrite as:
-#            min_{xL_,uL_,xL1_} ||  M ( xL_, uL_, xL1_ ) + res  ||^2_2
-#
-#            After QR factorization of M:
-#            min_{xL_,uL_,xL1_} ||  R ( xL_, uL_, xL1_ ) + rho  ||^2_2
-#
-#            '''
-#        pL = self.pL
-#        vL = self.vL
-#        wL = self.wL
-#
-#        xL = self.xL        # Last kalman update state prediction for the initial state
-#        yL = self.y[0,:]    # Initial measurement
-#
-#        x = self.x[0,:]     # Last MHE state prediction
-#        u = self.u[0,:]     # Last MHE control prediction
-#
-#        nx = x.shape[0]
-#        nu = u.shape[0]
-#        nV = vL.shape[0]
-#
-#        self._integrator_y.x = x
-#        self._integrator_y.u = u
-#        h = self._integrator_y.y
-#        x1 = self._integrator_y.step()
-#        Xx = self._integrator_y.dx1_dx0
-#        Xu = self._integrator_y.dx1_du
-#
-#        Hx = self._integrator_y.dh_dx0
-#        Hu = self._integrator_y.dh_du
-#
-#        x_tilde = x1 - numpy.dot(Xx,x) - numpy.dot(Xu,u)
-#        h_tilde =  h - numpy.dot(Hx,x) - numpy.dot(Hu,u)
-#
-#        res = numpy.bmat([ -numpy.dot(pL, xL),
-#                            numpy.dot(vL, yL - h_tilde),
-#                           -numpy.dot(wL, x_tilde) ])
-#        res = numpy.squeeze(numpy.array(res))
-#
-#        M = numpy.bmat([[                pL,  numpy.zeros((nx,nu)), numpy.zeros((nx,nx)) ],
-#                        [ -numpy.dot(vL,Hx),     -numpy.dot(vL,Hu), numpy.zeros((nV,nx)) ],
-#                        [ -numpy.dot(wL,Xx),     -numpy.dot(wL,Xu),                   wL ]])
-#
-#        Q, R = numpy.linalg.qr(M)
-#
-#    #    R1  = R[:nx+nu,:nx+nu]
-#    #    R12 = R[:nx+nu,nx+nu:]
-#        R2  = R[nx+nu:,nx+nu:]
-#
-#    #    rho = numpy.linalg.solve(Q,res)
-#        rho = numpy.squeeze(numpy.array(numpy.dot(Q.T,res)))
-#        rho2 = rho[nx+nu:]
-#
-#        pL1 = R2
-#        xL1 = -numpy.linalg.solve(R2,rho2)
-#
-#        self.pL = numpy.array( pL1 )
-#        self.AC = numpy.dot( pL1.T, pL1 )
-#
-#        self.xL = numpy.array( xL1 )
+    @secretAccess
+    def setupArrivalCost(self, xL, PL, VL, WL):
+        '''
+        Start the python side arrival cost (see ArrivalCost) with reference xL and square
+        root weight PL, and square root weights VL of the measurements y and WL of the state noise.
+        '''
+        self._arrivalCost = ArrivalCost(self._integrator, xL, PL, VL, WL)
+
+    def propagateArrivalCost(self):
+        '''
+        Move the arrival cost forward one sample using the first node of the current
+        estimate and its measurement y[0,:]. If the MHE was exported with an arrival cost
+        (CG_USE_ARRIVAL_COST), xAC and SAC are set to the new xL and PL^T PL.
+        Returns the new (PL, xL).
+        '''
+        assert hasattr(self, '_arrivalCost'), 'call setupArrivalCost first'
+        (PL, xL) = self._arrivalCost.update(self.x[0,:], self.u[0,:], self.y[0,:])
+        if hasattr(self, 'xAC'):
+            self.xAC = xL
+            self.SAC = numpy.dot(PL.T, PL)
+        return (PL, xL)
@@ -19,7 +19,7 @@ import ctypes
 import os
 from multiprocessing import Process, Queue
 
-from rawe.utils import codegen,pkgconfig,subprocess_tee
+from rawe.utils import codegen,pkgconfig,buildcache
 import writeAcadoOcpExport
 
 def makeExportMakefile(phase1Options):
@@ -59,9 +59,10 @@ clean :
 
 # This writes and runs the ocp exporter, returning an exported OCP as a
 # dictionary of files.
-def runPhase1(ocp, phase1Options, integratorOptions, ocpOptions):
+def runPhase1(ocp, phase1Options, integratorOptions, ocpOptions, linearInput=None):
     # write the ocp exporter cpp file
-    genfiles = {'export_ocp.cpp':writeAcadoOcpExport.generateAcadoOcp(ocp, integratorOptions, ocpOptions),
+    genfiles = {'export_ocp.cpp':writeAcadoOcpExport.generateAcadoOcp(ocp, integratorOptions, ocpOptions,
+                                                                      linearInput=linearInput),
                 'Makefile':makeExportMakefile(phase1Options)}
     # add a file which just runs the export in the current directory
     genfiles['run_export.cpp'] = '''\
@@ -71,12 +72,11 @@ int main(void){
     return exportOcp(".");
 }
 '''
-    exportpath = codegen.memoizeFiles(genfiles,prefix=phase1Options['hashPrefix']+'_phase1__')
-
-    # compile the ocp exporter
-    (ret, msgs) = subprocess_tee.call(['make',codegen.makeJobs()], cwd=exportpath)
-    if ret != 0:
-        raise Exception("exportOcp phase 1 compilation failed:\n\n"+msgs)
+    # compile the ocp exporter (or get it from the build cache)
+    exportpath = buildcache.memoizeBuild(genfiles, ['export_ocp.so','run_export'],
+                                         prefix=phase1Options['hashPrefix']+'_phase1__',
+                                         compilers=[phase1Options['CXX']],
+                                         errorMessage="exportOcp phase 1 compilation failed")
 
     # run the ocp exporter
     def runOcpExporter(path):
@@ -16,16 +16,26 @@
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-from rawe.utils import pkgconfig, codegen, subprocess_tee
+import copy
+from rawe.utils import pkgconfig, codegen, buildcache, buildscheduler
+
+# everything built by the Makefiles below
+products = ['ocp.so','ocp.a','ocp.o']
+
+workspace = '''\
+#include "acado_common.h"
+ACADOworkspace acadoWorkspace;
+ACADOvariables acadoVariables;
+'''
+
+def _visibilityFlags(cgOptions):
+    if cgOptions['hideSymbols']:
+        return (' -fvisibility=hidden', ' -fvisibility=hidden -fvisibility-inlines-hidden')
+    return ('', '')
 
 def mkMakefile(cgOptions, qposrc):
     qposrc = ' \\\n'.join(['\t'+os.path.join('qpoases', q.split('qpoases'+os.sep)[1]) for q in qposrc])
-    if cgOptions['hideSymbols']:
-        c_visibility = ' -fvisibility=hidden'
-        cxx_visibility = ' -fvisibility=hidden -fvisibility-inlines-hidden'
-    else:
-        c_visibility = ''
-        cxx_visibility = ''
+    (c_visibility, cxx_visibility) = _visibilityFlags(cgOptions)
 
     makefile = """\
 CXX      = %(CXX)s
@@ -118,6 +128,172 @@ clean :
     return makefile
 
 
+def mkQpoasesLibMakefile(cgOptions, qposrc):
+    qposrc = ' \\\n'.join(['\t'+os.path.join('qpoases', q.split('qpoases'+os.sep)[1]) for q in qposrc])
+    (c_visibility, cxx_visibility) = _visibilityFlags(cgOptions)
+
+    makefile = """\
+CXX      = %(CXX)s
+CC       = %(CC)s
+CXXFLAGS = %(CXXFLAGS)s%(cxx_visibility)s
+CFLAGS   = %(CFLAGS)s%(c_visibility)s
+
+CXX_SRC = \\
+%(qpo_src)s
+
+C_SRC = \\
+\tacado_auxiliary_functions.c
+
+QPO_INC = \\
+\t-I. \\
+\t-I./qpoases \\
+\t-I./qpoases/INCLUDE \\
+\t-I./qpoases/SRC
+
+CXXFLAGS += $(QPO_INC)
+CFLAGS   += $(QPO_INC)
+
+CXX_OBJ = $(CXX_SRC:%%.cpp=%%.o)
+C_OBJ = $(C_SRC:%%.c=%%.o)
+
+HEADERS = \\
+\tqpoases/solver.hpp \\
+\tacado_auxiliary_functions.h \\
+\tacado_common.h
+
+.PHONY: clean all
+all : libqpoases.a
+
+$(CXX_OBJ) : %%.o : %%.cpp $(HEADERS)
+\t@echo CXX $@: $(CXX) $(CXXFLAGS) -c $< -o $@
+\t@$(CXX) $(CXXFLAGS) -c $< -o $@
+
+$(C_OBJ) : %%.o : %%.c $(HEADERS)
+\t@echo CC $@: $(CC) $(CFLAGS) -c $< -o $@
+\t@$(CC) $(CFLAGS) -c $< -o $@
+
+libqpoases.a : $(CXX_OBJ) $(C_OBJ)
+\t@echo AR $@ : ar rcs $@ $(CXX_OBJ) $(C_OBJ)
+\t@ar rcs $@ $(CXX_OBJ) $(C_OBJ)
+
+clean :
+\t@rm -f libqpoases.a $(CXX_OBJ) $(C_OBJ)
+""" % {'CXX':cgOptions['CXX'], 'CC':cgOptions['CC'],
+       'CXXFLAGS':cgOptions['CXXFLAGS'], 'CFLAGS':cgOptions['CFLAGS'],
+       'c_visibility':c_visibility,
+       'cxx_visibility':cxx_visibility,
+       'qpo_src':qposrc}
+    return makefile
+
+def mkLinkedMakefile(cgOptions, qpoasesLibPath):
+    (c_visibility, cxx_visibility) = _visibilityFlags(cgOptions)
+
+    makefile = """\
+CXX      = %(CXX)s
+CC       = %(CC)s
+CXXFLAGS = %(CXXFLAGS)s%(cxx_visibility)s
+CFLAGS   = %(CFLAGS)s%(c_visibility)s
+
+LDFLAGS = -lm
+
+UNAME := $(shell uname)
+ifneq ($(UNAME),Darwin)
+\tLDFLAGS += -lrt
+endif
+
+# prebuilt qpOASES and acado auxiliary functions, shared with other exports
+QPOASES_LIB_PATH = %(qpoasesLibPath)s
+QPOASES_LIB = $(QPOASES_LIB_PATH)/libqpoases.a
+
+CXX_SRC = \\
+\trhs.cpp \\
+\trhsJacob.cpp \\
+\tacado_external_functions.cpp \\
+\tqpoases/solver.cpp
+
+C_SRC = \\
+\tworkspace.c \\
+\tpython_interface.c \\
+\tmodel.c \\
+\tacado_integrator.c \\
+\tacado_solver.c
+
+QPO_INC = \\
+\t-I. \\
+\t-I./qpoases \\
+\t-I$(QPOASES_LIB_PATH)/qpoases/INCLUDE \\
+\t-I$(QPOASES_LIB_PATH)/qpoases/SRC
+
+CXXFLAGS += $(QPO_INC)
+CFLAGS   += $(QPO_INC)
+
+CXX_OBJ = $(CXX_SRC:%%.cpp=%%.o)
+C_OBJ = $(C_SRC:%%.c=%%.o)
+
+HEADERS = \\
+\tqpoases/solver.hpp \\
+\tacado_auxiliary_functions.h \\
+\tacado_common.h
+
+.PHONY: clean all
+all : $(CXX_OBJ) $(C_OBJ) ocp.a ocp.so ocp.o
+
+$(CXX_OBJ) : %%.o : %%.cpp $(HEADERS)
+\t@echo CXX $@: $(CXX) $(CXXFLAGS) -c $< -o $@
+\t@$(CXX) $(CXXFLAGS) -c $< -o $@
+
+model.o :: CFLAGS += -Wall -Wextra -Werror -Wno-unused-variable
+workspace.o :: CFLAGS += -Wall -Wextra -Werror
+python_interface.o :: CFLAGS += -Wall -Wextra -Werror
+$(C_OBJ) : %%.o : %%.c $(HEADERS)
+\t@echo CC $@: $(CC) $(CFLAGS) -c $< -o $@
+\t@$(CC) $(CFLAGS) -c $< -o $@
+
+# link the whole library so that ocp.so, ocp.a and ocp.o all contain
+# every qpOASES and acado auxiliary function, just like a standalone export
+ocp.so : $(CXX_OBJ) $(C_OBJ) $(QPOASES_LIB)
+\t@echo LD $@: $(CXX) -shared -o $@ $(CXX_OBJ) $(C_OBJ) $(QPOASES_LIB) $(LDFLAGS)
+\t@$(CXX) -shared -o $@ $(CXX_OBJ) $(C_OBJ) -Wl,--whole-archive $(QPOASES_LIB) -Wl,--no-whole-archive $(LDFLAGS)
+
+ocp.a : $(CXX_OBJ) $(C_OBJ) $(QPOASES_LIB)
+\t@echo AR $@ : ar r $@ $(CXX_OBJ) $(C_OBJ) + $(QPOASES_LIB)
+\t@cp $(QPOASES_LIB) $@
+\t@ar r $@ $(CXX_OBJ) $(C_OBJ)
+
+ocp.o : $(CXX_OBJ) $(C_OBJ) $(QPOASES_LIB)
+\t@echo ld $@ : ld -r $(CXX_OBJ) $(C_OBJ) --whole-archive $(QPOASES_LIB) -o $@
+\t@ld -r $(CXX_OBJ) $(C_OBJ) --whole-archive $(QPOASES_LIB) --no-whole-archive -o $@
+
+clean :
+\t@echo rm -f ocp.a $(CXX_OBJ) $(C_OBJ) ocp.so
+\t@rm -f ocp.a ocp.so ocp.o $(CXX_OBJ) $(C_OBJ)
+""" % {'CXX':cgOptions['CXX'], 'CC':cgOptions['CC'],
+       'CXXFLAGS':cgOptions['CXXFLAGS'], 'CFLAGS':cgOptions['CFLAGS'],
+       'c_visibility':c_visibility,
+       'cxx_visibility':cxx_visibility,
+       'qpoasesLibPath':qpoasesLibPath}
+    return makefile
+
+def buildQpoasesLib(cgOptions, qpoasesSrc, qposrcFiles, phase1src):
+    '''
+    Compile qpOASES and the acado auxiliary functions into a static library
+    and return the directory it's in.
+
+    The qpOASES sources see the QP dimensions through the generated qpoases/solver.hpp
+    and acado_common.h, so the library is memoized on those headers and the compiler flags.
+    Every export with the same QP dimensions links against the same library.
+    '''
+    libfiles = {'qpoases':dict(qpoasesSrc),
+                'acado_common.h':phase1src['acado_common.h'],
+                'acado_auxiliary_functions.h':phase1src['acado_auxiliary_functions.h'],
+                'acado_auxiliary_functions.c':phase1src['acado_auxiliary_functions.c'],
+                'Makefile':mkQpoasesLibMakefile(cgOptions, qposrcFiles)}
+    libfiles['qpoases']['solver.hpp'] = phase1src['qpoases']['solver.hpp']
+    return buildcache.memoizeBuild(libfiles, ['libqpoases.a'],
+                                   prefix='qpoases_lib__',
+                                   compilers=[cgOptions['CC'], cgOptions['CXX']],
+                                   errorMessage="qpOASES library compilation failed")
+
 def exportPhase2(cgOptions, phase1src):
     # call pkg-config to get qpoases source and includes
     qpoStuff = {}
@@ -140,15 +316,11 @@ def exportPhase2(cgOptions, phase1src):
             else:
                 destdict[name] = src
         return destdict
-    genfiles = mergeAll(phase1src, {'qpoases':phase2src})
+    genfiles = mergeAll(phase1src, {'qpoases':copy.deepcopy(phase2src)})
 
     # add makefile
     genfiles['Makefile'] = mkMakefile(cgOptions, qpoStuff['qpOASESsrc'])
-    genfiles['workspace.c'] ='''\
-#include "acado_common.h"
-ACADOworkspace acadoWorkspace;
-ACADOvariables acadoVariables;
-'''
+    genfiles['workspace.c'] = workspace
 
     # write things in user specified directory if 'export_without_build_path' is not None
     # then return without building
@@ -161,14 +333,21 @@ ACADOvariables acadoVariables;
     if cgOptions['force_export_path'] is not None:
         codegen.writeDifferentFiles(cgOptions['force_export_path'], genfiles)
         exportpath = cgOptions['force_export_path']
-    # otherwise write things in memoized directory, then compile as normal
-    else:
-        exportpath = codegen.memoizeFiles(genfiles,prefix=cgOptions['hashPrefix']+'__')
 
-    # compile!
-    (ret, msgs) = subprocess_tee.call(['make',codegen.makeJobs()], cwd=exportpath)
-    if ret != 0:
-        raise Exception("ocp compilation failed:\n\n"+msgs)
+        # compile!
+        buildscheduler.make(exportpath, "ocp compilation failed")
+    # otherwise compile in the memoized directory, skipping make if it's already built.
+    # Instead of compiling qpOASES again, link against a shared prebuilt library.
+    else:
+        qpoasesLibPath = buildQpoasesLib(cgOptions, phase2src, qpoStuff['qpOASESsrc'], phase1src)
+        genfiles = dict(phase1src)
+        genfiles['Makefile'] = mkLinkedMakefile(cgOptions, qpoasesLibPath)
+        genfiles['workspace.c'] = workspace
+        exportpath = buildcache.memoizeBuild(genfiles, products,
+                                             prefix=cgOptions['hashPrefix']+'__',
+                                             compilers=[cgOptions['CC'], cgOptions['CXX']],
+                                             errorMessage="ocp compilation failed",
+                                             dependencies=[qpoasesLibPath])
 
     # return shared object
     return exportpath
@@ -17,6 +17,8 @@
 
 import casadi as C
 
+from ..rtIntegrator.rtModelExport import linearInputSource
+
 replace0 = {'real':'IntermediateState',
             'work':'_work',
             'init':'',
@@ -206,7 +208,7 @@ def writeAcadoAlgorithm(ocp, dae):
 
     return (algStrings, constraintData)
 
-def generateAcadoOcp(ocp, integratorOptions, ocpOptions):
+def generateAcadoOcp(ocp, integratorOptions, ocpOptions, linearInput=None):
     dae = ocp.dae
     #print "WARNING: RE-ENABLE PARAMETER UNSUPPORTED ASSERTION"
     assert len(dae.pNames()) == 0, 'parameters not supported by acado codegen'
@@ -258,10 +260,9 @@ def generateAcadoOcp(ocp, integratorOptions, ocpOptions):
 const int N = %(N)d;
 const double Ts = 1.0;
 OCP _ocp(0, N * Ts, N);
-_ocp.setModel( "model", "rhs", "rhsJacob" );
-_ocp.setDimensions( %(nx)d, %(nx)d, %(nz)d, %(nup)d );
+%(model)s
 //_ocp.subjectTo( _differentialEquation );
-''' % {'nx':len(dae.xNames()), 'nz':len(dae.zNames()), 'nup':len(dae.uNames())+len(dae.pNames()),'N':ocp.N})
+''' % {'model':'\n'.join(linearInputSource(dae, ocp.ts, linearInput, '_ocp')),'N':ocp.N})
 
     lines.append('/* complex constraints */')
     for (k, comparison, when) in constraintData:
@@ -347,6 +348,9 @@ OCPexport _ocpe( _ocp );\
     # write integrator options
     lines.append('\n/* integrator options */')
     for name,val in iter(sorted(integratorOptions.getAcadoOpts().items())):
+        # handled by the model above
+        if name == 'LINEAR_INPUT':
+            continue
         # multiply NUM_INTEGRATOR_STEPS by number of control intervals
         if name == 'NUM_INTEGRATOR_STEPS':
             val = repr(integratorOptions['NUM_INTEGRATOR_STEPS']*ocp.N)
@@ -16,3 +16,4 @@
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
 from rtIntegrator import RtIntegrator, RtIntegratorOptions
+from adaptiveRtIntegrator import AdaptiveRtIntegrator
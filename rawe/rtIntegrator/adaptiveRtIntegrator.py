@@ -0,0 +1,192 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+from rtIntegrator import RtIntegrator, RtIntegratorOptions
+
+# order of accuracy of each fixed step integrator
+integratorOrders = {'INT_EX_EULER':1,
+                    'INT_RK2':2, 'INT_RK3':3, 'INT_RK4':4,
+                    'INT_IRK_GL2':2, 'INT_IRK_GL4':4, 'INT_IRK_GL6':6, 'INT_IRK_GL8':8,
+                    'INT_IRK_RIIA1':1, 'INT_IRK_RIIA3':3, 'INT_IRK_RIIA5':5,
+                    'INT_DIRK3':3, 'INT_DIRK4':4, 'INT_DIRK5':5}
+
+# the lower order integrator which estimates the error of each integrator, like the
+# embedded method of a Runge-Kutta pair
+errorEstimators = {'INT_RK2':'INT_EX_EULER', 'INT_RK3':'INT_RK2', 'INT_RK4':'INT_RK3',
+                   'INT_IRK_GL2':'INT_IRK_RIIA1', 'INT_IRK_GL4':'INT_IRK_GL2',
+                   'INT_IRK_GL6':'INT_IRK_GL4', 'INT_IRK_GL8':'INT_IRK_GL6',
+                   'INT_IRK_RIIA3':'INT_IRK_RIIA1', 'INT_IRK_RIIA5':'INT_IRK_RIIA3',
+                   'INT_DIRK3':'INT_IRK_RIIA1', 'INT_DIRK4':'INT_DIRK3', 'INT_DIRK5':'INT_DIRK4'}
+
+def _optionsWith(options, changes):
+    # a copy of options with some of them changed, options can only be set once
+    ret = RtIntegratorOptions()
+    for name in options._options:
+        ret[name] = changes.get(name, options[name])
+    return ret
+
+class AdaptiveRtIntegrator(object):
+    '''
+    Integrate over ts with as many substeps (a power of two, at most maxSubsteps)
+    as needed to meet the error tolerance.
+
+    The exported integrators have a fixed step, so level j uses an integrator exported with
+    timestep ts/2**j and takes 2**j substeps in one rollout call. The error of level j is
+    estimated with a lower order integrator (see errorEstimators) with the same number of
+    substeps, exported without sensitivities:
+
+        err = max_i |x_j[i] - xlow_j[i]| / (atol + rtol*|x_j[i]|)
+
+    which is the error of the lower order solution, so it's conservative for x_j.
+    x_j is accepted if err <= 1. Otherwise the level is raised by as much as the order of the
+    estimator says is needed, until the budget is used up, so a finer level is only integrated
+    when a step is rejected. The level is lowered again for the next step when level j-1
+    would have met the tolerance. Each integrator is exported once (or taken from the build
+    cache), the first time it's needed.
+
+    After step(), x, z, dx1_dx0, dx1_du, dx1_dp are those of the accepted solution,
+    'error' is the achieved scaled error estimate, 'substeps' the number of substeps of
+    the accepted solution and 'work' counts the total effort so far.
+    '''
+    def __init__(self, dae, ts, options=RtIntegratorOptions(),
+                 rtol=1e-6, atol=1e-8, maxSubsteps=16):
+        assert options['INTEGRATOR_TYPE'] in errorEstimators, \
+            "no error estimate for INTEGRATOR_TYPE "+str(options['INTEGRATOR_TYPE'])+\
+            ", use one of "+str(sorted(errorEstimators.keys()))
+        assert type(maxSubsteps) is int and maxSubsteps >= 1 and \
+            (maxSubsteps & (maxSubsteps-1)) == 0, \
+            "maxSubsteps must be a power of two, got: "+str(maxSubsteps)
+        assert rtol >= 0 and atol >= 0 and rtol + atol > 0, "need a positive tolerance"
+        self._dae = dae
+        self._ts = ts
+        self._options = options
+        self._estimatorType = errorEstimators[options['INTEGRATOR_TYPE']]
+        self._estimatorOrder = integratorOrders[self._estimatorType]
+        self._maxLevel = int(numpy.log2(maxSubsteps))
+        self.rtol = rtol
+        self.atol = atol
+
+        # level j integrator and error estimator, created when first needed
+        self._integrators = {}
+        self._estimators = {}
+        self._warmLevels = set()
+        self._level = 0
+        nx = len(dae.xNames())
+        nz = len(dae.zNames())
+        nu = len(dae.uNames())
+        np = len(dae.pNames())
+        self.x = numpy.zeros(nx)
+        self.z = numpy.zeros(nz)
+        self.u = numpy.zeros(nu)
+        self.p = numpy.zeros(np)
+        self.dx1_dx0 = numpy.zeros((nx, nx))
+        self.dx1_du = numpy.zeros((nx, nu))
+        self.dx1_dp = numpy.zeros((nx, np))
+        self.error = 0.0
+        self.substeps = 0
+        self.resetWork()
+
+    def resetWork(self):
+        '''
+        zero the work counters: 'steps' (calls to step), 'substeps' (integrator intervals with
+        sensitivities, including rejected ones), 'estimatorSubsteps' (intervals of the lower order
+        error estimator, without sensitivities), 'refinements' (times a step was rejected and the
+        number of substeps was raised) and 'budgetExceeded' (steps which didn't meet the
+        tolerance with maxSubsteps)
+        '''
+        self.work = {'steps':0, 'substeps':0, 'estimatorSubsteps':0,
+                     'refinements':0, 'budgetExceeded':0}
+
+    def _integrator(self, level):
+        if level not in self._integrators:
+            self._integrators[level] = \
+                RtIntegrator(self._dae, self._ts/float(2**level), options=self._options)
+        return self._integrators[level]
+
+    def _integrate(self, level):
+        integrator = self._integrator(level)
+        integrator.z = self.z
+        N = 2**level
+        ret = integrator.rollout(self.x, numpy.tile(self.u, (N,1)), self.p, sensitivities=True,
+                                 reset=level not in self._warmLevels)
+        self._warmLevels.add(level)
+        self.work['substeps'] += N
+        return ret
+
+    def _estimate(self, level):
+        # x1 of the lower order integrator with the same substeps, which needs no sensitivities
+        if level not in self._estimators:
+            numSteps = self._options['NUM_INTEGRATOR_STEPS']*2**level
+            options = _optionsWith(self._options, {'INTEGRATOR_TYPE':self._estimatorType,
+                                                   'NUM_INTEGRATOR_STEPS':numSteps})
+            self._estimators[level] = RtIntegrator(self._dae, self._ts, options=options)
+        estimator = self._estimators[level]
+        estimator.z = self.z
+        self.work['estimatorSubsteps'] += 2**level
+        return estimator.step(self.x, self.u, self.p, sensitivities=False)
+
+    def _scaledError(self, estimate, x):
+        est = numpy.abs(x - estimate)
+        return numpy.max(est/(self.atol + self.rtol*numpy.abs(x))) if est.size > 0 else 0.0
+
+    def step(self, x=None, u=None, p=None):
+        # x,u,p can be dicts or array-like
+        # if x is a dict, the return value is a dict, otherwise it's a numpy array
+        def vectorize(val, names):
+            if type(val) == dict:
+                val = [val[n] for n in names]
+            return numpy.array(val, dtype=numpy.double).flatten()
+        if x is not None:
+            self.x = vectorize(x, self._dae.xNames())
+        if u is not None:
+            self.u = vectorize(u, self._dae.uNames())
+        if p is not None:
+            self.p = vectorize(p, self._dae.pNames())
+
+        level = self._level
+        while True:
+            sol = self._integrate(level)
+            err = self._scaledError(self._estimate(level), sol['x'][-1,:])
+            if err <= 1 or level >= self._maxLevel:
+                break
+            # the estimate goes down by 2**order for every doubling of the substeps
+            levels = int(numpy.ceil(numpy.log2(err)/self._estimatorOrder))
+            level = min(level + max(levels, 1), self._maxLevel)
+            self.work['refinements'] += 1
+        if err > 1:
+            self.work['budgetExceeded'] += 1
+        self.work['steps'] += 1
+
+        if err*2**self._estimatorOrder <= 1 and level > 0:
+            self._level = level - 1
+        else:
+            self._level = level
+
+        self.error = err
+        self.substeps = 2**level
+        self.x = sol['x'][-1,:]
+        self.z = sol['z'][0,:]
+        self.dx1_dx0 = sol['dxN_dx0']
+        # the control is held over all substeps
+        self.dx1_du = numpy.sum(sol['dxN_dU'], axis=1)
+        self.dx1_dp = sol['dxN_dp']
+
+        if type(x) == dict:
+            return dict(zip(self._dae.xNames(), self.x))
+        return numpy.copy(self.x)
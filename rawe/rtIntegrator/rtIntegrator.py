@@ -21,8 +21,10 @@ import numpy
 import casadi as C
 
 from rtIntegratorExport import exportIntegrator
+import rtModelExport
 
 from ..utils import codegen, subprocess_tee
+from ..dae.outputsExport import CompiledOutputs
 from ..utils.options import Options, OptStr, OptInt, OptBool
 import matplotlib.pyplot as plt
 
@@ -43,6 +45,9 @@ class RtIntegratorOptions(Options):
         self.add(OptInt('IMPLICIT_INTEGRATOR_NUM_ITS',default=3))
         self.add(OptInt('IMPLICIT_INTEGRATOR_NUM_ITS_INIT',default=0))
         self.add(OptBool('UNROLL_LINEAR_SOLVER',default=False))
+        # propagate the leading states in closed form if they are a linear input subsystem
+        # (see rawe.dae.detectLinearSubsystems.linearInputSubsystem), not an acado option
+        self.add(OptBool('LINEAR_INPUT',default=False))
 #        self.add(OptStr('MEASUREMENT_GRID',['EQUIDISTANT_SUBGRID','EQUIDISTANT_GRID','ONLINE_GRID']))
 
 class RtIntegrator(object):
@@ -128,6 +133,7 @@ class RtIntegrator(object):
     def __init__(self, dae, ts, measurements=None, options=RtIntegratorOptions()):
         self._dae = dae
         self._ts = ts
+        self._options = options
         if measurements is None:
             self._measurements = measurements
         else:
@@ -135,15 +141,19 @@ class RtIntegrator(object):
                 measurements = C.veccat(measurements)
             self._measurements = measurements
 
-        # setup outputs function
-        self._outputsFun = self._dae.outputsFunWithSolve()
-
         (integratorLib, modelLib, rtModelGen) = exportIntegrator(self._dae, ts, options, self._measurements)
         self._integratorLib = integratorLib
         self._modelLib = modelLib
         self._rtModelGen = rtModelGen
 
+        # Every instance integrates with its own workspace, so several integrators of the same
+        # model can be used at once, also from different threads (ctypes releases the GIL).
+        self._instance = numpy.zeros(self._integratorLib.instanceSize()/8 + 1)
+        self._instancePtr = ctypes.c_void_p(self._instance.ctypes.data)
+
         self._initIntegrator = 1
+        # exported on demand by _sensitivityFreeIntegrator, by number of seeds
+        self._sensitivityFreeIntegrators = {}
 
         nx = len( self._dae.xNames() )
         nz = len( self._dae.zNames() )
@@ -186,6 +196,21 @@ class RtIntegrator(object):
             self.dh_du = numpy.zeros( (nh, nu) )
             self.dh_dp = numpy.zeros( (nh, np) )
 
+    @property
+    def _outputs(self):
+        # solving for xdot/z symbolically is expensive, so only do it if outputs are requested
+        if not hasattr(self, '_compiledOutputs'):
+            self._compiledOutputs = CompiledOutputs(self._dae)
+        return self._compiledOutputs
+
+    def _getRtModelGen(self):
+        # the symbolic model is not generated if the integrator was loaded from the build cache
+        if self._rtModelGen is None:
+            linearInput = rtModelExport.linearInput(self._dae, self._options, self._measurements)
+            self._rtModelGen = rtModelExport.generateCModel(self._dae, self._ts, self._measurements,
+                                                            linearInput=linearInput)
+        return self._rtModelGen
+
     def log(self,new_x=None,new_u=None,new_y=None,new_yN=None,new_out=None):
         if new_x != None:
             self._log['x'].append(numpy.array(new_x))
@@ -243,6 +268,8 @@ class RtIntegrator(object):
         z    = numpy.array([z[n]    for n in self._dae.zNames()],dtype=numpy.double)
         u    = numpy.array([u[n]    for n in self._dae.uNames()],dtype=numpy.double)
         p    = numpy.array([p[n]    for n in self._dae.pNames()],dtype=numpy.double)
+        assert not self._options['LINEAR_INPUT'], \
+            "the exported rhs is only the nonlinear part with the LINEAR_INPUT option"
         dataIn = numpy.concatenate((x,z,u,p,xdot))
         dataOut = numpy.zeros(x.size + z.size, dtype=numpy.double)
 
@@ -251,7 +278,7 @@ class RtIntegrator(object):
                            )
 
         if compareWithSX:
-            f = self._rtModelGen['rhs']
+            f = self._getRtModelGen()['rhs']
             f.setInput(dataIn)
             f.evaluate()
             print f.output() - dataOut
@@ -264,6 +291,8 @@ class RtIntegrator(object):
         z    = numpy.array([z[n]    for n in self._dae.zNames()],dtype=numpy.double)
         u    = numpy.array([u[n]    for n in self._dae.uNames()],dtype=numpy.double)
         p    = numpy.array([p[n]    for n in self._dae.pNames()],dtype=numpy.double)
+        assert not self._options['LINEAR_INPUT'], \
+            "the exported rhsJacob is only the nonlinear part with the LINEAR_INPUT option"
         dataIn = numpy.concatenate((x,z,u,p,xdot))
         dataOut = numpy.zeros((x.size + z.size)*(2*x.size+z.size+u.size+p.size), dtype=numpy.double)
 
@@ -271,7 +300,7 @@ class RtIntegrator(object):
                                ctypes.c_void_p(dataOut.ctypes.data),
                                )
         if compareWithSX:
-            f = self._rtModelGen['rhsJacob']
+            f = self._getRtModelGen()['rhsJacob']
             f.setInput(dataIn)
             f.evaluate()
             print (f.output() - dataOut)
@@ -280,10 +309,21 @@ class RtIntegrator(object):
     def run(self,*args,**kwargs):
         raise Exception("to step an rt integrator, you now have to call .step(x,u,p) instead of .run(x,u,p)")
 
-    def step(self,x=None,u=None,p=None):
-        # x,u,p can be dicts or array-like
-        # if x is a dict, the return value is a dict, otherwise it's a numpy array
-
+    def step(self,x=None,u=None,p=None,sensitivities=True):
+        '''
+        Integrate one timestep from x with controls u and parameters p.
+        x,u,p can be dicts or array-like
+        if x is a dict, the return value is a dict, otherwise it's a numpy array
+
+        sensitivities selects what is computed besides x, z (and h):
+          True:  all jacobians (dx1_dx0, dz0_dx0, dx1_du, ..., dh_dp)
+          False: none of them, for plain simulation
+          seeds: only the directional sensitivities J*seeds of J = d(x1,z0,h)/d(x0,u,p), where
+                 seeds is an (nx+nu+np) by numDirections array of directions [dx0; du; dp].
+                 They go in dx1_dseed, dz0_dseed (and dh_dseed).
+        The last two use separate integrators which are exported the first time they're needed.
+        They don't touch the jacobians, which keep the values of the last full step.
+        '''
         # vectorize inputs
         if x != None:
             self.x = x
@@ -292,18 +332,35 @@ class RtIntegrator(object):
         if p != None:
             self.p = p
 
+        if sensitivities is True:
+            self._stepFull()
+        else:
+            self._stepDirectional(sensitivities)
+
+        # devectorize outputs
+        if x != None and type(x) == dict:
+            xret = {}
+            for k,name in enumerate(self._dae.xNames()):
+                xret[name] = self.x[k]
+        else:
+            xret = numpy.copy(self.x)
+        return xret
+
+    def _stepFull(self):
         # call integrator
         self._setData()
         if self._measurements is None:
-            ret = self._integratorLib.integrate(ctypes.c_void_p(self._data.ctypes.data),
-                                                self._initIntegrator)
+            ret = self._integratorLib.integrateInstance(self._instancePtr,
+                                                        ctypes.c_void_p(self._data.ctypes.data),
+                                                        self._initIntegrator)
         else:
-            ret = self._integratorLib.integrate(ctypes.c_void_p(self._data.ctypes.data),
-                                                ctypes.c_void_p(self._measData.ctypes.data),
-                                                self._initIntegrator)
+            ret = self._integratorLib.integrateInstance(self._instancePtr,
+                                                        ctypes.c_void_p(self._data.ctypes.data),
+                                                        ctypes.c_void_p(self._measData.ctypes.data),
+                                                        self._initIntegrator)
         assert ret==0, "integrator returned error: "+str(ret)
-        self._getData()
         self._initIntegrator = 0
+        self._getData()
 #        print "h:"
 #        print self.h
 #        print "dh_dx0:"
@@ -312,14 +369,215 @@ class RtIntegrator(object):
 #        print self.dh_du
 #        print "dh_dp:"
 #        print self.dh_dp
-        # devectorize outputs
-        if x != None and type(x) == dict:
-            xret = {}
-            for k,name in enumerate(self._dae.xNames()):
-                xret[name] = self.x[k]
+
+    def _sensitivityFreeIntegrator(self, numSeeds):
+        '''
+        The integrator without acado sensitivities of the dae augmented with numSeeds forward
+        sensitivities (see rtModelExport.variationalDae), with its own workspace.
+        It's exported (or loaded from the build cache) the first time it's asked for.
+        '''
+        if numSeeds not in self._sensitivityFreeIntegrators:
+            (dae, measurements) = rtModelExport.variationalDae(self._dae, self._measurements, numSeeds)
+            (integratorLib, _, _) = exportIntegrator(dae, self._ts, self._options, measurements,
+                                                     sensitivities=False)
+            instance = numpy.zeros(integratorLib.instanceSize()/8 + 1)
+            self._sensitivityFreeIntegrators[numSeeds] = \
+                {'lib':integratorLib,
+                 'instance':instance,
+                 'instancePtr':ctypes.c_void_p(instance.ctypes.data),
+                 'init':1}
+        return self._sensitivityFreeIntegrators[numSeeds]
+
+    def _stepDirectional(self, seeds):
+        nx = self.x.size
+        nz = self.z.size
+        nu = self.u.size
+        np = self.p.size
+        if seeds is False:
+            seeds = numpy.zeros((nx+nu+np, 0))
         else:
-            xret = numpy.copy(self.x)
-        return xret
+            seeds = numpy.array(seeds, dtype=numpy.double, ndmin=2)
+            assert seeds.ndim == 2 and seeds.shape[0] == nx+nu+np, \
+                'seeds should be '+str(nx+nu+np)+' by numDirections, got '+str(seeds.shape)
+        numSeeds = seeds.shape[1]
+        integrator = self._sensitivityFreeIntegrator(numSeeds)
+
+        # [x S_0 .. S_k z Sz_0 .. Sz_k u p dup_0 .. dup_k], the forward sensitivities S start
+        # at the seeds dx0 and are propagated by the integrator along with x
+        data = numpy.concatenate((self.x, seeds[:nx,:].T.flatten(),
+                                  self.z, numpy.zeros(numSeeds*nz),
+                                  self.u, self.p, seeds[nx:,:].T.flatten()))
+        if self._measurements is None:
+            ret = integrator['lib'].integrateInstance(integrator['instancePtr'],
+                                                      ctypes.c_void_p(data.ctypes.data),
+                                                      integrator['init'])
+        else:
+            # [h dh_0 .. dh_k]
+            nh = self.h.size
+            measData = numpy.zeros(nh*(1 + numSeeds))
+            ret = integrator['lib'].integrateInstance(integrator['instancePtr'],
+                                                      ctypes.c_void_p(data.ctypes.data),
+                                                      ctypes.c_void_p(measData.ctypes.data),
+                                                      integrator['init'])
+        assert ret==0, "integrator returned error: "+str(ret)
+        integrator['init'] = 0
+
+        iz = nx*(1 + numSeeds)
+        self.x = data[:nx]
+        self.z = data[iz:iz+nz]
+        if numSeeds > 0:
+            self.dx1_dseed = data[nx:iz].reshape((numSeeds, nx)).T
+            self.dz0_dseed = data[iz+nz:iz+nz*(1 + numSeeds)].reshape((numSeeds, nz)).T
+        if self._measurements is not None:
+            self.h = measData[:nh]
+            if numSeeds > 0:
+                self.dh_dseed = measData[nh:].reshape((numSeeds, nh)).T
+
+    def stepBatch(self, X, U, P=None, reset=True):
+        '''
+        Integrate M independent initial conditions in one call.
+        X is M by nx, U is M by nu (or a single u for all of them), P is M by np
+        (or a single p, default self.p). The current self.z is the initial guess for z.
+        If reset is True the integrator is re-initialized for every problem so the
+        results don't depend on the order of the problems.
+
+        Returns a dictionary of stacked results: 'x' (M by nx), 'z' (M by nz),
+        'dx1_dx0' (M by nx by nx), 'dx1_du', 'dx1_dp', 'dz0_dx0', 'dz0_du', 'dz0_dp',
+        and 'h', 'dh_dx0', 'dh_du', 'dh_dp' if there are measurements.
+        This doesn't change the state (self.x etc) of the integrator.
+        '''
+        nx = self.x.size
+        nz = self.z.size
+        nu = self.u.size
+        np = self.p.size
+        X = numpy.array(X, dtype=numpy.double, ndmin=2)
+        M = X.shape[0]
+        if P is None:
+            P = self.p
+        def stack(val, n, name):
+            val = numpy.array(val, dtype=numpy.double)
+            if val.ndim < 2:
+                val = numpy.tile(val.reshape((1,n)), (M,1))
+            assert val.shape == (M,n), \
+                name+' should have shape '+str((M,n))+' or '+str((n,))+', got '+str(val.shape)
+            return val
+        X = stack(X, nx, 'X')
+        U = stack(U, nu, 'U')
+        P = stack(P, np, 'P')
+        Z = stack(self.z, nz, 'z')
+
+        # one [x z dx1z0_dx0 dx1z0_dup u p] row per problem
+        nxz = nx+nz
+        cols = numpy.cumsum([0, nx, nz, nxz*nx, nxz*(nu+np), nu, np])
+        data = numpy.zeros((M, cols[-1]))
+        data[:,cols[0]:cols[1]] = X
+        data[:,cols[1]:cols[2]] = Z
+        data[:,cols[4]:cols[5]] = U
+        data[:,cols[5]:cols[6]] = P
+        rets = numpy.zeros(M, dtype=numpy.intc)
+
+        if self._measurements is None:
+            failures = self._integratorLib.integrateBatch(
+                self._instancePtr,
+                ctypes.c_void_p(data.ctypes.data),
+                data.shape[1], M, int(reset),
+                ctypes.c_void_p(rets.ctypes.data))
+        else:
+            nh = self.h.size
+            measData = numpy.zeros((M, nh + nh*nx + nh*(nu+np)))
+            failures = self._integratorLib.integrateBatch(
+                self._instancePtr,
+                ctypes.c_void_p(data.ctypes.data),
+                ctypes.c_void_p(measData.ctypes.data), measData.shape[1],
+                data.shape[1], M, int(reset),
+                ctypes.c_void_p(rets.ctypes.data))
+        if failures != 0:
+            bad = numpy.nonzero(rets)[0]
+            raise Exception('integrator returned errors '+str(list(rets[bad]))+
+                            ' for problems '+str(list(bad)))
+
+        dx1z0_dx0 = data[:,cols[2]:cols[3]].reshape((M, nxz, nx))
+        dx1z0_dup = data[:,cols[3]:cols[4]].reshape((M, nxz, nu+np))
+        ret = {'x': data[:,cols[0]:cols[1]],
+               'z': data[:,cols[1]:cols[2]],
+               'dx1_dx0': dx1z0_dx0[:,:nx,:],
+               'dz0_dx0': dx1z0_dx0[:,nx:,:],
+               'dx1_du': dx1z0_dup[:,:nx,:nu],
+               'dx1_dp': dx1z0_dup[:,:nx,nu:],
+               'dz0_du': dx1z0_dup[:,nx:,:nu],
+               'dz0_dp': dx1z0_dup[:,nx:,nu:]}
+        if self._measurements is not None:
+            dh_dup = measData[:,nh+nh*nx:].reshape((M, nh, nu+np))
+            ret['h'] = measData[:,:nh]
+            ret['dh_dx0'] = measData[:,nh:nh+nh*nx].reshape((M, nh, nx))
+            ret['dh_du'] = dh_dup[:,:,:nu]
+            ret['dh_dp'] = dh_dup[:,:,nu:]
+        return ret
+
+    def rollout(self, x0, U, p=None, sensitivities=False, outputs=False, reset=True, z0=None):
+        '''
+        Simulate len(U) steps from x0 with the control sequence U (N by nu) in one call.
+        p defaults to self.p. z0 is the initial guess for z, by default the current self.z.
+        To continue a previous rollout give its last z (ret['z'][-1,:]) and reset=False.
+
+        Returns a dictionary with the state trajectory 'x' (N+1 by nx) and 'z' (N by nz),
+        'h' (N by nh) if there are measurements, 'dxN_dx0' (nx by nx), 'dxN_dU' (nx by N by nu)
+        and 'dxN_dp' (nx by np) if sensitivities is True, and a dictionary of outputs (each with N+1 nodes, u=NaN at
+        the last one) in 'outputs' if outputs is True.
+        This doesn't change the state (self.x etc) of the integrator.
+        '''
+        nx = self.x.size
+        nz = self.z.size
+        nu = self.u.size
+        U = numpy.ascontiguousarray(U, dtype=numpy.double)
+        if U.ndim == 1 and nu > 0:
+            U = U.reshape((U.size/nu, nu))
+        N = U.shape[0]
+        assert U.shape == (N,nu), 'U should be N by '+str(nu)+', got '+str(U.shape)
+        if p is None:
+            p = self.p
+        p = numpy.ascontiguousarray(p, dtype=numpy.double)
+        assert p.size == self.p.size, 'p should have size '+str(self.p.size)+', got '+str(p.shape)
+
+        x = numpy.zeros((N+1, nx))
+        x[0,:] = x0
+        if z0 is None:
+            z0 = self.z
+        assert numpy.size(z0) == nz, 'z0 should have size '+str(nz)+', got '+str(numpy.shape(z0))
+        z = numpy.zeros((max(N,1), nz))
+        z[0,:] = z0
+        if sensitivities:
+            dxN_dx0 = numpy.zeros((nx, nx))
+            dxN_dU = numpy.zeros((nx, N*nu))
+            dxN_dp = numpy.zeros((nx, self.p.size))
+            sensPtrs = [ctypes.c_void_p(dxN_dx0.ctypes.data), ctypes.c_void_p(dxN_dU.ctypes.data),
+                        ctypes.c_void_p(dxN_dp.ctypes.data)]
+        else:
+            sensPtrs = [None, None, None]
+        failedStep = ctypes.c_int(0)
+
+        args = [self._instancePtr,
+                ctypes.c_void_p(x.ctypes.data), ctypes.c_void_p(z.ctypes.data),
+                ctypes.c_void_p(U.ctypes.data), ctypes.c_void_p(p.ctypes.data)]
+        if self._measurements is not None:
+            nh = self.h.size
+            measData = numpy.zeros((max(N,1), nh + nh*nx + nh*(nu + self.p.size)))
+            args += [ctypes.c_void_p(measData.ctypes.data), measData.shape[1]]
+        args += [N, int(reset)] + sensPtrs + [ctypes.byref(failedStep)]
+        ret = self._integratorLib.integrateRollout(*args)
+        if ret != 0:
+            raise Exception('integrator returned error '+str(ret)+' at step '+str(failedStep.value))
+
+        result = {'x':x, 'z':z[:N,:]}
+        if self._measurements is not None:
+            result['h'] = measData[:N,:nh]
+        if sensitivities:
+            result['dxN_dx0'] = dxN_dx0
+            result['dxN_dU'] = dxN_dU.reshape((nx, N, nu))
+            result['dxN_dp'] = dxN_dp
+        if outputs:
+            result['outputs'] = self._outputs.toDict(self._outputs.evaluate(x, U, p))
+        return result
 
     def getOutputs(self, x=None, u=None, p=None):
         # vectorize inputs
@@ -329,11 +587,8 @@ class RtIntegrator(object):
             self.u = u
         if p != None:
             self.p = p
-        self._outputsFun.setInput(self.x, 0)
-        self._outputsFun.setInput(self.u, 1)
-        self._outputsFun.setInput(self.p, 2)
-        self._outputsFun.evaluate()
+        outs = self._outputs.evaluate(self.x, self.u, self.p)
         ret = {}
-        for k,name in enumerate(self._dae.outputNames()):
-            ret[name] = numpy.array(self._outputsFun.output(k))
+        for name in self._outputs.names:
+            ret[name] = self._outputs.column(outs, name)[0].reshape(self._outputs.shapes[name])
         return ret
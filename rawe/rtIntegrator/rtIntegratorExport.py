@@ -16,10 +16,12 @@
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
 import ctypes
+import hashlib
 import os
+import sys
 from multiprocessing import Process, Queue
 
-from ..utils import codegen, subprocess_tee
+from ..utils import codegen, buildcache, pkgconfig
 import rtModelExport
 import rtIntegratorInterface
 
@@ -56,16 +58,17 @@ clean :
 """ % {'cfiles':' '.join(cfiles), 'cxxfiles':' '.join(cxxfiles)}
 
 
-def writeRtIntegrator(dae, options, measurements):
+def writeRtIntegrator(dae, timestep, options, measurements, linearInput, sensitivities=True):
     # write the exporter file
-    files = {'export_integrator.cpp':rtIntegratorInterface.phase1src(dae, options, measurements),
+    files = {'export_integrator.cpp':rtIntegratorInterface.phase1src(dae, timestep, options,
+                                                                     measurements, linearInput,
+                                                                     sensitivities=sensitivities),
              'Makefile':rtIntegratorInterface.phase1makefile()}
-    interfaceDir = codegen.memoizeFiles(files,prefix='rt_integrator_phase1__')
-
-    # call make to make sure shared lib is build
-    (ret, msgs) = subprocess_tee.call(['make',codegen.makeJobs()], cwd=interfaceDir)
-    if ret != 0:
-        raise Exception("integrator compilation failed:\n"+msgs)
+    # call make to make sure shared lib is build (or get it from the build cache)
+    interfaceDir = buildcache.memoizeBuild(files, ['export_integrator.so'],
+                                           prefix='rt_integrator_phase1__',
+                                           compilers=['g++'],
+                                           errorMessage="integrator compilation failed")
 
     # call makeRtIntegrator
     def call(path):
@@ -89,12 +92,270 @@ def writeRtIntegrator(dae, options, measurements):
         "error exporting integrator, see stdout/stderr above"
     return ret
 
-def exportIntegrator(dae, timestep, options, measurements):
+# Appended to the exported acado.h. The exported integrator uses the globals acadoWorkspace
+# and acadoVariables, this turns them into thread local pointers so that every RtIntegrator
+# can integrate with its own instance, and instances can be used from several threads at once.
+instanceHeader = '''
+#ifndef RT_INTEGRATOR_INSTANCE_H
+#define RT_INTEGRATOR_INSTANCE_H
+typedef struct {
+  ACADOworkspace workspace;
+  ACADOvariables variables;
+} rtIntegratorInstance;
+
+extern __thread ACADOworkspace * acadoWorkspacePtr;
+extern __thread ACADOvariables * acadoVariablesPtr;
+#define acadoWorkspace (*acadoWorkspacePtr)
+#define acadoVariables (*acadoVariablesPtr)
+
+/* use the workspace of instance (if it's not NULL) until RT_RESTORE_INSTANCE() */
+#define RT_USE_INSTANCE(instance) \\
+  ACADOworkspace * const oldWorkspacePtr = acadoWorkspacePtr; \\
+  ACADOvariables * const oldVariablesPtr = acadoVariablesPtr; \\
+  if ((instance) != 0){ \\
+    acadoWorkspacePtr = &(instance)->workspace; \\
+    acadoVariablesPtr = &(instance)->variables; \\
+  }
+#define RT_RESTORE_INSTANCE() \\
+  acadoWorkspacePtr = oldWorkspacePtr; \\
+  acadoVariablesPtr = oldVariablesPtr;
+#endif /* RT_INTEGRATOR_INSTANCE_H */
+'''
+
+def workspaceSource(hasMeasurements):
+    '''
+    C source with the default workspace and integrate() on a given instance.
+    '''
+    if hasMeasurements:
+        measArg = 'real_t * const measData, '
+        integrateCall = 'integrate(data, measData, resetIntegrator)'
+    else:
+        measArg = ''
+        integrateCall = 'integrate(data, resetIntegrator)'
+    return '''\
+#include <acado.h>
+
+/* used by plain integrate() */
+static rtIntegratorInstance defaultInstance;
+__thread ACADOworkspace * acadoWorkspacePtr = &defaultInstance.workspace;
+__thread ACADOvariables * acadoVariablesPtr = &defaultInstance.variables;
+
+int instanceSize(void){ return sizeof(rtIntegratorInstance); }
+
+/* integrate() using the workspace of instance, which is sizeof(rtIntegratorInstance) bytes */
+int integrateInstance(rtIntegratorInstance * const instance, real_t * const data,
+                      %(measArg)sconst int resetIntegrator){
+  int ret;
+  RT_USE_INSTANCE(instance)
+  ret = %(integrateCall)s;
+  RT_RESTORE_INSTANCE()
+  return ret;
+}
+''' % {'measArg':measArg, 'integrateCall':integrateCall}
+
+def batchSource(dae, hasMeasurements):
+    '''
+    C source which calls the exported integrate() on many independent problems (integrateBatch)
+    or on consecutive intervals of one trajectory (integrateRollout).
+    '''
+    if hasMeasurements:
+        measArgs = 'real_t * const measData, const int measSize, '
+        batchCall = 'integrate(data + k*dataSize, measData + k*measSize, resetIntegrator)'
+        rolloutCall = 'integrate(data, measData + k*measSize, reset)'
+    else:
+        measArgs = ''
+        batchCall = 'integrate(data + k*dataSize, resetIntegrator)'
+        rolloutCall = 'integrate(data, reset)'
+    return '''\
+#include <string.h>
+#include "acado.h"
+
+#define NX %(nx)d
+#define NZ %(nz)d
+#define NU %(nu)d
+#define NP %(np)d
+#define NXZ (NX + NZ)
+#define NUP (NU + NP)
+/* offsets in [x z dx1z0_dx0 dx1z0_dup u p] */
+#define I_Z NX
+#define I_DX0 (I_Z + NZ)
+#define I_DUP (I_DX0 + NXZ*NX)
+#define I_U (I_DUP + NXZ*NUP)
+#define I_P (I_U + NU)
+#define DATA_SIZE (I_P + NP)
+
+/* Integrate numBatch independent problems. data holds one [x z dx1z0_dx0 dx1z0_dup u p] block
+ * of dataSize elements for each problem, and is overwritten with the results.
+ * All problems use the workspace of instance, or the default one if it is NULL.
+ * rets gets the return code of each problem, the number of failures is returned.
+ */
+int integrateBatch(rtIntegratorInstance * const instance,
+                   real_t * const data, %(measArgs)sconst int dataSize,
+                   const int numBatch, const int resetIntegrator, int * const rets){
+  int k;
+  int failures = 0;
+  RT_USE_INSTANCE(instance)
+  for (k = 0; k < numBatch; k++){
+    rets[k] = %(batchCall)s;
+    if (rets[k] != 0)
+      failures++;
+  }
+  RT_RESTORE_INSTANCE()
+  return failures;
+}
+
+/* Simulate N intervals starting from x[0:NX] with controls U (N by NU) and parameters p.
+ * x (N+1 by NX) gets the state trajectory, z (N by NZ) the algebraic states at the start
+ * of each interval, z[0:NZ] is used as the initial guess.
+ * If dxN_dx0 (NX by NX), dxN_dU (NX by N*NU) and dxN_dp (NX by NP) are not NULL they get
+ * the sensitivities of the final state. On failure the integrator's return code is returned and
+ * failedStep is set to the failed interval.
+ */
+int integrateRollout(rtIntegratorInstance * const instance,
+                     real_t * const x, real_t * const z, real_t const * const U,
+                     real_t const * const p, %(measArgs)sconst int N,
+                     const int resetIntegrator,
+                     real_t * const dxN_dx0, real_t * const dxN_dU, real_t * const dxN_dp,
+                     int * const failedStep){
+  real_t data[DATA_SIZE];
+  real_t tmp[NX];
+  int k, i, j, l, ret, reset;
+  const int ncU = N*NU;
+  RT_USE_INSTANCE(instance)
+
+  memset(data, 0, sizeof(data));
+  if (NZ > 0)
+    memcpy(data + I_Z, z, sizeof(real_t)*NZ);
+  if (NP > 0)
+    memcpy(data + I_P, p, sizeof(real_t)*NP);
+  if (dxN_dx0 != 0){
+    memset(dxN_dx0, 0, sizeof(real_t)*NX*NX);
+    for (i = 0; i < NX; i++)
+      dxN_dx0[i*NX + i] = 1;
+  }
+  if (dxN_dU != 0)
+    memset(dxN_dU, 0, sizeof(real_t)*NX*ncU);
+  if (dxN_dp != 0)
+    memset(dxN_dp, 0, sizeof(real_t)*NX*NP);
+
+  for (k = 0; k < N; k++){
+    memcpy(data, x + k*NX, sizeof(real_t)*NX);
+    if (NU > 0)
+      memcpy(data + I_U, U + k*NU, sizeof(real_t)*NU);
+    /* warm start every interval after the first from the previous one */
+    reset = (k == 0) ? resetIntegrator : 0;
+    ret = %(rolloutCall)s;
+    if (ret != 0){
+      *failedStep = k;
+      RT_RESTORE_INSTANCE()
+      return ret;
+    }
+    memcpy(x + (k + 1)*NX, data, sizeof(real_t)*NX);
+    if (NZ > 0)
+      memcpy(z + k*NZ, data + I_Z, sizeof(real_t)*NZ);
+
+    /* chain rule: dx_{k+1}/dx0 = A dx_k/dx0, dx_{k+1}/dU = A dx_k/dU + [0 .. B .. 0],
+     * dx_{k+1}/dp = A dx_k/dp + Bp where A = dx1/dx0, B = dx1/du and Bp = dx1/dp
+     * of this interval */
+    if (dxN_dx0 != 0){
+      for (j = 0; j < NX; j++){
+        for (i = 0; i < NX; i++){
+          tmp[i] = 0;
+          for (l = 0; l < NX; l++)
+            tmp[i] += data[I_DX0 + i*NX + l]*dxN_dx0[l*NX + j];
+        }
+        for (i = 0; i < NX; i++)
+          dxN_dx0[i*NX + j] = tmp[i];
+      }
+    }
+    if (dxN_dU != 0){
+      for (j = 0; j < k*NU; j++){
+        for (i = 0; i < NX; i++){
+          tmp[i] = 0;
+          for (l = 0; l < NX; l++)
+            tmp[i] += data[I_DX0 + i*NX + l]*dxN_dU[l*ncU + j];
+        }
+        for (i = 0; i < NX; i++)
+          dxN_dU[i*ncU + j] = tmp[i];
+      }
+      for (i = 0; i < NX; i++)
+        for (j = 0; j < NU; j++)
+          dxN_dU[i*ncU + k*NU + j] = data[I_DUP + i*NUP + j];
+    }
+    if (dxN_dp != 0){
+      for (j = 0; j < NP; j++){
+        for (i = 0; i < NX; i++){
+          tmp[i] = data[I_DUP + i*NUP + NU + j];
+          for (l = 0; l < NX; l++)
+            tmp[i] += data[I_DX0 + i*NX + l]*dxN_dp[l*NP + j];
+        }
+        for (i = 0; i < NX; i++)
+          dxN_dp[i*NP + j] = tmp[i];
+      }
+    }
+  }
+  RT_RESTORE_INSTANCE()
+  return 0;
+}
+''' % {'nx':len(dae.xNames()), 'nz':len(dae.zNames()),
+       'nu':len(dae.uNames()), 'np':len(dae.pNames()),
+       'measArgs':measArgs, 'batchCall':batchCall, 'rolloutCall':rolloutCall}
+
+# everything built by the integrator Makefile
+products = ['integrator.so','model.so']
+
+def exportFingerprint(dae, timestep, options, measurements, sensitivities=True):
+    '''
+    Hash everything which determines the exported integrator, without doing any expensive symbolics.
+    Returns None if the integrator can't be fingerprinted.
+    '''
+    if measurements is None:
+        exprsFingerprint = dae.fingerprint()
+    else:
+        exprsFingerprint = dae.fingerprintExpressions([measurements])
+    if exprsFingerprint is None:
+        return None
+    toolchain = [buildcache.toolchainVersion('gcc'),
+                 buildcache.toolchainVersion('g++'),
+                 pkgconfig.call(['--modversion','acado'])]
+    generators = buildcache.sourceFingerprint([sys.modules[__name__], rtModelExport,
+                                               rtIntegratorInterface, codegen])
+    return hashlib.md5(str(['rt_integrator', exprsFingerprint, repr(timestep), generators,
+                            measurements is None, sensitivities,
+                            sensitivities and batchSource(dae, measurements is not None),
+                            instanceHeader, workspaceSource(measurements is not None),
+                            sorted(options.getAcadoOpts().items()),
+                            toolchain])).hexdigest()
+
+def loadIntegrator(exportpath):
+    print 'loading '+exportpath+'/integrator.so'
+    integratorLib = ctypes.cdll.LoadLibrary(exportpath+'/integrator.so')
+    print 'loading '+exportpath+'/model.so'
+    modelLib = ctypes.cdll.LoadLibrary(exportpath+'/model.so')
+    return (integratorLib, modelLib)
+
+def exportIntegrator(dae, timestep, options, measurements, sensitivities=True):
+    '''
+    Export and compile an integrator, returning (integratorLib, modelLib, rtModelGen).
+    If this integrator was exported before, no symbolics are done and rtModelGen is None.
+    If sensitivities is False, acado doesn't propagate any sensitivities: integrate() then works
+    on [x z u p] (and measData is only h), and there is no integrateBatch/integrateRollout.
+    '''
+    # if this exact integrator has been exported and built before, skip all the symbolics
+    fingerprint = exportFingerprint(dae, timestep, options, measurements, sensitivities)
+    if fingerprint is not None:
+        exportpath = buildcache.lookupFingerprint(fingerprint, products)
+        if exportpath is not None:
+            (integratorLib, modelLib) = loadIntegrator(exportpath)
+            return (integratorLib, modelLib, None)
+
     # get the exported integrator files
-    exportedFiles = writeRtIntegrator(dae, options, measurements)
+    linearInput = rtModelExport.linearInput(dae, options, measurements)
+    exportedFiles = writeRtIntegrator(dae, timestep, options, measurements, linearInput,
+                                      sensitivities=sensitivities)
 
     # model file
-    rtModelGen = rtModelExport.generateCModel(dae,timestep, measurements)
+    rtModelGen = rtModelExport.generateCModel(dae,timestep, measurements, linearInput=linearInput)
     modelFile = '''\
 #include "acado.h"
 #include "rhs.h"
@@ -110,38 +371,34 @@ def exportIntegrator(dae, timestep, options, measurements):
     symbolicsFiles = ['rhs.cpp','rhsJacob.cpp']
     if measurements is not None:
         symbolicsFiles += ['measurements.cpp', 'measurementsJacob.cpp']
-    makefile = makeMakefile(['workspace.c', 'model.c', 'integrator.c'],
-                            symbolicsFiles)
+    cfiles = ['workspace.c', 'model.c', 'integrator.c']
+    if sensitivities:
+        cfiles.append('integrator_batch.c')
+    makefile = makeMakefile(cfiles, symbolicsFiles)
 
-    # write the static workspace file (temporary)
-    workspace = """\
-#include <acado.h>
-ACADOworkspace acadoWorkspace;
-ACADOvariables acadoVariables;
-"""
     genfiles = {'integrator.c': exportedFiles['integrator.c'],
-                'acado.h': exportedFiles['acado.h'],
+                'acado.h': exportedFiles['acado.h'] + instanceHeader,
                 'model.c': modelFile,
                 'rhs.cpp': '#include "rhs.h"\n'+rtModelGen['rhsFile'][0],
                 'rhs.h': rtModelGen['rhsFile'][1],
                 'rhsJacob.cpp': '#include "rhsJacob.h"\n'+rtModelGen['rhsJacobFile'][0],
                 'rhsJacob.h': rtModelGen['rhsJacobFile'][1],
-                'workspace.c': workspace,
+                'workspace.c': workspaceSource(measurements is not None),
                 'Makefile': makefile}
+    if sensitivities:
+        genfiles['integrator_batch.c'] = batchSource(dae, measurements is not None)
     if measurements is not None:
         genfiles['measurements.cpp'] = '#include "measurements.h"\n'+rtModelGen['measurementsFile'][0]
         genfiles['measurements.h'] = rtModelGen['measurementsFile'][1]
         genfiles['measurementsJacob.cpp'] = '#include "measurementsJacob.h"\n'+rtModelGen['measurementsJacobFile'][0]
         genfiles['measurementsJacob.h'] = rtModelGen['measurementsJacobFile'][1]
-    exportpath = codegen.memoizeFiles(genfiles,prefix='rt_integrator__')
-
-    # compile the code
-    (ret, msgs) = subprocess_tee.call(['make',codegen.makeJobs()], cwd=exportpath)
-    if ret != 0:
-        raise Exception("integrator compilation failed:\n"+msgs)
+    # compile the code (or get it from the build cache)
+    exportpath = buildcache.memoizeBuild(genfiles, products,
+                                         prefix='rt_integrator__',
+                                         compilers=['gcc','g++'],
+                                         errorMessage="integrator compilation failed")
+    if fingerprint is not None:
+        buildcache.recordFingerprint(fingerprint, exportpath)
 
-    print 'loading '+exportpath+'/integrator.so'
-    integratorLib = ctypes.cdll.LoadLibrary(exportpath+'/integrator.so')
-    print 'loading '+exportpath+'/model.so'
-    modelLib = ctypes.cdll.LoadLibrary(exportpath+'/model.so')
+    (integratorLib, modelLib) = loadIntegrator(exportpath)
     return (integratorLib, modelLib, rtModelGen)
@@ -18,8 +18,9 @@
 import casadi as C
 
 from ..utils import pkgconfig
+from rtModelExport import linearInputSource
 
-def phase1src(dae,options,measurements):
+def phase1src(dae,timestep,options,measurements,linearInput,sensitivities=True):
     ret = '''\
 #include <string>
 #include <iostream>
@@ -45,15 +46,16 @@ int export_integrator( const char * genPath)
 
   // set NUM_INTEGRATOR_STEPS
   sim.set( NUM_INTEGRATOR_STEPS, %(NUM_INTEGRATOR_STEPS)s );
-
+%(sensitivities)s
   // 0 == rhs()
-  sim.setModel( "model", "rhs", "rhsJacob" );
-  sim.setDimensions( %(nx)d, %(nx)d, %(nz)d, %(nup)d );
-''' % {'INTEGRATOR_TYPE': options['INTEGRATOR_TYPE'],
+%(model)s''' % {'INTEGRATOR_TYPE': options['INTEGRATOR_TYPE'],
        'NUM_INTEGRATOR_STEPS': options['NUM_INTEGRATOR_STEPS'],
-       'nx':len(dae.xNames()),
-       'nz':len(dae.zNames()),
-       'nup':len(dae.uNames())+len(dae.pNames())}
+       'sensitivities': '' if sensitivities else '''
+  // only integrate the states, no sensitivities
+  sim.set( DYNAMIC_SENSITIVITY, NO_SENSITIVITY );
+''',
+       'model': ''.join(['  '+line+'\n' for line in
+                         linearInputSource(dae, timestep, linearInput, 'sim')])}
 
     if measurements is not None:
         ret += '''
@@ -18,23 +18,85 @@
 import casadi as C
 
 from ..utils import codegen
+from ..dae import Dae
+from ..dae.detectLinearSubsystems import linearInputSubsystem
 
-def generateCModel(dae,timeScaling,measurements):
+def linearInput(dae, options, measurements):
+    '''
+    The linear input subsystem which the exported integrator propagates in closed form,
+    or None if the LINEAR_INPUT option is off or there is none.
+    '''
+    if not options['LINEAR_INPUT']:
+        return None
+    if measurements is not None:
+        print "LINEAR_INPUT is not supported together with measurements, exporting the full model"
+        return None
+    ret = linearInputSubsystem(dae)
+    if ret is None:
+        print "LINEAR_INPUT: no linear input subsystem in the leading states, exporting the full model"
+    else:
+        print "LINEAR_INPUT: propagating "+str(dae.xNames()[:ret['n1']])+" in closed form"
+    return ret
+
+def linearInputSource(dae, timeScaling, subsystem, objName):
+    '''
+    The acado exporter lines (a list, not indented) which set the model of objName:
+    the linear input subsystem M1 dot(x1) == A1 x1 + B1 [u,p] (with the same time scaling
+    as the model functions) if there is one, and the external model functions.
+    '''
+    nx = len(dae.xNames())
+    nz = len(dae.zNames())
+    nup = len(dae.uNames()) + len(dae.pNames())
+    if subsystem is None:
+        return ['%s.setModel( "model", "rhs", "rhsJacob" );' % objName,
+                '%s.setDimensions( %d, %d, %d, %d );' % (objName, nx, nx, nz, nup)]
+
+    n1 = subsystem['n1']
+    lines = ['// linear input subsystem M1 dot(x1) == A1 x1 + B1 [u,p], x1 = '+
+             str(dae.xNames()[:n1])]
+    for (name, mat) in [('M1', subsystem['M1']/timeScaling),
+                        ('A1', subsystem['A1']),
+                        ('B1', subsystem['B1'])]:
+        lines.append('Matrix %s( %d, %d );' % (name, mat.shape[0], mat.shape[1]))
+        for i in range(mat.shape[0]):
+            for j in range(mat.shape[1]):
+                lines.append('%s( %d, %d ) = %s;' % (name, i, j, repr(float(mat[i,j]))))
+    lines.append('%s.setLinearInput( M1, A1, B1 );' % objName)
+    lines.append('%s.setModel( "model", "rhs", "rhsJacob" );' % objName)
+    # NX1, NX2, NX3, NDX, NDX3, NXA, NXA3, NU
+    # the model functions still take the full xdot (NDX = NX1+NX2)
+    lines.append('%s.setDimensions( %d, %d, 0, %d, 0, %d, 0, %d );' % \
+                     (objName, n1, nx-n1, nx, nz, nup))
+    return lines
+
+def generateCModel(dae,timeScaling,measurements,linearInput=None):
+    '''
+    The residual and its jacobian as C functions of [x z u p xdot].
+    With a linearInput subsystem (see linearInputSubsystem) only the remaining rows are
+    exported, still as functions of the full [x z u p xdot].
+    '''
     xdot = C.veccat([dae.ddt(name) for name in dae.xNames()])
     inputs = C.veccat([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), xdot])
-    f = dae.getResidual()
+    nxzup = inputs.size() - xdot.size()
 
-    # dae residual
-    rhs = C.SXFunction( [inputs], [f] )
-    rhs.init()
+    # dae residual and its jacobian, only derived once per dae
     # handle time scaling
-    [f] = rhs.eval([C.veccat([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), xdot/timeScaling])])
+    [f, jac] = dae.residualFunction().eval([C.veccat([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), xdot/timeScaling])])
+    # chain rule for the time scaling of xdot
+    jac = C.horzcat([jac[:,:nxzup], jac[:,nxzup:]/timeScaling])
+
+    if linearInput is not None:
+        assert measurements is None, "measurements aren't supported with a linear input subsystem"
+        rows = linearInput['nonlinearRows']
+        f = C.veccat([f[i,0] for i in rows])
+        jac = jac[rows,range(inputs.size())]
+
     rhs = C.SXFunction( [inputs], [C.densify(f)] )
     rhs.init()
     rhsString = codegen.writeCCode(rhs, 'rhs')
 
     # dae residual jacobian
-    jf = C.veccat( [ C.jacobian(f,inputs).T ] )
+    jf = C.veccat( [ jac.T ] )
     rhsJacob = C.SXFunction( [inputs], [C.densify(jf)] )
     rhsJacob.init()
     rhsJacobString = codegen.writeCCode(rhsJacob, 'rhsJacob')
@@ -64,3 +126,49 @@ def generateCModel(dae,timeScaling,measurements):
         ret['measurementsJacobFile'] = measurementsJacobString
 
     return ret
+
+def variationalDae(dae, measurements, numSeeds):
+    '''
+    The dae and measurements augmented with their forward sensitivities in numSeeds directions,
+    returned as (dae, measurements).
+    Direction k adds the states S_k = dx/dseed_k, the algebraic states Sz_k = dz/dseed_k, the
+    parameters [du_k, dp_k] and the residual rows
+        df/dxdot dot(S_k) + df/dx S_k + df/dz Sz_k + df/du du_k + df/dp dp_k == 0
+    so integrating from S_k(0) = dx0_k gives dx1/dseed_k and dz0/dseed_k.
+    The new variables are ordered [x S_0 .. S_k], [z Sz_0 .. Sz_k], u, [p du_0 dp_0 .. du_k dp_k].
+    '''
+    if numSeeds == 0:
+        return (dae, measurements)
+    xNames = dae.xNames()
+    zNames = dae.zNames()
+    upNames = dae.uNames() + dae.pNames()
+    inputs = C.veccat([dae.xVec(), dae.zVec(), dae.uVec(), dae.pVec(), dae.xDotVec()])
+
+    ret = Dae()
+    def addVars(addVar, names, k=None):
+        if k is None:
+            return C.veccat([addVar(name) for name in names])
+        return C.veccat([addVar(name+'__dseed'+str(k)) for name in names])
+    x = addVars(ret.addX, xNames)
+    sx = [addVars(ret.addX, xNames, k) for k in range(numSeeds)]
+    z = addVars(ret.addZ, zNames)
+    sz = [addVars(ret.addZ, zNames, k) for k in range(numSeeds)]
+    u = addVars(ret.addU, dae.uNames())
+    p = addVars(ret.addP, dae.pNames())
+    sup = [addVars(ret.addP, upNames, k) for k in range(numSeeds)]
+    xdot = C.veccat([ret.ddt(name) for name in xNames])
+    # the seeds in the order of the inputs [x z u p xdot]
+    seeds = [C.veccat([sx[k], sz[k], sup[k],
+                       C.veccat([ret.ddt(name+'__dseed'+str(k)) for name in xNames])])
+             for k in range(numSeeds)]
+    newInputs = C.veccat([x, z, u, p, xdot])
+
+    [f, jac] = dae.residualFunction().eval([newInputs])
+    ret.setResidual([f] + [C.mul(jac, seed) for seed in seeds])
+
+    if measurements is not None:
+        hFun = C.SXFunction([inputs], [measurements, C.jacobian(measurements, inputs)])
+        hFun.init()
+        [h, jh] = hFun.eval([newInputs])
+        measurements = C.veccat([h] + [C.mul(jh, seed) for seed in seeds])
+    return (ret, measurements)
@@ -20,6 +20,9 @@ import casadi as C
 import numpy
 import matplotlib.pyplot as plt
 
+from dae.outputsExport import CompiledOutputs
+from rtIntegrator import RtIntegrator, RtIntegratorOptions
+
 def getitemMsg(d,name,msg):
     try:
         return d[name]
@@ -41,6 +44,11 @@ def vectorizeXUP(x,u,p,dae):
         pVec = p
     return (xVec,uVec,pVec)
 
+def vectorizeToArray(v,names,msg):
+    if type(v) == dict:
+        return numpy.array([getitemMsg(v,name,msg) for name in names], dtype=numpy.double)
+    return numpy.array(v, dtype=numpy.double).flatten()
+
 def maybeToScalar(x):
     if x.size() == 1:
         return x.at(0)
@@ -68,18 +76,31 @@ class Timer(object):
         return self.nextTime - self.dt - self._t0
 
 class Sim(object):
-    def __init__(self, dae, ts):
-        print "creating integrator"
+    def __init__(self, dae, ts, backend='idas', integratorOptions=None):
+        '''
+        backend 'idas' integrates with CasADi's IdasIntegrator with tight tolerances.
+        backend 'rt' uses a compiled RtIntegrator, which is much faster. Choose the scheme with
+        INTEGRATOR_TYPE (e.g. INT_IRK_GL4, or INT_RK4 for explicit Runge-Kutta) and the accuracy
+        with NUM_INTEGRATOR_STEPS in integratorOptions.
+        '''
+        assert backend in ['idas','rt'], 'backend must be "idas" or "rt", got: '+str(backend)
         self.dae = dae
         self._ts = ts
-        self.integrator = C.IdasIntegrator(self.dae.casadiDae())
-        self.integrator.setOption("reltol",1e-6)
-        self.integrator.setOption("abstol",1e-8)
-        self.integrator.setOption("t0",0)
-        self.integrator.setOption("tf",ts)
-        self.integrator.setOption('name','integrator')
-        self.integrator.setOption("linear_solver",C.CSparse)
-        self.integrator.init()
+        self.backend = backend
+        if backend == 'idas':
+            print "creating integrator"
+            self.integrator = C.IdasIntegrator(self.dae.casadiDae())
+            self.integrator.setOption("reltol",1e-6)
+            self.integrator.setOption("abstol",1e-8)
+            self.integrator.setOption("t0",0)
+            self.integrator.setOption("tf",ts)
+            self.integrator.setOption('name','integrator')
+            self.integrator.setOption("linear_solver",C.CSparse)
+            self.integrator.init()
+        else:
+            if integratorOptions is None:
+                integratorOptions = RtIntegratorOptions()
+            self.integrator = RtIntegrator(self.dae, ts=ts, options=integratorOptions)
 
         print "creating outputs function"
         (fAll, (f0,outputs0names)) = self.dae.outputsFun()
@@ -96,30 +117,41 @@ class Sim(object):
         self._log = {'x':[],'u':[],'y':[],'yN':[],'outputs':dict(zip(self.outputNames,listOut))}
 
     def step(self, x, u, p):
+        '''
+        Integrate one timestep. If x is a dict the result is a dict, otherwise
+        it is a column (a DMatrix for the idas backend, an nx by 1 array for the rt backend).
+        '''
+        if self.backend == 'rt':
+            return self._stepRt(x, u, p)
         (xVec,uVec,pVec) = vectorizeXUP(x,u,p,self.dae)
         self.integrator.setInput(xVec,C.INTEGRATOR_X0)
         self.integrator.setInput(C.veccat([uVec,pVec]),C.INTEGRATOR_P)
         self.integrator.evaluate()
-        xNext = C.DMatrix(self.integrator.output())
         if type(x) == dict:
-            ret = {}
-            for k,name in enumerate(self.dae.xNames()):
-                ret[name] = xNext[k].at(0)
-        else:
-            ret = xNext
-        return ret
+            xNext = numpy.array(self.integrator.output()).flatten()
+            return dict(zip(self.xNames, xNext.tolist()))
+        return C.DMatrix(self.integrator.output())
+
+    def _stepRt(self, x, u, p):
+        self.integrator.x = vectorizeToArray(x, self.xNames, "the states")
+        self.integrator.u = vectorizeToArray(u, self.uNames, "the controls")
+        self.integrator.p = vectorizeToArray(p, self.dae.pNames(), "the parameters")
+        self.integrator.step(sensitivities=False)
+        if type(x) == dict:
+            return dict(zip(self.xNames, self.integrator.x.tolist()))
+        return self.integrator.x.reshape((self.integrator.x.size, 1)).copy()
 
     def getOutputs(self, x, u, p):
         if self.outputsFun0 == None:
             return {}
-        (xVec,uVec,pVec) = vectorizeXUP(x,u,p,self.dae)
-        self.outputsFun0.setInput(xVec, 0)
-        self.outputsFun0.setInput(uVec, 1)
-        self.outputsFun0.setInput(pVec, 2)
-        self.outputsFun0.evaluate()
+        if not hasattr(self, '_outputs0'):
+            self._outputs0 = CompiledOutputs(self.dae, names=self.outputs0names)
+        outs = self._outputs0.evaluate(vectorizeToArray(x, self.xNames, "the states"),
+                                       vectorizeToArray(u, self.uNames, "the controls"),
+                                       vectorizeToArray(p, self.dae.pNames(), "the parameters"))
         ret = {}
-        for k,name in enumerate(self.outputs0names):
-            ret[name] = maybeToScalar(C.DMatrix(self.outputsFun0.output(k)))
+        for name in self.outputs0names:
+            ret[name] = maybeToScalar(C.DMatrix(self._outputs0.column(outs, name)[0]))
         return ret
 
     def log(self,new_x=None,new_u=None,new_y=None,new_yN=None,new_out=None):
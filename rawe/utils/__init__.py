@@ -16,6 +16,9 @@
 # along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
 
 import codegen
+import buildcache
+import buildscheduler
+import ringbuffer
 import pkgconfig
 import subprocess_tee
 import mkprotobufs
@@ -0,0 +1,289 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import hashlib
+import time
+import fcntl
+import shutil
+import subprocess
+
+import codegen
+import buildscheduler
+
+# Content addressed cache of compiled artifacts in ~/.rawesome.
+# Every entry is a memoized directory which has been successfully built.
+# The index keeps track of which build products exist, how big the entry is,
+# which other entries it was built against, and when it was last used so that
+# old entries can be evicted.
+indexPath = os.path.join(codegen.rawesomeDataPath, 'index.json')
+lockPath = os.path.join(codegen.rawesomeDataPath, 'index.lock')
+
+# total size of all cached build directories before old ones get evicted
+maxCacheBytes = 4*1024**3
+
+_toolchainVersions = {}
+_sourceHashes = {}
+
+def toolchainVersion(compiler):
+    '''
+    return a string identifying a compiler (the first line of `compiler --version`)
+    '''
+    try:
+        return _toolchainVersions[compiler]
+    except KeyError:
+        pass
+    try:
+        p = subprocess.Popen([compiler, '--version'],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (output, _) = p.communicate()
+        version = output.strip().split('\n')[0]
+    except OSError:
+        version = 'unknown'
+    _toolchainVersions[compiler] = version
+    return version
+
+def sourceFingerprint(modules):
+    '''
+    return the md5 of the source files of the python modules which generate an export,
+    so that changing a generator doesn't reuse builds made by the old one
+    '''
+    hashes = []
+    for module in modules:
+        path = module.__file__
+        if path.endswith('.pyc') or path.endswith('.pyo'):
+            path = path[:-1]
+        if path not in _sourceHashes:
+            with open(path, 'r') as f:
+                _sourceHashes[path] = hashlib.md5(f.read()).hexdigest()
+        hashes.append(_sourceHashes[path])
+    return hashlib.md5(str(hashes)).hexdigest()
+
+class _CacheIndex(object):
+    '''
+    The build cache index, locked for the duration of a "with" block.
+    '''
+    def __enter__(self):
+        if not os.path.exists(codegen.rawesomeDataPath):
+            os.makedirs(codegen.rawesomeDataPath)
+        self._lockfile = open(lockPath, 'a')
+        fcntl.flock(self._lockfile, fcntl.LOCK_EX)
+        try:
+            with open(indexPath, 'r') as f:
+                self.data = json.load(f)
+        except (IOError, ValueError):
+            self.data = {}
+        for name in ['hits','misses','evictions','fingerprintHits']:
+            if name not in self.data:
+                self.data[name] = 0
+        for name in ['entries','fingerprints']:
+            if name not in self.data:
+                self.data[name] = {}
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        try:
+            if excType is None:
+                tmpPath = indexPath+'.tmp.'+str(os.getpid())
+                with open(tmpPath, 'w') as f:
+                    json.dump(self.data, f, indent=2, sort_keys=True)
+                os.rename(tmpPath, indexPath)
+        finally:
+            fcntl.flock(self._lockfile, fcntl.LOCK_UN)
+            self._lockfile.close()
+
+    def lookup(self, exportpath, products):
+        '''
+        Return True if exportpath was built and all its products still exist.
+        '''
+        name = os.path.basename(exportpath)
+        if name not in self.data['entries']:
+            return False
+        for product in products:
+            if not os.path.exists(os.path.join(exportpath, product)):
+                del self.data['entries'][name]
+                return False
+        return True
+
+    def insert(self, exportpath, products, dependencies):
+        name = os.path.basename(exportpath)
+        self.data['entries'][name] = {'size':_directorySize(exportpath),
+                                      'lastUsed':time.time(),
+                                      'products':products,
+                                      'dependencies':[os.path.basename(d) for d in dependencies]}
+
+    def touch(self, exportpath):
+        self.data['entries'][os.path.basename(exportpath)]['lastUsed'] = time.time()
+
+    def _hasDependents(self, name):
+        for entry in self.data['entries'].values():
+            if name in entry.get('dependencies', []):
+                return True
+        return False
+
+    def _remove(self, name):
+        '''
+        Delete one entry, unless it is being built, is in use by any process,
+        or another cached entry was built against it. Returns True if it was deleted.
+        '''
+        if self._hasDependents(name):
+            return False
+        path = os.path.join(codegen.rawesomeDataPath, name)
+        with buildscheduler.RemoveLock(path) as lock:
+            if not lock.acquired:
+                return False
+            shutil.rmtree(path, ignore_errors=True)
+        del self.data['entries'][name]
+        for (fp, fpName) in self.data['fingerprints'].items():
+            if fpName == name:
+                del self.data['fingerprints'][fp]
+        self.data['evictions'] += 1
+        return True
+
+    def evict(self, keep):
+        '''
+        Remove least recently used entries until the cache fits in maxCacheBytes.
+        The entry named by "keep" is never removed, and neither are entries which
+        are busy or needed by other entries (see _remove).
+        '''
+        entries = self.data['entries']
+        totalSize = sum([e['size'] for e in entries.values()])
+        # removing an entry can free up what it depended on, so go again until nothing changes
+        removedAny = True
+        while totalSize > maxCacheBytes and removedAny:
+            removedAny = False
+            lru = sorted(entries.keys(), key=lambda name: entries[name]['lastUsed'])
+            for name in lru:
+                if totalSize <= maxCacheBytes:
+                    break
+                if name == os.path.basename(keep):
+                    continue
+                size = entries[name]['size']
+                if self._remove(name):
+                    totalSize -= size
+                    removedAny = True
+
+def _directorySize(path):
+    size = 0
+    for (root, _, files) in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+def memoizeBuild(genfiles, products, prefix='', compilers=None, errorMessage='compilation failed',
+                 dependencies=None):
+    '''
+    Given a recursive dict filename:source containing a Makefile, return a directory
+    in which "make" has produced all the files in "products".
+
+    The directory is keyed on the source files and the versions of "compilers".
+    If it has been built before, the directory is returned immediately without writing
+    any files or calling make.
+
+    "dependencies" are other cached directories the Makefile uses (e.g. a prebuilt library),
+    they won't be evicted while this directory is cached.
+    The returned directory is marked in use, so it won't be evicted while this process runs.
+    Entries are only marked in use or removed with the index locked, so there is no race
+    between finding an entry and marking it.
+    '''
+    if dependencies is None:
+        dependencies = []
+    if compilers is None:
+        compilers = ['gcc','g++']
+    toolchain = '\n'.join([c+': '+toolchainVersion(c) for c in sorted(compilers)])
+    exportpath = codegen._getExportPath(genfiles, prefix, salt=toolchain)
+
+    def lookup():
+        with _CacheIndex() as index:
+            if index.lookup(exportpath, products):
+                index.data['hits'] += 1
+                index.touch(exportpath)
+                buildscheduler.markInUse(exportpath)
+                return True
+        return False
+
+    if lookup():
+        return exportpath
+
+    # if someone else is building the same thing right now, wait for them and use their build
+    with buildscheduler.BuildLock(exportpath):
+        if lookup():
+            return exportpath
+        with _CacheIndex() as index:
+            index.data['misses'] += 1
+
+        codegen.writeDifferentFiles(exportpath, genfiles)
+        buildscheduler.make(exportpath, errorMessage)
+        for product in products:
+            assert os.path.exists(os.path.join(exportpath, product)), \
+                'make succeeded but "'+product+'" was not built in '+exportpath
+
+        with _CacheIndex() as index:
+            buildscheduler.markInUse(exportpath)
+            index.insert(exportpath, products, dependencies)
+            index.evict(keep=exportpath)
+
+    return exportpath
+
+def lookupFingerprint(fingerprint, products):
+    '''
+    If a directory has been recorded for this fingerprint and all its products are
+    still built, return it. Otherwise return None.
+    '''
+    with _CacheIndex() as index:
+        fingerprints = index.data['fingerprints']
+        if fingerprint not in fingerprints:
+            return None
+        exportpath = os.path.join(codegen.rawesomeDataPath, fingerprints[fingerprint])
+        if not index.lookup(exportpath, products):
+            del fingerprints[fingerprint]
+            return None
+        index.data['fingerprintHits'] += 1
+        index.touch(exportpath)
+        buildscheduler.markInUse(exportpath)
+        return exportpath
+
+def recordFingerprint(fingerprint, exportpath):
+    '''
+    Remember that the (already built) directory exportpath was generated from
+    something with this fingerprint.
+    '''
+    with _CacheIndex() as index:
+        index.data['fingerprints'][fingerprint] = os.path.basename(exportpath)
+
+def cacheStats():
+    '''
+    return a dictionary with the number of cache hits/misses/evictions,
+    the number of cached entries, and their total size in bytes
+    '''
+    with _CacheIndex() as index:
+        entries = index.data['entries']
+        return {'hits':index.data['hits'],
+                'misses':index.data['misses'],
+                'fingerprintHits':index.data['fingerprintHits'],
+                'evictions':index.data['evictions'],
+                'entries':len(entries),
+                'bytes':sum([e['size'] for e in entries.values()])}
+
+def clearStats():
+    with _CacheIndex() as index:
+        for name in ['hits','misses','evictions','fingerprintHits']:
+            index.data[name] = 0
@@ -0,0 +1,173 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import fcntl
+import threading
+import multiprocessing
+
+import codegen
+import subprocess_tee
+
+# All calls to make from every thread and process share a pool of cpu tokens.
+# A token is a file in ~/.rawesome/jobserver which is held with flock() while a
+# build uses that cpu, so tokens are released automatically if a process dies.
+jobserverPath = os.path.join(codegen.rawesomeDataPath, 'jobserver')
+locksPath = os.path.join(codegen.rawesomeDataPath, 'locks')
+
+# size of the token pool, None means the number of cpus
+maxTokens = None
+
+# (path, seconds waiting for cpus, seconds building, number of jobs) for every build
+# run by this process
+jobTimes = []
+_jobTimesLock = threading.Lock()
+
+def _numTokens():
+    if maxTokens is None:
+        return multiprocessing.cpu_count()
+    return maxTokens
+
+def _numWanted():
+    if codegen.maxMakeJobs is None:
+        return _numTokens()
+    return min(codegen.maxMakeJobs, _numTokens())
+
+def _acquireTokens(numWanted):
+    '''
+    Block until at least one token is available, then take up to numWanted tokens.
+    Returns a list of open (locked) token files.
+    '''
+    if not os.path.exists(jobserverPath):
+        try:
+            os.makedirs(jobserverPath)
+        except OSError:
+            pass
+    tokens = []
+    while len(tokens) == 0:
+        for k in range(_numTokens()):
+            f = open(os.path.join(jobserverPath, 'token'+str(k)), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                f.close()
+                continue
+            tokens.append(f)
+            if len(tokens) == numWanted:
+                break
+        if len(tokens) == 0:
+            time.sleep(0.05)
+    return tokens
+
+def _releaseTokens(tokens):
+    for f in tokens:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+def _openLockfile(path, suffix):
+    if not os.path.exists(locksPath):
+        try:
+            os.makedirs(locksPath)
+        except OSError:
+            pass
+    return open(os.path.join(locksPath, os.path.basename(path)+suffix), 'a')
+
+class BuildLock(object):
+    '''
+    Exclusive lock on building a directory, shared by all threads and processes.
+    Use this so that identical builds which are in flight at the same time
+    only get built once.
+    '''
+    def __init__(self, path):
+        self._path = path
+
+    def __enter__(self):
+        self._lockfile = _openLockfile(self._path, '.lock')
+        fcntl.flock(self._lockfile, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        fcntl.flock(self._lockfile, fcntl.LOCK_UN)
+        self._lockfile.close()
+
+# shared locks on every directory this process is using, held until it exits
+_inUse = {}
+_inUseLock = threading.Lock()
+
+def markInUse(path):
+    '''
+    Tell other threads and processes that path is in use (e.g. a library in it is loaded)
+    until this process exits, so that it isn't deleted from under us.
+    '''
+    name = os.path.basename(path)
+    with _inUseLock:
+        if name in _inUse:
+            return
+        lockfile = _openLockfile(path, '.use')
+        fcntl.flock(lockfile, fcntl.LOCK_SH)
+        _inUse[name] = lockfile
+
+class RemoveLock(object):
+    '''
+    Try to lock a directory for removal, without blocking.
+    "acquired" is False if it is being built or is in use by any thread or process,
+    in which case it must not be removed.
+    '''
+    def __init__(self, path):
+        self._path = path
+
+    def __enter__(self):
+        self._lockfiles = []
+        self.acquired = True
+        for suffix in ['.lock', '.use']:
+            lockfile = _openLockfile(self._path, suffix)
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                lockfile.close()
+                self.acquired = False
+                break
+            self._lockfiles.append(lockfile)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        for lockfile in self._lockfiles:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+
+def make(path, errorMessage='compilation failed'):
+    '''
+    Call make in path using as many cpu tokens as are free (at least one,
+    at most codegen.maxMakeJobs), and record how long it took.
+    '''
+    t0 = time.time()
+    tokens = _acquireTokens(_numWanted())
+    t1 = time.time()
+    try:
+        (ret, msgs) = subprocess_tee.call(['make','-j'+str(len(tokens))], cwd=path)
+    finally:
+        _releaseTokens(tokens)
+    t2 = time.time()
+
+    with _jobTimesLock:
+        jobTimes.append((path, t1-t0, t2-t1, len(tokens)))
+    print 'built %s with %d jobs in %.2f s (waited %.2f s for cpus)' % \
+        (os.path.basename(path), len(tokens), t2-t1, t1-t0)
+
+    if ret != 0:
+        raise Exception(errorMessage+":\n\n"+msgs)
@@ -23,8 +23,13 @@ import multiprocessing
 
 rawesomeDataPath = os.path.expanduser("~/.rawesome")
 
+# maximum number of parallel jobs given to make, None means use all cpus
+maxMakeJobs = None
+
 def makeJobs():
-    return '-j'+str(multiprocessing.cpu_count())
+    if maxMakeJobs is None:
+        return '-j'+str(multiprocessing.cpu_count())
+    return '-j'+str(maxMakeJobs)
 
 # Given a recursive dict filename:source, return a unique directory with
 # those files written to it. If these exact files were already memoized,
@@ -83,11 +88,11 @@ def writeDifferentFiles(path,gfs):
             except:
                 writeFile()
 
-def _getExportPath(genfiles,prefix):
+def _getExportPath(genfiles,prefix,salt=''):
     flattened = flattenFileDict(genfiles)
     flattened.sort()
     return os.path.join(rawesomeDataPath,
-                        prefix+hashlib.md5(''.join([''.join(x) for x in flattened])).hexdigest())
+                        prefix+hashlib.md5(salt+''.join([''.join(x) for x in flattened])).hexdigest())
 
 def flattenFileDict(fd,prefix=''):
         assert isinstance(fd,dict)
@@ -132,6 +137,14 @@ def withTempdir(command):
 
     return allfiles
 
+# Hash the generated C code of an initialized SXFunction.
+# This is linear in the size of the expression graph, so it is a cheap
+# way to check if two functions are the same before doing anything expensive with them.
+def hashFunction(f):
+    def callme(tmpdir):
+        f.generateCode( os.path.join(tmpdir,'fingerprint.c') )
+    return hashlib.md5(withTempdir(callme)['fingerprint.c']).hexdigest()
+
 def writeCCode(f, name):
     def callme(tmpdir):
         f.generateCode( os.path.join(tmpdir,'generatedCode.c') )
@@ -0,0 +1,103 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+class RingBuffer(object):
+    '''
+    Fixed capacity log of equally shaped arrays (or scalars).
+    The storage is allocated as one (capacity,)+shape block at the first append,
+    after that appending is a copy into the block. When it is full the oldest entries
+    are overwritten.
+
+    numpy.array(buf), len(buf), buf[k] and iteration all see the entries oldest first,
+    so it can be used in place of a list of arrays. They all return copies, so the entries
+    don't change when the buffer wraps around.
+    '''
+    def __init__(self, capacity):
+        assert type(capacity) is int and capacity > 0, \
+            "capacity must be a positive int, got: "+str(capacity)
+        self._capacity = capacity
+        self._data = None
+        self._head = 0
+        self._count = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def append(self, value):
+        value = numpy.asarray(value, dtype=numpy.double)
+        if self._data is None:
+            self._data = numpy.zeros((self._capacity,)+value.shape)
+        assert value.shape == self._data.shape[1:], \
+            "can't log something with shape "+str(value.shape)+" in a log of shape "+\
+            str(self._data.shape[1:])
+        self._data[self._head] = value
+        self._head = (self._head + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def array(self):
+        '''
+        return a (len, ...) array of the entries, oldest first
+        '''
+        if self._data is None:
+            return numpy.zeros((0,))
+        if self._count < self._capacity:
+            return self._data[:self._count].copy()
+        return numpy.concatenate((self._data[self._head:], self._data[:self._head]))
+
+    def select(self, index):
+        '''
+        return a (len, ...) array of entry[index] for every entry, oldest first,
+        copying only the selected part of the log
+        '''
+        if self._data is None:
+            return numpy.zeros((0,))
+        if not isinstance(index, tuple):
+            index = (index,)
+        data = self._data[(slice(None),)+index]
+        if self._count < self._capacity:
+            return data[:self._count].copy()
+        return numpy.concatenate((data[self._head:], data[:self._head]))
+
+    def __array__(self, dtype=None):
+        ret = self.array()
+        if dtype is not None:
+            return ret.astype(dtype)
+        return ret
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, long, numpy.integer)):
+            if index < 0:
+                index += self._count
+            if index < 0 or index >= self._count:
+                raise IndexError('index '+str(index)+' out of range for a log of length '+\
+                                 str(self._count))
+            return self._data[(self._head - self._count + index) % self._capacity].copy()
+        return self.array()[index]
+
+    def __iter__(self):
+        for k in range(self._count):
+            yield self[k]
@@ -0,0 +1,63 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+# time AdaptiveRtIntegrator against a fixed step RtIntegrator with the same maximum number
+# of substeps, on the pendulum from rawe/benchmark.py
+
+import time
+import numpy
+
+import rawe
+import rawe.benchmark
+from rawe.rtIntegrator import RtIntegrator, RtIntegratorOptions, AdaptiveRtIntegrator
+
+def timeSteps(integrator, x0, u0, p0, numSteps):
+    x = x0
+    t0 = time.time()
+    for k in range(numSteps):
+        x = integrator.step(x, u0, p0)
+    return ((time.time() - t0)/numSteps, x)
+
+if __name__=='__main__':
+    (makeDae, ts, x0, u0, p0) = rawe.benchmark.benchmarkModels['pendulum']
+    dae = makeDae()
+    x0 = rawe.benchmark._vector(dae.xNames(), x0)
+    u0 = rawe.benchmark._vector(dae.uNames(), u0)
+    p0 = rawe.benchmark._vector(dae.pNames(), p0)
+    maxSubsteps = 16
+    numSteps = 500
+
+    fixedOpts = RtIntegratorOptions()
+    fixedOpts['INTEGRATOR_TYPE'] = 'INT_IRK_GL4'
+    fixedOpts['NUM_INTEGRATOR_STEPS'] = maxSubsteps
+    fixed = RtIntegrator(dae, ts, options=fixedOpts)
+
+    adaptiveOpts = RtIntegratorOptions()
+    adaptiveOpts['INTEGRATOR_TYPE'] = 'INT_IRK_GL4'
+    adaptive = AdaptiveRtIntegrator(dae, ts, options=adaptiveOpts, maxSubsteps=maxSubsteps)
+
+    # export everything before timing
+    timeSteps(fixed, x0, u0, p0, 1)
+    timeSteps(adaptive, x0, u0, p0, 1)
+    adaptive.resetWork()
+
+    (fixedTime, xFixed) = timeSteps(fixed, x0, u0, p0, numSteps)
+    (adaptiveTime, xAdaptive) = timeSteps(adaptive, x0, u0, p0, numSteps)
+    print "fixed step, %d substeps:   %.2f us/step" % (maxSubsteps, 1e6*fixedTime)
+    print "adaptive, <= %d substeps:  %.2f us/step" % (maxSubsteps, 1e6*adaptiveTime)
+    print "adaptive work: "+str(adaptive.work)
+    print "difference of the final states: "+str(numpy.max(numpy.abs(xFixed - xAdaptive)))
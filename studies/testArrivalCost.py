@@ -0,0 +1,101 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+# check the square root arrival cost update of MheRT.propagateArrivalCost against
+# the covariance form update, on a small MHE
+
+import numpy
+import casadi as C
+
+import rawe
+
+def makeDae():
+    dae = rawe.dae.Dae()
+    [pos,vel] = dae.addX( ["pos","vel"] )
+    force = dae.addU( "force" )
+    dae.setResidual([dae.ddt('pos') - vel,
+                     dae.ddt('vel') - (force - 0.14*pos - 0.2*vel)])
+    return dae
+
+def covarianceForm(integrator, x, u, yL, xL, PL, VL, WL):
+    '''
+    The arrival cost update with the linearization at (x,u), in covariance form:
+    posterior covariance of (xL,uL) given the prior and the measurement yL, propagated
+    through the linearized dynamics plus the process noise covariance.
+    Returns the new information matrix PL1^T PL1 and xL1.
+    '''
+    nx = x.size
+    nu = u.size
+    integrator.x = x
+    integrator.u = u
+    integrator.step()
+    J = numpy.hstack((integrator.dx1_dx0, integrator.dx1_du))
+    H = numpy.hstack((integrator.dh_dx0, integrator.dh_du))
+    xu = numpy.concatenate((x, u))
+    xTilde = integrator.x - numpy.dot(J, xu)
+    hTilde = integrator.h - numpy.dot(H, xu)
+
+    prior = numpy.zeros((nx+nu, nx+nu))
+    prior[:nx,:nx] = numpy.dot(PL.T, PL)
+    V = numpy.dot(VL.T, VL)
+    sigma = numpy.linalg.inv(prior + numpy.dot(H.T, numpy.dot(V, H)))
+    mean = numpy.dot(sigma, numpy.dot(prior, numpy.concatenate((xL, numpy.zeros(nu)))) +
+                            numpy.dot(H.T, numpy.dot(V, yL - hTilde)))
+    P1 = numpy.dot(J, numpy.dot(sigma, J.T)) + numpy.linalg.inv(numpy.dot(WL.T, WL))
+    return (numpy.linalg.inv(P1), xTilde + numpy.dot(J, mean))
+
+if __name__=='__main__':
+    N = 10
+    ts = 0.1
+    dae = makeDae()
+    mhe = rawe.Mhe(dae, N=N, ts=ts)
+    mhe.minimizeLsq(C.veccat([mhe.yx, mhe.yu]))
+    mhe.minimizeLsqEndTerm(mhe.yx)
+
+    intOpts = rawe.RtIntegratorOptions()
+    intOpts['INTEGRATOR_TYPE'] = 'INT_IRK_GL4'
+    intOpts['NUM_INTEGRATOR_STEPS'] = 5
+    ocpOpts = rawe.OcpExportOptions()
+    ocpOpts['QP_SOLVER'] = 'QP_QPOASES'
+    mhert = rawe.MheRT(mhe, ocpOptions=ocpOpts, integratorOptions=intOpts)
+
+    # the same integrator as MheRT's, for the full jacobians
+    integrator = rawe.RtIntegrator(dae, ts=ts, options=intOpts,
+                                   measurements=C.veccat([mhe.yx, mhe.yu]))
+
+    numpy.random.seed(0)
+    xL = numpy.array([0.2, -0.1])
+    PL = numpy.array([[2.0, 0.3], [0.0, 1.5]])
+    VL = numpy.diag([10.0, 5.0, 2.0])
+    WL = numpy.diag([20.0, 8.0])
+    mhert.setupArrivalCost(xL, PL, VL, WL)
+
+    for k in range(5):
+        mhert.x[0,:] = numpy.random.randn(2)
+        mhert.u[0,:] = numpy.random.randn(1)
+        mhert.y[0,:] = numpy.random.randn(3)
+        (info, xL1) = covarianceForm(integrator, mhert.x[0,:], mhert.u[0,:], mhert.y[0,:],
+                                     xL, PL, VL, WL)
+        (PL, xL) = mhert.propagateArrivalCost()
+        PL = numpy.copy(PL)
+        xL = numpy.copy(xL)
+
+        infoErr = numpy.max(numpy.abs(numpy.dot(PL.T, PL) - info))/numpy.max(numpy.abs(info))
+        xErr = numpy.max(numpy.abs(xL - xL1))/max(numpy.max(numpy.abs(xL1)), 1.0)
+        print "update %d: relative error of PL^T PL %.3g, of xL %.3g" % (k, infoErr, xErr)
+        assert infoErr < 1e-10 and xErr < 1e-10, "square root and covariance form disagree"
+    print "square root arrival cost matches the covariance form"
@@ -0,0 +1,100 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+# the build cache must never delete an entry which is being built, is loaded by
+# some process, or was built against by another cached entry
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+from rawe.utils import buildcache, buildscheduler, codegen
+
+def useCacheDir(path):
+    codegen.rawesomeDataPath = path
+    buildcache.indexPath = os.path.join(path, 'index.json')
+    buildcache.lockPath = os.path.join(path, 'index.lock')
+    buildscheduler.locksPath = os.path.join(path, 'locks')
+
+def fakeEntry(name, dependencies=[]):
+    path = os.path.join(codegen.rawesomeDataPath, name)
+    os.makedirs(path)
+    with open(os.path.join(path, 'product'), 'w') as f:
+        f.write('x'*1000)
+    with buildcache._CacheIndex() as index:
+        index.insert(path, ['product'], [os.path.join(codegen.rawesomeDataPath, d)
+                                         for d in dependencies])
+    return path
+
+def holdInUse(path, ready, done):
+    buildscheduler.markInUse(path)
+    ready.set()
+    done.wait()
+
+def evict():
+    with buildcache._CacheIndex() as index:
+        index.evict(keep='')
+        return sorted(index.data['entries'].keys())
+
+if __name__=='__main__':
+    tmpdir = tempfile.mkdtemp()
+    try:
+        useCacheDir(tmpdir)
+        buildcache.maxCacheBytes = 0
+
+        lib = fakeEntry('qpoases_lib__0')
+        ocp = fakeEntry('ocp__0', dependencies=['qpoases_lib__0'])
+        other = fakeEntry('outputs__0')
+
+        # another process has both the ocp and the outputs loaded
+        ready = multiprocessing.Event()
+        done = multiprocessing.Event()
+        p = multiprocessing.Process(target=holdInUse, args=(ocp, ready, done))
+        p.start()
+        ready.wait()
+        buildscheduler.markInUse(other)
+
+        assert evict() == ['ocp__0', 'outputs__0', 'qpoases_lib__0']
+        for path in [lib, ocp, other]:
+            assert os.path.exists(path), path+' was removed while in use'
+
+        # being built
+        with buildscheduler.BuildLock(lib):
+            done.set()
+            p.join()
+            # outputs__0 is still in use by this process
+            assert evict() == ['outputs__0', 'qpoases_lib__0']
+            assert not os.path.exists(ocp)
+            assert os.path.exists(lib), 'qpoases_lib__0 was removed while being built'
+
+        # nothing depends on the library any more
+        assert evict() == ['outputs__0']
+        assert not os.path.exists(lib)
+        assert os.path.exists(other)
+
+        # dependencies get recorded by memoizeBuild
+        makefile = 'all :\n\techo built > product\n'
+        built = buildcache.memoizeBuild({'Makefile':makefile}, ['product'], prefix='dep__')
+        dependent = buildcache.memoizeBuild({'Makefile':makefile+'# uses '+built+'\n'}, ['product'],
+                                            prefix='dependent__', dependencies=[built])
+        with buildcache._CacheIndex() as index:
+            assert index.data['entries'][os.path.basename(dependent)]['dependencies'] == \
+                [os.path.basename(built)]
+        print "build cache eviction test passed"
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,61 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+# export the same model with and without LINEAR_INPUT and check that one step
+# gives the same states and sensitivities
+
+import numpy
+import casadi as C
+
+import rawe
+from rawe import RtIntegrator, RtIntegratorOptions
+from rawe.dae.detectLinearSubsystems import linearInputSubsystem
+
+def makeDae():
+    dae = rawe.dae.Dae()
+    # the actuator state leads, so it can be a linear input subsystem
+    [aileron, pos, vel] = dae.addX( ["aileron", "pos", "vel"] )
+    daileron = dae.addU( "daileron" )
+    dae.setResidual([dae.ddt('aileron') + 2.0*aileron - daileron,
+                     dae.ddt('pos') - vel,
+                     dae.ddt('vel') - (aileron - 3.0*C.sin(pos) - 0.2*vel)])
+    return dae
+
+def step(linearInput):
+    dae = makeDae()
+    opts = RtIntegratorOptions()
+    opts['INTEGRATOR_TYPE'] = 'INT_IRK_GL4'
+    opts['NUM_INTEGRATOR_STEPS'] = 5
+    opts['LINEAR_INPUT'] = linearInput
+    integrator = RtIntegrator(dae, ts=0.05, options=opts)
+    integrator.x = numpy.array([0.1, 0.5, -0.3])
+    integrator.u = numpy.array([0.7])
+    integrator.step()
+    return integrator
+
+if __name__=='__main__':
+    subsystem = linearInputSubsystem(makeDae())
+    assert subsystem is not None and subsystem['n1'] == 1, \
+        "aileron should be a linear input subsystem, got: "+str(subsystem)
+
+    full = step(False)
+    linear = step(True)
+    for name in ['x','dx1_dx0','dx1_du']:
+        err = numpy.max(numpy.abs(getattr(full, name) - getattr(linear, name)))
+        print name+' max difference: '+str(err)
+        assert err < 1e-8, name+" differs with LINEAR_INPUT: "+str(err)
+    print "LINEAR_INPUT matches the full model"
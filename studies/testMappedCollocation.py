@@ -0,0 +1,65 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+# check that setupCollocation(tf, mapped=True) gives the same constraints as the loops
+
+import numpy
+import casadi as C
+
+import rawe
+
+def makeConstraintFunctions(mapped):
+    dae = rawe.models.pendulum2()
+    dae.addP('endTime')
+    ocp = rawe.collocation.Coll(dae, nk=5, nicp=2, deg=3, collPoly='RADAU')
+    ocp.setupCollocation(ocp.lookup('endTime'), mapped=mapped)
+
+    V = ocp._dvMap.vectorize()
+    g = C.MXFunction([V], [ocp._constraints.getG()])
+    g.init()
+    jac = g.jacobian(0,0)
+    jac.init()
+    return (ocp, g, jac)
+
+def evaluate(f, v):
+    f.setInput(v)
+    f.evaluate()
+    return C.DMatrix(f.output())
+
+if __name__=='__main__':
+    (ocp, gLoops, jacLoops) = makeConstraintFunctions(False)
+    (_, gMapped, jacMapped) = makeConstraintFunctions(True)
+
+    numpy.random.seed(0)
+    for trial in range(5):
+        v = numpy.random.randn(ocp.getNV())
+        # the parameters (m, endTime) come first, keep them away from 0
+        v[:ocp.pSize()] = 0.5 + numpy.abs(v[:ocp.pSize()])
+        g0 = numpy.array(evaluate(gLoops, v))
+        g1 = numpy.array(evaluate(gMapped, v))
+        assert g0.shape == g1.shape, str(g0.shape)+' != '+str(g1.shape)
+        err = numpy.max(numpy.abs(g0 - g1))
+        assert err < 1e-12, 'constraint values differ by '+str(err)
+
+        j0 = evaluate(jacLoops, v)
+        j1 = evaluate(jacMapped, v)
+        s0 = numpy.array(C.DMatrix(j0.sparsity(), 1))
+        s1 = numpy.array(C.DMatrix(j1.sparsity(), 1))
+        assert s0.shape == s1.shape and numpy.all(s0 == s1), 'jacobian sparsity differs'
+        err = numpy.max(numpy.abs(numpy.array(j0) - numpy.array(j1)))
+        assert err < 1e-10, 'jacobians differ by '+str(err)
+    print 'mapped and looped collocation constraints match'
@@ -0,0 +1,58 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+# a closed loop run whose controller replays a control sequence has to give the
+# same trajectories as the open loop run with that sequence, including the
+# algebraic state guesses which are carried from one step to the next
+
+import numpy
+import casadi as C
+
+import rawe
+from rawe import MonteCarlo, RtIntegratorOptions
+
+def makeDae():
+    dae = rawe.dae.Dae()
+    [pos, vel] = dae.addX( ["pos", "vel"] )
+    acc = dae.addZ( "acc" )
+    force = dae.addU( "force" )
+    dae.setResidual([dae.ddt('pos') - vel,
+                     dae.ddt('vel') - acc,
+                     acc + 0.1*acc*acc*acc - (force - 3.0*C.sin(pos) - 0.2*vel)])
+    return dae
+
+if __name__=='__main__':
+    opts = RtIntegratorOptions()
+    opts['INTEGRATOR_TYPE'] = 'INT_IRK_RIIA3'
+    opts['NUM_INTEGRATOR_STEPS'] = 2
+    mc = MonteCarlo(makeDae(), ts=0.1, options=opts, numProcesses=2)
+
+    M = 6
+    N = 40
+    numpy.random.seed(0)
+    x0s = numpy.random.randn(M, 2)
+    Us = numpy.random.randn(M, N, 1)
+
+    openLoop = mc.run(x0s, Us)
+    closedLoop = mc.run(x0s, N, controller=lambda x, k, m: Us[m,k,:])
+    assert openLoop['failed'] == [] and closedLoop['failed'] == []
+
+    assert numpy.all(closedLoop['u'] == Us)
+    err = numpy.max(numpy.abs(openLoop['x'] - closedLoop['x']))
+    print 'max difference between open and closed loop: '+str(err)
+    assert err < 1e-12, "closed loop differs from open loop: "+str(err)
+    print "closed loop matches open loop"
@@ -0,0 +1,95 @@
+# Copyright 2012-2013 Greg Horn
+#
+# This file is part of rawesome.
+#
+# rawesome is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# rawesome is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with rawesome.  If not, see <http://www.gnu.org/licenses/>.
+
+# every way of writing to an OcpRT field has to either mark it dirty (so _setAll
+# sends it to the solver) or raise, never write silently
+
+import numpy
+
+from rawe.ocp.ocprt import _tracked
+
+def fresh():
+    a = _tracked(numpy.zeros((3,4)))
+    a._dirty = False
+    return a
+
+def assertMarks(name, write):
+    a = fresh()
+    write(a)
+    assert a._dirty, name+" didn't mark the field dirty"
+    assert numpy.any(a != 0), name+" didn't write"
+    print name+': marked dirty'
+
+def assertRaises(name, write):
+    a = fresh()
+    try:
+        write(a)
+    except ValueError:
+        assert not a._dirty and numpy.all(a == 0)
+        print name+': raises'
+        return
+    raise Exception(name+" wrote to a field without marking it dirty")
+
+def assertReadOnly(name, read):
+    a = fresh()
+    read(a)
+    assert not a._dirty, name+" marked the field dirty without writing"
+    print name+': stays clean'
+
+if __name__=='__main__':
+    def setitem(a): a[0,1] = 1.0
+    def viewSetitem(a): a[0,:][1] = 1.0
+    def viewOfView(a): a[1:,:][0][2] = 1.0
+    def transpose(a): a.T[1,0] = 1.0
+    def reshape(a): a.reshape(12)[5] = 1.0
+    def setslice(a): a[1:2] = 1.0
+    def iadd(a): a += 1.0
+    def itemIadd(a): a[0] *= 2.0; a[0] += 1.0
+    assertMarks('item assignment', setitem)
+    assertMarks('view item assignment', viewSetitem)
+    assertMarks('view of a view', viewOfView)
+    assertMarks('transposed view', transpose)
+    assertMarks('reshaped view', reshape)
+    assertMarks('slice assignment', setslice)
+    assertMarks('in-place operator', iadd)
+    assertMarks('in-place operator on a row', itemIadd)
+    assertMarks('fill', lambda a: a.fill(1.0))
+    assertMarks('ufunc out=', lambda a: numpy.add(a, 1.0, out=a))
+    assertMarks('ufunc out= a view', lambda a: numpy.multiply(numpy.ones(4), 2.0, out=a[1]))
+    assertMarks('ufunc reduce out=', lambda a: numpy.add.reduce(numpy.ones((2,4)), axis=0, out=a[2]))
+
+    # numpy.copyto can only be intercepted where numpy dispatches __array_function__
+    a = fresh()
+    try:
+        numpy.copyto(a, numpy.ones((3,4)))
+        assert a._dirty and numpy.all(a == 1), "copyto didn't mark the field dirty"
+        print 'numpy.copyto: marked dirty'
+    except ValueError:
+        assert not a._dirty and numpy.all(a == 0)
+        print 'numpy.copyto: raises (no __array_function__ dispatch in this numpy)'
+
+    # plain ndarray views can't be tracked
+    assertRaises('numpy.asarray view', lambda a: numpy.asarray(a).__setitem__(0, 1.0))
+    assertRaises('ndarray view', lambda a: a.view(numpy.ndarray).fill(1.0))
+    def flat(a): a.flat[3] = 1.0
+    assertRaises('flat', flat)
+
+    assertReadOnly('arithmetic', lambda a: a + 1.0)
+    assertReadOnly('numpy.dot', lambda a: numpy.dot(a, numpy.ones(4)))
+    assertReadOnly('numpy.sum', lambda a: numpy.sum(a))
+    assertReadOnly('copy', lambda a: numpy.copy(a).fill(1.0))
+    print "all write paths are tracked"
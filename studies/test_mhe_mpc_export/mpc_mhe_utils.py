@@ -28,31 +28,9 @@ import matplotlib.pyplot as plt
 
 import casadi as C
 import rawe
+from rawe.ocp import dlqr
 
 
-def dlqr(A, B, Q, R, N=None):
-
-    if N == None:
-        N = np.zeros((Q.shape[0],R.shape[0]))
-
-    P = scipy.linalg.solve_discrete_are(A, B, Q, R)
-
-#    nx = A.shape[0]
-#    nu = B.shape[1]
-#    PL = np.eye(nx)
-#    for k in range(10):
-#        M = np.bmat([[             Q, np.zeros((nx,nu)), np.zeros((nx,nx)) ],
-#                     [             0,                 R, np.zeros((nu,nx)) ],
-#                     [ -np.dot(PL,A),     -np.dot(PL,B),                PL ]])
-#        np.linalg.inv(np.dot(M.T,M))*M.T
-
-
-    k1 = np.dot(np.dot(B.T, P), B) + R
-    k2 = np.dot(np.dot(B.T, P), A)
-    K = np.linalg.solve(k1,k2)
-
-    return K, P
-
 def ComputeTerminalCost(integrator, xlin, ulin, Q, R, N=None):
 
     integrator.x = xlin
@@ -104,9 +82,11 @@ def UpdateArrivalCost(integrator, x, u, xL, yL, PL, VL, WL):
     integrator.u = u
     out = integrator.getOutputs()
     h = np.squeeze(out['measurements'])
-    x1 = integrator.step()
-    Xx = integrator.dx1_dx0
-    Xu = integrator.dx1_du
+    # only d(x1)/d(x,u) is needed, not d(x1)/dp or z
+    nP = integrator.p.size
+    x1 = integrator.step(sensitivities=np.eye(nx+nu+nP)[:,:nx+nu])
+    Xx = integrator.dx1_dseed[:,:nx]
+    Xu = integrator.dx1_dseed[:,nx:]
 
     Hx = np.diag([1,0])
     Hu = np.array([[0,1]]).T